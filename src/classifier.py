@@ -4,11 +4,13 @@
 # Compares texts with the classifier.
 #
 
-import pickle
-import kyotocabinet as kc
+import codec
+import knn
+import storage
 import kyotocabinetutil as kc_util
 
 from Stemmer import Stemmer
+from array import array
 from collections import Counter
 from math import sqrt, log
 from nltk.corpus import stopwords
@@ -24,7 +26,8 @@ if __name__ == "__main__":
 
 from settings import DICTIONARY_DB_FILENAME, \
         VECTOR_DB_FILENAME, VECTORS_NORM_DB_FILENAME, \
-        CLASSIFIER_STATE_FILENAME, K_ITEM, MIN_COS_SINE
+        CLASSIFIER_STATE_FILENAME, K_ITEM, MIN_COS_SINE, NORMALIZED_VECTORS, \
+        KNN_ENGINE
 
 class CleanTextUtil:
     """ Utility for cleaning text by using stop words and stemming.
@@ -99,7 +102,7 @@ class CleanTextUtil:
         return words
 
 
-class WordInfo:
+class WordInfo(object):
     """ A word info object contains information about a word.
 
     The object is stored in the main dictionary of words.
@@ -113,6 +116,8 @@ class WordInfo:
         idf (float): The inverse document frequency (idf), defaults is 0.0.
 
     """
+    __slots__ = ("word", "index", "number", "idf")
+
     def __init__(self, word, index):
         """ Sets the word and his index.
 
@@ -134,15 +139,55 @@ class WordInfo:
                "idf       : %s" % \
            (self.word, self.index, self.number, self.idf))
 
+codec.register(3, WordInfo, WordInfo.__slots__)
+
+
+class Vector(object):
+    """ A vector of words stored as parallel arrays sorted by word index.
+
+    The words are given by their index in the dictionary, so the scalar
+    product of two vectors only walks the arrays (see Classifier.scalar_product).
+    The weights are the tf-idf of the words, updated with the idf by
+    Classifier.set_tfidf_norm.
+
+    Attributes:
+        indexes (array of int): The indexes of the words, increasing.
+        tfs (array of float): The term frequencies (tf) of the words.
+        weights (array of float): The tf-idf of the words.
+        tag (str): The tag of the vector.
+
+    """
+    __slots__ = ("indexes", "tfs", "weights", "tag")
+
+    def __init__(self, indexes, tfs, weights, tag):
+        """ Initializes all variables of the object.
+
+        Args:
+            indexes (array of int): The indexes of the words, increasing.
+            tfs (array of float): The term frequencies (tf) of the words.
+            weights (array of float): The tf-idf of the words.
+            tag (str): The tag of the vector.
+
+        """
+        self.indexes = indexes
+        self.tfs = tfs
+        self.weights = weights
+        self.tag = tag
 
-class Vector:
-    """ A vector object representing a vector with items. 
+
+class LegacyVector(object):
+    """ A vector stored before the arrays, as a list of vector items.
+
+    The old records are read as legacy vectors and converted to vectors
+    by the classifier (see Classifier.convert_dbs).
 
     Attributes:
         items (list of VectorItem): The list of vector items.
         tag (str): The tag of the vector.
 
     """
+    __slots__ = ("items", "tag")
+
     def __init__(self, items, tag):
         """ Initializes all variables of the object.
 
@@ -155,16 +200,18 @@ class Vector:
         self.tag = tag
 
 
-class VectorItem:
+class VectorItem(object):
     """ A vector item object containing word information used for comparisons.
 
-    The object is an item of a list called a vector.
+    The object is an item of the list of a legacy vector.
 
     Attributes:
         word (str): The word as a simple string.
         tf (float): The term frequency (tf) of the word.
 
     """
+    __slots__ = ("word", "tf")
+
     def __init__(self, word, tf):
         """ Initializes all variables of the object.
 
@@ -202,14 +249,19 @@ class VectorItem:
             WordInfo: The word info object from the dictionary database.
 
         """
-        return pickle.loads(dictionary_db.get(self.word))
+        return codec.loads(dictionary_db.get(self.word))
+
+codec.register(6, Vector, Vector.__slots__)
+# after the vector: the old pickles of "Vector" are legacy vectors
+codec.register(4, LegacyVector, LegacyVector.__slots__, pickle_name="Vector")
+codec.register(5, VectorItem, VectorItem.__slots__)
 
 
 class Classifier:
     """ The class contains useful methods for comparing text.
     
     Step to follow to start:
-    - add text to the dictionary (add_text())
+    - add text to the dictionary (add_text(), or add_texts() for many texts)
     - evaluate the idf (add_idf()) 
     
     Examples:
@@ -243,53 +295,81 @@ class Classifier:
     More about the databases (with key/value):
     - A dictionary containing words information.
      - the key is a word 
-     - the value is a WordInfo object serialized.
+     - the value is a WordInfo object serialized (see codec).
 
     - Multiple vectors of text.
      - the key is the name of a vector
-     - the value is a serialized list of VectorItem.
+     - the value is a serialized Vector (arrays of word indexes and tf-idf weights).
 
-    - Multiple vectors norm.
+    - Multiple vectors norm (not used with normalized vectors).
      - the key is the name of a vector.
      - the value is a vector norm as string.
 
     - State of the classifier.
      - the key is a variable to store.
      - the value is the value of the variable.
+     (the number of texts "text_nb", the last event of the collector 
+     processed "events_watermark", "1" for "normalized" if the weights
+     of the vectors are normalized, "1" for "postings" if the postings
+     of the vectors are up to date)
+
+    - Postings of the vectors (with the "postings" kNN engine, see PostingsIndex).
+
+    With normalized vectors, the tf-idf weights of a vector are divided by
+    its norm: the norm of each vector is 1 and the cosine similarity is
+    the scalar product of the vectors, the norms are not stored.
 
     Attributes:
         clean_text_util (CleanTextUtil): The CleanTextUtil object used to transformed words.
         dictionary_db (kyotocabinet.DB): A dictionary containing words information.
         vectors_db (kyotocabinet.DB): Multiple vectors of text.
-        vectors_norm_db (kyotocabinet.DB): Multiple vectors norm.
+        vectors_norm_db (kyotocabinet.DB): Multiple vectors norm (None with normalized vectors).
         classifier_state_db (kyotocabinet.DB): State of the classifier.
         word_index (int): Number of words in the dictionary (defaults is the number of words).
+        normalized (bool): True if the weights of the vectors are normalized.
+        engine (str): The kNN engine, "postings" or "matrix".
+        postings (PostingsIndex): The vectors by word (None with the "matrix" engine).
+        knn_engine (KNNEngine): The reference vectors of the last kNN (None before the first kNN).
     
     """
-    def __init__(self, clean_text_util):
-        """ Open or create three databases and set the provided cleaner object.
+    def __init__(self, clean_text_util, normalized=NORMALIZED_VECTORS, engine=KNN_ENGINE):
+        """ Open or create the databases and set the provided cleaner object.
+
+        The vectors stored in the other mode are converted.
         
         Args:
             clean_text_util (CleanTextUtil): The CleanTextUtil object used to transformed words.
+            normalized (bool, optional): True to store normalized vectors
+                (defaults is NORMALIZED_VECTORS).
+            engine (str, optional): The kNN engine, "postings" or "matrix"
+                (defaults is KNN_ENGINE).
 
         """
         self.clean_text_util = clean_text_util
+        self.normalized = normalized
+        self.engine = engine
+        self.knn_engine = None
+        self.postings = knn.PostingsIndex() if engine == "postings" else None
+        self.__compares = None
 
-        self.dictionary_db = kc.DB()
+        self.dictionary_db = storage.new_db()
         self.dictionary_db.open(DICTIONARY_DB_FILENAME, 
-                          kc.DB.OWRITER | kc.DB.OCREATE)
+                          storage.OWRITER | storage.OCREATE)
         
-        self.vectors_db = kc.DB()
+        self.vectors_db = storage.new_db()
         self.vectors_db.open(VECTOR_DB_FILENAME, 
-                            kc.DB.OWRITER | kc.DB.OCREATE)
+                            storage.OWRITER | storage.OCREATE)
         
-        self.vectors_norm_db = kc.DB()
-        self.vectors_norm_db.open(VECTORS_NORM_DB_FILENAME, 
-                            kc.DB.OWRITER | kc.DB.OCREATE)
-
-        self.classifier_state_db = kc.DB()
+        if normalized:
+            self.vectors_norm_db = None
+        else:
+            self.vectors_norm_db = storage.new_db()
+            self.vectors_norm_db.open(VECTORS_NORM_DB_FILENAME, 
+                                storage.OWRITER | storage.OCREATE)
+
+        self.classifier_state_db = storage.new_db()
         self.classifier_state_db.open(CLASSIFIER_STATE_FILENAME, 
-                            kc.DB.OWRITER | kc.DB.OCREATE)
+                            storage.OWRITER | storage.OCREATE)
 
         # set the total number of documents in the corpus
         if not self.classifier_state_db.get("text_nb"): 
@@ -297,6 +377,21 @@ class Classifier:
 
         # Current number of words in the dictionary
         self.word_index = len(self.dictionary_db)
+
+        # convert the vectors stored in the other mode
+        mode = "1" if normalized else "0"
+        if (self.classifier_state_db.get("normalized") or "0") != mode:
+            logging.info("convert the vectors (normalized: %s)" % normalized)
+            self.__reweight_vectors()
+            self.classifier_state_db.set("normalized", mode)
+
+        # index the vectors added without postings
+        if self.postings is not None and self.classifier_state_db.get("postings") != "1":
+            logging.info("index the postings of the vectors")
+            self.postings.clear()
+            for name, vector in self.get_vectors():
+                self.postings.add(name, vector)
+        self.classifier_state_db.set("postings", "1" if self.postings is not None else "0")
         
     def add_text(self, text):
         """ Adds a new text to the dictionary.
@@ -305,46 +400,221 @@ class Classifier:
             text (str): A text to feed the dictionary.
 
         """
-        words = self.clean_text_util.clean_text(text)
-        # remove duplicate word
-        words = set(words) 
+        self.add_texts([text])
+
+    def add_texts(self, texts):
+        """ Adds many texts to the dictionary with a single write.
+
+        The numbers of documents of the words are counted in memory and the
+        dictionary is written with one transaction at the end: the words get
+        the same information as with add_text for each text, in a fraction of
+        the time for a large corpus.
+
+        Args:
+            texts (iterable of str): The texts to feed the dictionary.
+
+        Returns:
+            int: The number of texts added.
+
+        Raises:
+            IOError: The dictionary can't be written.
+
+        """
+        texts_added = [0]
+
+        def gen_words():
+            for text in texts:
+                texts_added[0] += 1
+                # remove duplicate word
+                yield set(self.clean_text_util.clean_text(text))
+
+        self.__count_words(gen_words())
+
+        text_nb = int(self.classifier_state_db.get("text_nb"))
+        text_nb += texts_added[0]
+        self.classifier_state_db.replace("text_nb", str(text_nb)) 
+
+        return texts_added[0]
+
+    def extend_text(self, name, text):
+        """ Adds the new words of a text already in the dictionary.
+
+        The text is the text of a vector with more words (new items of a feed).
+        Only the words not in the vector are counted, the number of texts 
+        doesn't change.
+
+        Args:
+            name (str): The name of the vector of the text.
+            text (str): The whole text.
+
+        """
+        words = set(self.clean_text_util.clean_text(text))
+
+        vector = self.get_vector(name)
+        if vector and words:
+            # the words of the vector are known by their index
+            indexes = set(vector.indexes)
+            words -= set(word_info.word for word_info in
+                         kc_util.get_bulk(self.dictionary_db, words).values()
+                         if word_info.index in indexes)
+
+        self.__count_words([words])
+
+    def rm_texts(self, names):
+        """ Removes the texts of vectors from the dictionary.
+
+        The words of a vector are the words counted for its text: their
+        numbers of documents and the number of texts are decremented, the
+        words left in no text are removed. The vectors are not removed
+        (see rm_vector) and the idf must be set again.
+
+        Args:
+            names (iterable of str): The names of the vectors of the texts.
+
+        Returns:
+            int: The number of texts removed.
+
+        Raises:
+            IOError: The dictionary can't be written.
+
+        """
+        counts = Counter()
+        texts_removed = 0
+        for name in names:
+            vector = self.get_vector(name)
+            if vector:
+                counts.update(vector.indexes)
+                texts_removed += 1
+
+        if not texts_removed:
+            return 0
+
+        # the dictionary is keyed by word, the words are found by their index
+        records, keys = {}, []
+        for word, word_info in kc_util.gen_db(self.dictionary_db.cursor()):
+            if word_info.index in counts:
+                word_info.number -= counts[word_info.index]
+                if word_info.number > 0:
+                    records[word] = codec.dumps(word_info)
+                else:
+                    keys.append(word)
+
+        kc_util.set_bulk(self.dictionary_db, records)
+        if keys and self.dictionary_db.remove_bulk(keys, True) < 0:
+            raise IOError("can't remove the words: %s" % self.dictionary_db.error())
+
+        text_nb = int(self.classifier_state_db.get("text_nb"))
+        text_nb = max(text_nb - texts_removed, 0)
+        self.classifier_state_db.replace("text_nb", str(text_nb))
+
+        return texts_removed
+
+    def __count_words(self, documents):
+        """ Counts the documents of words in the dictionary.
+
+        The new words get the next indexes, in the order they are found.
+
+        Args:
+            documents (iterable of set of str): The words of each document.
+
+        Raises:
+            IOError: The dictionary can't be written.
+
+        """
+        counts = Counter()
+        new_words = []
+        for words in documents:
+            for word in words:
+                if word not in counts:
+                    new_words.append(word)
+                counts[word] += 1
+
+        if not counts:
+            return
+
+        # the words already in the dictionary are read at once
+        word_infos = dict((word_info.word, word_info) for word_info in
+                          kc_util.get_bulk(self.dictionary_db, counts.keys()).values())
 
         # for each word:
         # - if the word already exist in the dictionary we update the occurrence
-        # - otherwise we add a new word with his index to the dictionary 
-        for word in words:
-            word_info_pickle = self.dictionary_db.get(word)
-            if word_info_pickle:
-                word_info = pickle.loads(word_info_pickle)
-                word_info.number += 1
-                self.dictionary_db.replace(word, pickle.dumps(word_info))
-
+        # - otherwise we add a new word with his index to the dictionary 
+        records = {}
+        for word in new_words:
+            word_info = word_infos.get(word)
+            if word_info:
+                word_info.number += counts[word]
             else:
-                new_word_info = WordInfo(word, self.word_index)
-                self.dictionary_db.add(word, pickle.dumps(new_word_info))
+                word_info = WordInfo(word, self.word_index)
+                word_info.number = counts[word]
                 self.word_index += 1
-        
-        text_nb = int(self.classifier_state_db.get("text_nb"))
-        text_nb += 1
-        self.classifier_state_db.replace("text_nb", str(text_nb)) 
+            records[word] = codec.dumps(word_info)
+
+        kc_util.set_bulk(self.dictionary_db, records)
     
     def set_idf(self):
         """ Updates by adding the inverse document frequency (idf) for each word.
 
+        With normalized vectors, the vectors are normalized again with the new idf.
+
         """
         for word, word_info in kc_util.gen_db(self.dictionary_db.cursor()):
             word_info.idf = self.idf(word_info.number)
-            self.dictionary_db.replace(word, pickle.dumps(word_info))
+            self.dictionary_db.replace(word, codec.dumps(word_info))
+
+        if self.normalized:
+            self.__reweight_vectors()
 
     def set_tfidf_norm(self):
-        """ Updates vectors tf-idf norm.
+        """ Updates vectors tf-idf weights and norm.
         
-        The idf is the inverse document frequency.
+        The idf is the inverse document frequency, the weights of the vectors
+        are updated with the idf of set_idf.
+        With normalized vectors, the weights are already updated by set_idf.
 
         """
+        if not self.normalized:
+            self.__reweight_vectors()
+
+    def __reweight_vectors(self):
+        """ Updates the tf-idf weights of the vectors with the idf of the dictionary.
+
+        The weights are normalized or the norms are stored, according to the mode.
+
+        """
+        idfs = dict((word_info.index, word_info.idf) for _, word_info
+                    in kc_util.gen_db(self.dictionary_db.cursor()))
+
+        self.knn_engine = None
         for name, vector in self.get_vectors():
-            norm = self.vector_tfidf_norm(vector.items)
-            self.vectors_norm_db.replace(name, norm)
+            vector.weights = self.__weights(vector.tfs,
+                                            [idfs.get(index, 0.) for index in vector.indexes])
+            self.vectors_db.replace(name, codec.dumps(vector))
+            if self.postings is not None:
+                self.postings.add(name, vector)
+
+            if not self.normalized:
+                norm = self.vector_tfidf_norm(vector)
+                # the vectors added with normalized weights have no norm yet
+                self.vectors_norm_db.set(name, norm)
+
+    def __weights(self, tfs, idfs):
+        """ Returns the tf-idf weights, divided by their norm with normalized vectors.
+
+        Args:
+            tfs (list of float): The term frequencies.
+            idfs (list of float): The idf of the words.
+
+        Returns:
+            array: The tf-idf weights.
+
+        """
+        weights = array("d", (tf * idf for tf, idf in zip(tfs, idfs)))
+        if self.normalized:
+            norm = sqrt(sum([weight**2 for weight in weights]))
+            if norm:
+                weights = array("d", (weight / norm for weight in weights))
+        return weights
  
     def add_vector(self, name, text, tag=None):
         """ Adds a new vector of words to the database.  
@@ -356,37 +626,70 @@ class Classifier:
         
         """
         words = self.clean_text_util.clean_text(text)
+        if not words:
+            logging.debug("no word for the vector %s" % name)
+            return
      
         # max{f(w,d) : w ∈ d)}
         counter = Counter(words)
         _, max_occ = counter.most_common(1)[0] 
 
-        # remove duplicate word
-        words = set(words)
-        
-        items = []
-        for word in words:
-            pickle_wordinfo = self.dictionary_db.get(word)
-            if not pickle_wordinfo:
-                continue
-            
-            word_info = pickle.loads(pickle_wordinfo)
+        # tf formula: tf(f,d) = f(f,d)/max{f(w,d) : w ∈ d)} (src Wikipedia)
+        tfs = dict((word, occ / float(max_occ)) for word, occ in counter.items())
+
+        # finally, we create a new vector
+        vector = self.__new_vector(tfs, tag)
+        if not self.vectors_db.add(name, codec.dumps(vector)):
+            logging.debug("the vector %s exists" % name)
+            return
 
-            # tf formula: tf(f,d) = f(f,d)/max{f(w,d) : w ∈ d)} (src Wikipedia)
-            tf = counter[word]/float(max_occ)
+        if self.postings is not None:
+            self.postings.add(name, vector)
+        self.__forget_vector(name)
 
-            # create a new vector item entry
-            items.append(VectorItem(word, tf))
+        # add an empty entry to the norm db (replaces the norm of a vector
+        # removed with normalized weights)
+        if not self.normalized:
+            self.vectors_norm_db.set(name, self.vector_tfidf_norm(vector))
 
-        # sort the vector item by the dictionary index
-        items.sort(key=lambda x: x.word_info(self.dictionary_db).index)
+    def __new_vector(self, tfs, tag):
+        """ Returns a vector of the words of the dictionary.
 
-        # finally, we create a new vector
-        vector = Vector(items, tag)
-        self.vectors_db.add(name, pickle.dumps(vector))
+        The word infos are read at once, the words missing in the dictionary
+        are skipped.
+
+        Args:
+            tfs (dict): The term frequencies by word.
+            tag (str): The tag/category.
+
+        Returns:
+            Vector: The vector sorted by word index.
+
+        """
+        word_infos = kc_util.get_bulk(self.dictionary_db, tfs.keys()).values()
+        word_infos.sort(key=lambda word_info: word_info.index)
+
+        vector_tfs = array("d", (tfs[word_info.word] for word_info in word_infos))
+        return Vector(array("i", (word_info.index for word_info in word_infos)),
+                      vector_tfs,
+                      self.__weights(vector_tfs, [word_info.idf for word_info in word_infos]),
+                      tag)
+
+    def __upgrade_vector(self, vector):
+        """ Returns the vector of a legacy vector.
+
+        Args:
+            vector (Vector or LegacyVector): The vector read.
+
+        Returns:
+            Vector: The vector.
 
-        # add an empty entry to the norm db
-        self.vectors_norm_db.add(name, self.vector_tfidf_norm(items))
+        """
+        if not isinstance(vector, LegacyVector):
+            return vector
+
+        return self.__new_vector(dict((item.word, float(item.tf)) for item in vector.items),
+                                 vector.tag)
 
     def rm_vector(self, name):
         """ Removes a vector of words from the database.
@@ -396,8 +699,24 @@ class Classifier:
 
         """
         logging.debug("Remove vector %s" % name)
+        vector = self.get_vector(name)
+        if vector and self.postings is not None:
+            self.postings.rm(name, vector)
+
         self.vectors_db.remove(name)
-        self.vectors_norm_db.remove(name)
+        if not self.normalized:
+            self.vectors_norm_db.remove(name)
+        self.__forget_vector(name)
+
+    def __forget_vector(self, name):
+        """ Drops the kNN engine if it has been loaded with a vector that changed.
+
+        Args:
+            name (str): The name of the vector.
+
+        """
+        if self.knn_engine and self.knn_engine.covers(name):
+            self.knn_engine = None
 
     def update_vector_tag(self, u_name, tag):
         """ Updates a vector's tag.
@@ -409,12 +728,60 @@ class Classifier:
         """
         vector = self.get_vector(u_name)
         vector.tag = tag
-        self.vectors_db.replace(u_name, pickle.dumps(vector)) 
+        self.vectors_db.replace(u_name, codec.dumps(vector)) 
+        self.__forget_vector(u_name)
+
+    def set_watermark(self, seq):
+        """ Stores the sequence number of the last event of the collector processed.
+
+        Args:
+            seq (int): Sequence number of the event.
+
+        """
+        self.classifier_state_db.set("events_watermark", str(seq))
+
+    def convert_dbs(self):
+        """ Converts the words and the vectors stored with pickle to the binary format.
+
+        The legacy vectors (lists of vector items) are also converted to arrays.
+
+        Returns:
+            int: The number of records converted.
+
+        """
+        converted = kc_util.convert_db(self.dictionary_db) + kc_util.convert_db(self.vectors_db)
+
+        vectors = {}
+        for name, vector in kc_util.gen_db(self.vectors_db.cursor()):
+            if isinstance(vector, LegacyVector):
+                vectors[name] = codec.dumps(self.__upgrade_vector(vector))
+        kc_util.set_bulk(self.vectors_db, vectors)
+        self.knn_engine = None
+
+        return converted + len(vectors)
+
+    def close(self):
+        """ Closes all databases.
+
+        """
+        for db in [self.dictionary_db, self.vectors_db, self.vectors_norm_db,
+                   self.classifier_state_db, self.postings]:
+            if db is not None:
+                db.close()
 
     ###########################################################################
     # Getter
     ###########################################################################
 
+    def get_watermark(self):
+        """ Returns the sequence number of the last event of the collector processed.
+
+        Returns:
+            int: Sequence number of the event, 0 if no event has been processed.
+
+        """
+        return int(self.classifier_state_db.get("events_watermark") or 0)
+
     def get_vector(self, u_name):
         """ Gets a vector from his name.
 
@@ -426,7 +793,7 @@ class Classifier:
 
         """
         try:
-            return pickle.loads(self.vectors_db.get(u_name))
+            return self.__upgrade_vector(codec.loads(self.vectors_db.get(u_name)))
         except TypeError as er:
             logging.debug("%s not exists" % u_name)
             return
@@ -438,19 +805,19 @@ class Classifier:
             tuple (str, Vector): Name of the vector and vector object. 
 
         """
-        return kc_util.gen_db(self.vectors_db.cursor())
+        for name, vector in kc_util.gen_db(self.vectors_db.cursor()):
+            yield name, self.__upgrade_vector(vector)
     
     def get_vectors_name(self):
         """ Returns vector's names.
 
+        Only the keys are read, the vectors are not decoded.
+
         Returns:
             list of str: A list of names.
 
         """
-        vectors_name = []
-        for name, feed in self.get_vectors():
-            vectors_name.append(name)
-        return vectors_name
+        return list(kc_util.gen_keys(self.vectors_db.cursor()))
 
     ###########################################################################
     # Math
@@ -498,49 +865,37 @@ class Classifier:
         Each tf-idf item of the vector is evaluated.
 
         Args:
-            u (list of VectorItem): The vector to work with.
+            u (Vector): The vector to work with.
 
         Returns:
             float: The tf-idf norm calculated.
 
         """
-        return sqrt(sum( [self.tf_idf(item)**2 for item in u] ))
+        return sqrt(sum( [weight**2 for weight in u.weights] ))
     
     def scalar_product(self, u, v):
         """ Returns the tf-idf scalar product of two sparse vectors.
         
         The vector should be sorted by his word index according to increasing values of the key (from low to high values).
-        The complexity is O(len(u)+len(v)) in the worst case.
+        The complexity is O(len(u)+len(v)) in the worst case, the dictionary is not read
+        (the tf-idf weights are in the vectors).
         
         Args:
-            u (list of VectorItem): The u vector.
-            v (list of VectorItem): The v vector.
+            u (Vector): The u vector.
+            v (Vector): The v vector.
 
         Returns:
             float: The tf-idf scalar product.
 
         """
-        sp = 0.0
-        n1 = len(u)
-        n2 = len(v)
-        i = j = 0
-        d = self.dictionary_db
-        while (i < n1 and j < n2):
-            if u[i].word_info(d).index > v[j].word_info(d).index:
-                j += 1
-            elif v[j].word_info(d).index > u[i].word_info(d).index:
-                i += 1
-            else:
-                sp += self.tf_idf(u[i]) * self.tf_idf(v[j])
-                i += 1
-                j += 1
-
-        return sp
+        return knn.scalar_product(u, v)
 
     def cosine_sim(self, u_name, v_name):
         """ Returns the cosine similarity of the angle between vectors u and v.
         
         The formula is: cosine_sim = u.v / |u||v|.
+        With normalized vectors, |u| = |v| = 1: the cosine_sim is u.v
+        (a vector without weight has a null cosine_sim).
 
         Args:
             u_name (str): The u vector name.
@@ -552,19 +907,24 @@ class Classifier:
         """
         u_vector = self.get_vector(u_name)
         v_vector = self.get_vector(v_name)
-        u_norm = self.vectors_norm_db.get(u_name)
-        v_norm = self.vectors_norm_db.get(v_name)
 
-        numerator = self.scalar_product(u_vector.items, v_vector.items)
-        denominator = float(u_norm) * float(v_norm)
-        
-        try:
+        numerator = self.scalar_product(u_vector, v_vector)
+
+        if self.normalized:
             # round the cosine similarity two digits after the decimal point 
-            cosine = round(numerator / denominator, 2)
-        except ZeroDivisionError:
-            logging.error("division by zero for %s and %s !" \
-                    % (u_name, v_name))
-            cosine = 0
+            cosine = round(numerator, 2)
+        else:
+            u_norm = self.vectors_norm_db.get(u_name)
+            v_norm = self.vectors_norm_db.get(v_name)
+            denominator = float(u_norm) * float(v_norm)
+
+            try:
+                # round the cosine similarity two digits after the decimal point 
+                cosine = round(numerator / denominator, 2)
+            except ZeroDivisionError:
+                logging.error("division by zero for %s and %s !" \
+                        % (u_name, v_name))
+                cosine = 0
         
         logging.debug("%s %s = %s " \
                 % (u_name, v_name, cosine))
@@ -575,6 +935,12 @@ class Classifier:
         """ returns the k-NN neighbor classification with the cosinus similarity.
 
         Build a list of tuples with the tag and the cosine similarity.
+        With the "postings" engine, only the vectors sharing words with the
+        vector are scored, through the postings of its words (the other
+        vectors have a null cosine similarity).
+        With the "matrix" engine, the vectors to compare are loaded in a kNN
+        engine (see knn.py), kept for the next calls with the same names:
+        the vector is scored against all of them at once.
 
         Args:
             u_eval (str): The u vector name to evaluate.
@@ -584,25 +950,76 @@ class Classifier:
             list of tuples (tag, sim): A list of K-Nearest neighbors.
 
         """
-        max_sim = [] # [(tag, sim) ... ]
+        u_vector = self.get_vector(u_eval)
+        if not u_vector:
+            return []
 
-        for v_comp in v_compares:
-            cosine_sim = self.cosine_sim(u_eval, v_comp)
+        u_norm = None if self.normalized else self.vectors_norm_db.get(u_eval)
 
-            if cosine_sim > MIN_COS_SINE:
-                # add vector tag and cos sim: (tag, sim)
-                max_sim.append((self.get_vector(v_comp).tag, cosine_sim))
+        if self.postings is not None:
+            return self.__postings_kNN(u_vector, u_norm, v_compares)
 
-        # sort cosine similarity
-        # [('SPORT', 0.2), ('ART', 0.60), ('ART', 0.13)]
-        # [('ART', 0.13), ('SPORT', 0.2), ('ART', 0.60)]
-        max_sim.sort(key=lambda tag_nb: tag_nb[1]) 
+        # the reference vectors are loaded once for many evaluations
+        if not self.knn_engine or self.knn_engine.names != v_compares:
+            self.knn_engine = self.__new_knn_engine(v_compares)
 
-        # return the k-nearest neighbor only
         # [('ART', 0.13), ('SPORT', 0.2), ('ART', 0.60)]
         # if K_ITEM = 2 
         # [('SPORT', 0.2), ('ART', 0.60)]
-        return max_sim[-K_ITEM:]
+        return self.knn_engine.kNN(u_vector, u_norm)
+
+    def __postings_kNN(self, u_vector, u_norm, v_compares):
+        """ Returns the k-NN neighbors among the vectors sharing words with a vector.
+
+        Args:
+            u_vector (Vector): The vector to evaluate.
+            u_norm (str): The norm of the vector, None for normalized vectors.
+            v_compares (list of str): List of vector name to compare.
+
+        Returns:
+            list of tuples (tag, sim): A list of K-Nearest neighbors.
+
+        """
+        # the positions of the names are kept for the next calls
+        if not self.__compares or self.__compares[0] != v_compares:
+            self.__compares = (list(v_compares),
+                               dict((name, position) for position, name in enumerate(v_compares)))
+        positions = self.__compares[1]
+
+        sims = dict((name, sim) for name, sim in self.postings.scores(u_vector).items()
+                    if name in positions)
+
+        if not self.normalized:
+            norms = self.vectors_norm_db.get_bulk(sims.keys(), False)
+            for name, sim in sims.items():
+                denominator = float(u_norm) * float(norms[name])
+                sims[name] = sim / denominator if denominator else 0.
+
+        neighbors = knn.nearest((sim, positions[name], name) for name, sim in sims.items())
+
+        # only the tags of the neighbors are read
+        vectors = kc_util.get_bulk(self.vectors_db, [name for name, _ in neighbors])
+        return [(vectors[name].tag, sim) for name, sim in neighbors]
+
+    def __new_knn_engine(self, v_compares):
+        """ Returns a kNN engine loaded with the reference vectors.
+
+        The vectors and their norms are read at once.
+
+        Args:
+            v_compares (list of str): List of vector name to compare.
+
+        Returns:
+            KNNEngine: The engine.
+
+        """
+        vectors = dict((name, self.__upgrade_vector(vector)) for name, vector
+                       in kc_util.get_bulk(self.vectors_db, v_compares).items())
+        norms = None
+        if not self.normalized:
+            norms = self.vectors_norm_db.get_bulk(vectors.keys(), False)
+
+        return knn.KNNEngine(list(v_compares), vectors, norms)
 
     def eval_category(self, u_eval, v_compares):
         """ Returns the categorie/tag of a vector.
@@ -657,26 +1074,38 @@ class Classifier:
             print(word) 
             print("")
 
-    def print_vector(self, name, items=None):
+    def print_vector(self, name, vector=None, word_infos=None):
         """ Prints content of a vector.
 
         Args:
             name (str): Name of the vector.
-            items (list of VectorItem, optional): Items to print.
+            vector (Vector, optional): The vector to print.
+            word_infos (dict, optional): The word infos by index, read from the dictionary
+            by default.
 
         """
+        if word_infos is None:
+            word_infos = dict((word_info.index, word_info) for _, word_info
+                              in kc_util.gen_db(self.dictionary_db.cursor()))
+
         print("* Vector name: %s" % name)
-        for item in items or self.get_vector(name).items:
-            print(item.printer(self.dictionary_db))
+        vector = vector or self.get_vector(name)
+        for index, tf in zip(vector.indexes, vector.tfs):
+            # insert the tf line before the idf
+            s = str(word_infos[index]).split("\n")
+            print("\n".join(s[:3] + ["tf        : %s" % tf] + [s[-1]]))
             print("")
 
     def print_vectors(self):
         """ Prints content of all vector.
         
         """
+        word_infos = dict((word_info.index, word_info) for _, word_info
+                          in kc_util.gen_db(self.dictionary_db.cursor()))
+
         print("Vectors:")
         for name, vector in self.get_vectors():
-            self.print_vector(name, vector.items)
+            self.print_vector(name, vector, word_infos)
 
 ###########################################################################
 # CleanTextUtil Example
@@ -706,9 +1135,7 @@ if __name__ == "__main__":
 ###########################################################################
 
 if __name__ == "__main__":
-    vi_1 = VectorItem("damien", "1")
-    vi_2 = VectorItem("ludovic", "0.5")
-    v = Vector([vi_1,vi_2], "SPORT")
+    v = Vector(array("i", [0, 12]), array("d", [1., 0.5]), array("d", [0., 0.]), "SPORT")
 
 ###########################################################################
 # VectorItem Example
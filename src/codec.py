@@ -0,0 +1,452 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Compact binary serialization of the records
+# stored in the databases.
+#
+
+import pickle, struct, sys, types, zlib
+from array import array
+from cStringIO import StringIO
+
+from settings import COMPRESS_THRESHOLD, COMPRESS_LEVEL
+
+import logging
+if __name__ == "__main__":
+    format_str = "%(asctime)s %(levelname)s %(funcName)s: %(message)s"
+    logging.basicConfig(format=format_str, level=logging.DEBUG)
+
+# first byte of a record, never the first byte of a pickle
+MAGIC = "\xfe"
+# version 2: texts compressed with zlib
+# version 3: arrays of numbers
+VERSION = 3
+
+# first byte of a compressed text (see pack_text), never in an UTF-8 text
+COMPRESSED = "\xfd"
+
+INT = struct.Struct("<q")
+FLOAT = struct.Struct("<d")
+LENGTH = struct.Struct("<I")
+
+# classes by code: (class, fields, defaults)
+CLASSES = {}
+# codes by class
+CODES = {}
+# classes by name, to read the old pickles
+LEGACY = {}
+# old-style classes standing for the classes in the old pickles
+PLACEHOLDERS = {}
+
+# value of an attribute not set
+ABSENT = object()
+
+def register(code, cls, fields, defaults=None, pickle_name=None):
+    """ Registers a class stored with the binary format.
+
+    The fields are stored in this order with the number of fields,
+    so new fields must be added at the end: the records stored before
+    get the default values of the new fields. A class with other fields
+    gets a new code, the class of the old code still reads the old records.
+
+    Args:
+        code (int): Code of the class in the records (0-255), never reused.
+        cls (type): The class, its objects are created without calling __init__.
+        fields (tuple of str): The attributes stored.
+        defaults (dict, optional): Values of the attributes missing in a record
+        or in an old pickle. An attribute without default stays unset.
+        pickle_name (str, optional): Name of the class in the old pickles,
+        defaults to the name of the class.
+
+    """
+    pickle_name = pickle_name or cls.__name__
+
+    CLASSES[code] = (cls, fields, defaults or {})
+    CODES[cls] = code
+    LEGACY[pickle_name] = cls
+    PLACEHOLDERS[pickle_name] = types.ClassType(pickle_name, (), {})
+
+def dumps(obj):
+    """ Returns the record of an object of a registered class.
+
+    Args:
+        obj (object): The object.
+
+    Returns:
+        str: The record.
+
+    Raises:
+        TypeError: A value can't be stored.
+
+    """
+    out = [MAGIC, chr(VERSION)]
+    _dump_record(obj, out)
+    return "".join(out)
+
+def loads(data, fields=None):
+    """ Returns the object of a record or of an old pickle.
+
+    With fields, the other fields of the record are skipped without being
+    decoded (the compressed texts are not decompressed): they get their
+    default value or stay unset.
+
+    Args:
+        data (str): The record or the pickle.
+        fields (list of str, optional): The fields read, defaults to all.
+
+    Returns:
+        object: The object.
+
+    Raises:
+        ValueError: The version of the record is unknown.
+
+    """
+    if data[:1] != MAGIC:
+        return loads_pickle(data)
+
+    if not 1 <= ord(data[1]) <= VERSION:
+        raise ValueError("unknown version of the record: %s" % ord(data[1]))
+
+    if fields is not None and data[2] == "r":
+        return _load_record(data, 3, fields)[0]
+
+    return _load_value(data, 2)[0]
+
+def loads_pickle(data):
+    """ Returns the object of a pickle, with the registered classes of today.
+
+    The objects of the registered classes are created again with their
+    attributes, the other classes are read as usual.
+
+    Args:
+        data (str): The pickle.
+
+    Returns:
+        object: The object.
+
+    """
+    return _upgrade(_LegacyUnpickler(StringIO(data)).load())
+
+def pack_text(text):
+    """ Returns the bytes of a text, compressed with zlib if the text is large.
+
+    Args:
+        text (unicode): The text.
+
+    Returns:
+        str: The UTF-8 text or the compressed text after COMPRESSED.
+
+    """
+    data = text.encode("utf-8")
+    if len(data) >= COMPRESS_THRESHOLD:
+        packed = zlib.compress(data, COMPRESS_LEVEL)
+        if len(packed) + 1 < len(data):
+            return COMPRESSED + packed
+    return data
+
+def unpack_text(data):
+    """ Returns the text of pack_text.
+
+    Args:
+        data (str): The bytes of the text, compressed or not.
+
+    Returns:
+        unicode: The text.
+
+    """
+    if data[:1] == COMPRESSED:
+        data = zlib.decompress(data[1:])
+    return data.decode("utf-8")
+
+def is_record(data):
+    """ Returns True if the data is a record of the binary format.
+
+    Args:
+        data (str): The data.
+
+    Returns:
+        boolean: False for an old pickle.
+
+    """
+    return data[:1] == MAGIC
+
+###########################################################################
+# Records
+###########################################################################
+
+def _dump_record(obj, out):
+    """ Appends the record of an object to a list of strings.
+
+    Args:
+        obj (object): The object of a registered class.
+        out (list of str): The record.
+
+    """
+    code = CODES[type(obj)]
+    fields = CLASSES[code][1]
+
+    out.append("r%s%s" % (chr(code), chr(len(fields))))
+    for field in fields:
+        _dump_value(getattr(obj, field, ABSENT), out)
+
+def _dump_value(value, out):
+    """ Appends a value with its type to a list of strings.
+
+    Args:
+        value (object): The value.
+        out (list of str): The record.
+
+    Raises:
+        TypeError: The value can't be stored.
+
+    """
+    if value is None:
+        out.append("N")
+    elif value is ABSENT:
+        out.append("X")
+    elif isinstance(value, bool):
+        out.append("T" if value else "F")
+    elif isinstance(value, (int, long)):
+        if -2**63 <= value < 2**63:
+            out.append("i" + INT.pack(value))
+        else:
+            digits = str(value)
+            out.append("I" + LENGTH.pack(len(digits)) + digits)
+    elif isinstance(value, float):
+        out.append("f" + FLOAT.pack(value))
+    elif isinstance(value, unicode):
+        data = pack_text(value)
+        kind = "z" if data[:1] == COMPRESSED else "u"
+        out.append(kind + LENGTH.pack(len(data)) + data)
+    elif isinstance(value, str):
+        out.append("s" + LENGTH.pack(len(value)) + value)
+    elif isinstance(value, array):
+        if sys.byteorder == "big":
+            value = array(value.typecode, value)
+            value.byteswap()
+        out.append("a" + value.typecode + LENGTH.pack(len(value)) + value.tostring())
+    elif isinstance(value, (list, tuple)):
+        out.append("l" + LENGTH.pack(len(value)))
+        for v in value:
+            _dump_value(v, out)
+    elif type(value) in CODES:
+        _dump_record(value, out)
+    else:
+        raise TypeError("can't serialize %s" % type(value))
+
+def _load_value(data, pos):
+    """ Reads a value.
+
+    Args:
+        data (str): The record.
+        pos (int): Position of the value.
+
+    Returns:
+        tuple (object, int): The value and the position of the next value.
+
+    """
+    kind = data[pos]
+    pos += 1
+
+    if kind == "i":
+        return INT.unpack_from(data, pos)[0], pos + 8
+    if kind == "u":
+        end = pos + 4 + LENGTH.unpack_from(data, pos)[0]
+        return data[pos + 4:end].decode("utf-8"), end
+    if kind == "f":
+        return FLOAT.unpack_from(data, pos)[0], pos + 8
+    if kind == "N":
+        return None, pos
+    if kind == "X":
+        return ABSENT, pos
+    if kind == "s":
+        end = pos + 4 + LENGTH.unpack_from(data, pos)[0]
+        return data[pos + 4:end], end
+    if kind == "z":
+        end = pos + 4 + LENGTH.unpack_from(data, pos)[0]
+        return unpack_text(data[pos + 4:end]), end
+    if kind == "r":
+        return _load_record(data, pos)
+    if kind == "a":
+        values = array(data[pos])
+        end = pos + 5 + values.itemsize * LENGTH.unpack_from(data, pos + 1)[0]
+        values.fromstring(data[pos + 5:end])
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values, end
+    if kind == "l":
+        values = []
+        count, pos = LENGTH.unpack_from(data, pos)[0], pos + 4
+        for _ in xrange(count):
+            value, pos = _load_value(data, pos)
+            values.append(value)
+        return values, pos
+    if kind in "TF":
+        return kind == "T", pos
+    if kind == "I":
+        end = pos + 4 + LENGTH.unpack_from(data, pos)[0]
+        return long(data[pos + 4:end]), end
+
+    raise ValueError("unknown type of value: %r" % kind)
+
+def _load_record(data, pos, wanted=None):
+    """ Reads the object of a record.
+
+    Args:
+        data (str): The record.
+        pos (int): Position of the code of the class.
+        wanted (list of str, optional): The fields decoded, defaults to all.
+
+    Returns:
+        tuple (object, int): The object and the position of the next value.
+
+    """
+    cls, fields, defaults = CLASSES[ord(data[pos])]
+    count = ord(data[pos + 1])
+    pos += 2
+
+    obj = cls.__new__(cls)
+    for field in fields[count:]:
+        if field in defaults:
+            setattr(obj, field, defaults[field])
+
+    for field in fields[:count]:
+        if wanted is not None and field not in wanted:
+            pos = _skip_value(data, pos)
+            if field in defaults:
+                setattr(obj, field, defaults[field])
+            continue
+
+        value, pos = _load_value(data, pos)
+        if value is not ABSENT:
+            setattr(obj, field, value)
+
+    # the fields unknown by this version are skipped
+    for _ in xrange(count - len(fields)):
+        pos = _skip_value(data, pos)
+
+    return obj, pos
+
+def _skip_value(data, pos):
+    """ Returns the position of the next value, the value is not decoded.
+
+    Args:
+        data (str): The record.
+        pos (int): Position of the value.
+
+    Returns:
+        int: The position of the next value.
+
+    """
+    kind = data[pos]
+    pos += 1
+
+    if kind in "uszI":
+        return pos + 4 + LENGTH.unpack_from(data, pos)[0]
+    if kind in "if":
+        return pos + 8
+    if kind in "NXTF":
+        return pos
+    if kind == "a":
+        return pos + 5 + array(data[pos]).itemsize * LENGTH.unpack_from(data, pos + 1)[0]
+    if kind == "l":
+        count, pos = LENGTH.unpack_from(data, pos)[0], pos + 4
+        for _ in xrange(count):
+            pos = _skip_value(data, pos)
+        return pos
+    if kind == "r":
+        count, pos = ord(data[pos + 1]), pos + 2
+        for _ in xrange(count):
+            pos = _skip_value(data, pos)
+        return pos
+
+    raise ValueError("unknown type of value: %r" % kind)
+
+###########################################################################
+# Old pickles
+###########################################################################
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """ Reads the old pickles of the registered classes as old-style objects.
+
+    """
+    def find_class(self, module, name):
+        # the module can be __main__ if the pickle has been written by a script
+        if name in PLACEHOLDERS:
+            return PLACEHOLDERS[name]
+        return pickle.Unpickler.find_class(self, module, name)
+
+def _upgrade(value):
+    """ Replaces the old-style objects of an old pickle by registered objects.
+
+    Args:
+        value (object): A value of the pickle.
+
+    Returns:
+        object: The value with the registered classes.
+
+    """
+    if isinstance(value, list):
+        return [_upgrade(v) for v in value]
+
+    if not isinstance(value, types.InstanceType) or \
+            PLACEHOLDERS.get(value.__class__.__name__) is not value.__class__:
+        return value
+
+    cls = LEGACY[value.__class__.__name__]
+    _, fields, defaults = CLASSES[CODES[cls]]
+
+    obj = cls.__new__(cls)
+    for field in fields:
+        if field in value.__dict__:
+            setattr(obj, field, _upgrade(value.__dict__[field]))
+        elif field in defaults:
+            setattr(obj, field, defaults[field])
+
+    return obj
+
+###########################################################################
+# Codec Example
+###########################################################################
+
+if __name__ == "__main__":
+    import timeit
+    from collector import Collector
+    from classifier import Classifier, CleanTextUtil, Vector, LegacyVector, VectorItem
+
+    ## convert the databases written with pickle (one-shot)
+    collector = Collector()
+    classifier = Classifier(CleanTextUtil("french"))
+    converted = collector.convert_dbs() + classifier.convert_dbs()
+    logging.info("%s records converted" % converted)
+    ##
+
+    def downgrade(obj):
+        # the same object as an old-style object, like in the old pickles
+        old = PLACEHOLDERS[obj.__class__.__name__]()
+        for field in CLASSES[CODES[type(obj)]][1]:
+            if hasattr(obj, field):
+                value = getattr(obj, field)
+                if isinstance(value, list):
+                    value = [downgrade(v) for v in value]
+                setattr(old, field, value)
+        return old
+
+    def compare_test(name, obj):
+        record, pickled = dumps(obj), pickle.dumps(downgrade(obj))
+        t_record = timeit.timeit(lambda: loads(record), number=2000)
+        t_pickle = timeit.timeit(lambda: loads_pickle(pickled), number=2000)
+        print("%s: %s bytes (pickle %s bytes), read %.1fx faster" % \
+              (name, len(record), len(pickled), t_pickle / t_record))
+
+    for name in collector.get_feeds_name():
+        _, item = collector.get_items(name).next()
+        compare_test("item", item)
+        break
+
+    compare_test("legacy vector", LegacyVector([VectorItem(u"mot%s" % i, i / 100.)
+                                                for i in range(100)], "SPORT"))
+    compare_test("vector", Vector(array("i", range(100)), array("d", [i / 100. for i in range(100)]),
+                                  array("d", [i / 50. for i in range(100)]), "SPORT"))
+
+    collector.close()
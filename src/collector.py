@@ -5,19 +5,30 @@
 # to the kyoto cabinet database.
 #
 
-import pickle
-import kyotocabinet as kc
+import codec
+import storage
 import kyotocabinetutil as kc_util
 
-from boilerpipe.extract import Extractor
 from guess_language.guess_language import guessLanguage
 
-import random, string, os, time
-import BeautifulSoup
-import feedparser
+import random, string, os, time, calendar, threading, bisect
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.utils import parsedate_tz, mktime_tz
+from multiprocessing.pool import ThreadPool
+from htmlutil import html_to_text
+from fetcher import Fetcher
+from extractor import ArticleExtractor
+from dedup import DuplicateIndex, simhash, feed_name
 
 from settings import WORK_DIR, ACTIVE_ACTICLE_EXTRACTOR, \
-        FEEDS_DB_FILENAME, DEFAULT_LANGUAGE_CODE
+        FEEDS_DB_FILENAME, DEFAULT_LANGUAGE_CODE, FEEDS_CONCURRENCY, \
+        SHARED_ITEMS_DB, ITEMS_DB_FILENAME, ITEMS_DB_CACHE_SIZE, \
+        LANGUAGE_SAMPLE_RATE, LANGUAGE_STABLE_VOTES, \
+        LANGUAGE_CACHE_MAX_LENGTH, LANGUAGE_CACHE_SIZE, ACTIVE_DEDUP, \
+        EVENTS_DB_FILENAME, DATES_DB_FILENAME, RETENTION_COMPACT_RATIO, \
+        BODIES_DB_FILENAME, DB_EXT
 
 import logging
 if __name__ == "__main__":
@@ -43,21 +54,141 @@ class Collector:
     >>> collector.rm_feed(name)
     True
 
+    Many feeds can be fetched at the same time with "add_feeds" and "update_feeds",
+    the databases are always written by one thread at a time.
+
+    Feeds are downloaded by a fetcher, any object with the method
+    "parse(url, etag=None, modified=None)" returning a feedparser result.
+
+    By default, the items of a feed are stored in their own database file.
+    With SHARED_ITEMS_DB, new feeds store their items in a single database
+    with keys "feed name/item id", and the item database filename of the feed
+    is "$ITEMS_DB_FILENAME/feed name". Existing feeds are moved to the shared
+    database with "migrate_items_db".
+
+    Databases of items stay open between two calls, the least recently used
+    are closed when more than ITEMS_DB_CACHE_SIZE are open.
+    The method "close" closes all databases, a collector can also be used 
+    with the "with" statement.
+
+    The linked web pages of new items are extracted in the background 
+    by an article extractor (ACTIVE_ACTICLE_EXTRACTOR), adding a feed doesn't 
+    wait for them. The text of the finished articles is stored with "update_articles".
+
+    The language of the items is guessed with the language declared for the feed
+    and the language detected on its previous items, the abstracts are only
+    detected on a sample (see LanguageGuesser).
+
+    The ids of the items of a feed are kept in memory in a sorted array,
+    read from the keys of the database at the first update of the feed.
+    An update skips the known items without reading the database.
+
+    The same story published by many feeds is flagged: a new item with
+    nearly the same title and abstract as a stored item of another feed has
+    the attribute "duplicate_of" (see DuplicateIndex, ACTIVE_DEDUP). The
+    duplicates are stored but skipped by "get_text_from_items". When the
+    original is removed, its first duplicate replaces it.
+
+    Each change of the items is appended to an event log with a sequence
+    number: new item, text of the web page stored, tag changed, feed removed.
+    A consumer keeps the sequence number of the last event processed and
+    reads only the next events with "get_events".
+
+    The items are also indexed by publication date: "get_items_since" and
+    "get_items_between" read the items of a period without reading
+    the other items. The items stored before the index are added
+    with "index_dates".
+
+    The text of the linked web page (the body of an item) is stored apart
+    from the other fields (the header), in a database of bodies with keys
+    "feed name/item id". The methods "get_items" and "get_item" only read
+    the bodies when the field "webpage_text" is asked.
+
+    Old items are removed with "rm_items" (see Retention). The files of the
+    databases don't shrink after a removal: "compact_items_dbs" rebuilds
+    the databases with many items removed, when they are not in use.
+
     Attributes:
         feeds_db (kyotocabinet.DB): The database of feeds.
+        events_db (kyotocabinet.DB): The event log, events by sequence number.
+        dates_db (kyotocabinet.DB): The items by publication date.
+        bodies_db (kyotocabinet.DB): The texts of the web pages by "feed name/item id".
+        event_seq (int): Sequence number of the last event.
+        lock (threading.RLock): Serializes writes to the databases.
+        fetcher (Fetcher): Downloads and parses feeds.
+        extractor (ArticleExtractor): Extracts the linked web pages or None.
+        dedup_index (DuplicateIndex): Finds the near-duplicate items or None.
+        shared_items_db (kyotocabinet.DB): The database of items shared by feeds,
+        opened the first time it is used.
+        shared_items_db_users (int): Number of users of the shared database.
+        items_dbs (OrderedDict): Open databases of items by filename, with the
+        number of users, from the least to the most recently used.
+        items_dbs_size (int): Maximum number of open databases of items.
+        language_guessers (dict): Guessers of the language of the items by feed name.
+        language_cache (OrderedDict): Languages of short abstracts by hash,
+        shared by the guessers.
+        seen_ids (dict): Sorted arrays of the item ids by item database filename.
+        lookups_avoided (int): Number of known items skipped without reading the database.
+        removed_items (dict): Number of items removed by database filename
+        since the last compaction.
 
     """
     feed_status_ok = [200, 301, 302]
 
-    def __init__(self):
+    def __init__(self, fetcher=None, items_dbs_size=ITEMS_DB_CACHE_SIZE,
+                 extractor=None, dedup_index=None):
         """ Opens or creates the feeds database.
 
+        Args:
+            fetcher (Fetcher, optional): Downloads and parses feeds, 
+            defaults is a Fetcher with persistent connections.
+            items_dbs_size (int, optional): Maximum number of open databases of items.
+            extractor (ArticleExtractor, optional): Extracts the linked web pages,
+            defaults is an ArticleExtractor if ACTIVE_ACTICLE_EXTRACTOR is set.
+            dedup_index (DuplicateIndex, optional): Finds the near-duplicate items,
+            defaults is a DuplicateIndex if ACTIVE_DEDUP is set.
+
         """
-        self.feeds_db = kc.DB()
-        self.feeds_db.open(FEEDS_DB_FILENAME,
-                           kc.DB.OWRITER | kc.DB.OCREATE)
+        if not extractor and ACTIVE_ACTICLE_EXTRACTOR:
+            extractor = ArticleExtractor()
+        self.extractor = extractor
+
+        self.fetcher = fetcher or Fetcher()
 
-    def add_feed(self, name, url, tag=None):
+        if not dedup_index and ACTIVE_DEDUP:
+            dedup_index = DuplicateIndex()
+        self.dedup_index = dedup_index
+
+        self.feeds_db = storage.new_db()
+        self.feeds_db.open(FEEDS_DB_FILENAME,
+                           storage.OWRITER | storage.OCREATE)
+
+        self.events_db = storage.new_db()
+        self.events_db.open(EVENTS_DB_FILENAME,
+                            storage.OWRITER | storage.OCREATE)
+        cursor = self.events_db.cursor()
+        self.event_seq = int(cursor.get_key()) if cursor.jump_back() else 0
+
+        self.dates_db = storage.new_db()
+        self.dates_db.open(DATES_DB_FILENAME,
+                           storage.OWRITER | storage.OCREATE)
+
+        self.bodies_db = storage.new_db()
+        self.bodies_db.open(BODIES_DB_FILENAME,
+                            storage.OWRITER | storage.OCREATE)
+
+        self.lock = threading.RLock()
+        self.shared_items_db = None
+        self.shared_items_db_users = 0
+        self.items_dbs = OrderedDict()
+        self.items_dbs_size = items_dbs_size
+        self.language_guessers = {}
+        self.language_cache = OrderedDict()
+        self.seen_ids = {}
+        self.lookups_avoided = 0
+        self.removed_items = {}
+
+    def add_feed(self, name, url, tag=None, language=None):
         """ Adds a new feed to the database.
         
         The feed is not added if the feed/name already exists.
@@ -66,6 +197,7 @@ class Collector:
             name (str): Name of the feed.
             url (str): The feed url.
             tag (str, optional): The tag chosen. 
+            language (str, optional): Code of the language declared for the feed ("fr", "en").
 
         Returns:
             Feed: The new feed added.
@@ -75,11 +207,499 @@ class Collector:
             logging.info('the feed "%s" already exists' % name)
             return
 
+        feed_parsed = self.__fetch_feed(url)
+
+        with self.lock:
+            feed = self.__store_feed(name, url, tag, feed_parsed, language)
+
+        # store the articles already extracted
+        self.update_articles()
+
+        return feed
+
+    def add_feeds(self, feeds, concurrency=FEEDS_CONCURRENCY):
+        """ Adds new feeds to the database by fetching them concurrently.
+
+        Feeds are downloaded and parsed by a pool of threads, 
+        the databases are written one feed at a time.
+
+        Args:
+            feeds (list of tuple): A list of tuples (name, url, tag)
+            or (name, url, tag, language).
+            concurrency (int, optional): Number of feeds fetched at the same time.
+
+        Returns:
+            dict: The new feeds added by name (None if the feed was not added).
+
+        """
+        # the language is optional
+        feeds = [tuple(feed_info) + (None,) * (4 - len(feed_info)) for feed_info in feeds]
+        feeds = [feed_info for feed_info in feeds if not self.has_feed(feed_info[0])]
+
+        def fetch(feed_info):
+            return feed_info, self.__fetch_feed(feed_info[1])
+
+        added = {}
+        for (name, url, tag, language), feed_parsed in self.__imap(fetch, feeds, concurrency):
+            with self.lock:
+                added[name] = self.__store_feed(name, url, tag, feed_parsed, language)
+
+        # store the articles already extracted
+        self.update_articles()
+
+        return added
+        
+    def update_feed(self, name):
+        """ Updates a feed by adding new items to the actual collection.
+        
+        Args:
+            name (str): Name of the feed.
+        
+        Returns:
+            boolean: True if new items has been added with the update.
+
+        """
+        feed = self.get_feed(name)
+
+        # feed can be None with get_feed() and that is ok
+        if not feed:
+            return False
+
+        feed_parsed = self.__fetch_feed(feed.url, feed.etag, feed.modified)
+
+        with self.lock:
+            updated = self.__update_items(feed, feed_parsed)
+
+        # store the articles already extracted
+        self.update_articles()
+
+        return updated
+
+    def update_feeds(self, names, concurrency=FEEDS_CONCURRENCY):
+        """ Updates feeds by fetching them concurrently.
+
+        Feeds are downloaded and parsed by a pool of threads, 
+        new items are written one feed at a time.
+
+        Args:
+            names (list of str): Names of the feeds.
+            concurrency (int, optional): Number of feeds fetched at the same time.
+
+        Returns:
+            dict: True by feed name if new items has been added with the update.
+
+        """
+        feeds = [feed for feed in map(self.get_feed, names) if feed]
+
+        def fetch(feed):
+            return feed, self.__fetch_feed(feed.url, feed.etag, feed.modified)
+
+        updated = dict((name, False) for name in names)
+        for feed, feed_parsed in self.__imap(fetch, feeds, concurrency):
+            with self.lock:
+                updated[feed.name] = self.__update_items(feed, feed_parsed)
+
+        # store the articles already extracted
+        self.update_articles()
+
+        return updated
+
+    def rm_feed(self, name):
+        """ Removes a feed with his name.
+
+        The feed is removed from the feed and the item database.
+        
+        Args:
+            name (str): Name of the feed.
+
+        Returns:
+            boolean: True if the item has been removed.
+
+        """
+        feed = self.get_feed(name)
+        
+        # remove the item database
+        try:
+            namespace = self.__namespace(feed.item_db_filename)
+            if namespace:
+                with self.lock:
+                    kc_util.remove_prefix(self.__shared_items_db(), "%s/" % namespace)
+            else:
+                with self.lock:
+                    self.__close_items_db(feed.item_db_filename)
+                    os.remove(feed.item_db_filename)
+
+        except AttributeError as er:
+            # feed can be None with get_feed()
+            if feed:
+                logging.error(er)
+            return False
+        except IOError as er:
+            # the items can't be removed from the shared database
+            logging.error(er)
+            return False
+        except OSError as er:
+            # print the error and quit if the file exists
+            if os.path.isfile(feed.item_db_filename):
+                logging.error(er)
+                return False
+            logging.debug(er)
+
+        # remove the feed from the feeds database 
+        self.feeds_db.remove(name)
+        self.language_guessers.pop(name, None)
+        self.seen_ids.pop(feed.item_db_filename, None)
+        self.removed_items.pop(feed.item_db_filename, None)
+        self.__rm_bodies(name)
+        self.__rm_fingerprints(name)
+        self.__rm_dates(name)
+        self.__log_events("rm_feed", name, [None])
+        logging.info("feed %s removed", name)
+
+        return True
+
+    def rm_items(self, name, item_ids):
+        """ Removes items of a feed.
+
+        The ids stay in the ids of the known items, they are recorded in the
+        index of dates for the next runs: an item removed but still published
+        by the feed is not added again by an update.
+
+        Args:
+            name (str): Name of the feed.
+            item_ids (list): Ids of the items.
+
+        Returns:
+            int: The number of items removed.
+
+        """
+        feed = self.get_feed(name)
+        if not feed or not item_ids:
+            return 0
+
         try:
-            logging.debug("start parsing !")
-            feed_parsed = feedparser.parse(url)
+            with self.lock:
+                with self.__items_db(feed.item_db_filename) as (items_db, prefix):
+                    removed = items_db.remove_bulk(
+                            ["%s%s" % (prefix, item_id) for item_id in item_ids], True)
+                    if removed < 0:
+                        raise IOError("can't remove the items: %s" % items_db.error())
+
+                filename = ITEMS_DB_FILENAME \
+                        if self.__namespace(feed.item_db_filename) else feed.item_db_filename
+                self.removed_items[filename] = self.removed_items.get(filename, 0) + removed
+
+        except IOError as er:
+            logging.error(er)
+            return 0
+
+        self.__rm_bodies(name, item_ids)
+        self.__rm_fingerprints(name, item_ids)
+        self.__rm_dates(name, item_ids)
+        self.__add_removed_ids(name, item_ids)
+        self.__log_events("rm", name, item_ids)
+        logging.info("%s items of %s removed" % (removed, name))
+
+        return removed
+
+    def compact_items_dbs(self, ratio=RETENTION_COMPACT_RATIO):
+        """ Rebuilds the databases of items with many items removed.
+
+        A database is rebuilt if at least this part of its items has been removed
+        since the last compaction and if it is not in use, otherwise
+        it is rebuilt by a next call. The writes wait during the rebuild.
+
+        Args:
+            ratio (float, optional): Part of the items removed.
+
+        Returns:
+            int: The number of databases rebuilt.
+
+        """
+        compacted = 0
+
+        for filename, removed in self.removed_items.items():
+            try:
+                with self.lock:
+                    if self.__compact_items_db(filename, removed, ratio):
+                        compacted += 1
+
+            except (IOError, OSError) as er:
+                logging.error("error while compacting %s" % filename)
+                logging.debug(er)
 
-            if feed_parsed.status not in self.feed_status_ok:
+        return compacted
+
+    def update_feed_tag(self, name, tag):
+        """ Updates the category/tag of a feed.
+
+        Args:
+            name (str): Name of the feed.
+            tag (str): Category/tag of the feed.
+
+        """
+        feed = self.get_feed(name)
+        feed.tag = tag
+        self.feeds_db.replace(name, codec.dumps(feed))
+
+    def update_item_tag(self, item_db_filename, item_id, tag, name=None):
+        """ Updates the category/tag of an item.
+
+        Args:
+            item_db_filename (str): Name of the items database.
+            item_id (int): Id of the item to update.
+            tag (str): Category/tag of the item.
+            name (str): Name of the feed, searched in the feeds if not given.
+
+        Returns:
+            Item: The updated item is returned.
+
+        """
+        item = None
+
+        try:
+            with self.__items_db(item_db_filename) as (items_db, prefix):
+                key = "%s%s" % (prefix, item_id)
+
+                item = codec.loads(items_db.get(key))
+                item.tag = tag
+
+                items_db.replace(key, codec.dumps(item)) 
+
+            if name is None:
+                name = self.__feed_name(item_db_filename)
+            self.__log_events("tag", name, [item_id])
+        except Exception as er:
+            logging.error(er)
+
+        return item
+
+    def migrate_items_db(self):
+        """ Moves the items of feeds stored in their own file to the shared database.
+
+        For each feed, items are copied with a single transaction, 
+        the feed is linked to the shared database and the old file is removed.
+        The migration can be run again after an error.
+
+        Returns:
+            int: The number of feeds migrated.
+
+        """
+        migrated = 0
+
+        for name, feed in self.get_feeds():
+            if self.__namespace(feed.item_db_filename):
+                continue
+
+            try:
+                with self.lock:
+                    with self.__items_db(feed.item_db_filename) as (items_db, _):
+                        records = items_db.get_bulk(items_db.match_prefix(""), False)
+
+                    records = dict(("%s/%s" % (name, item_id), value) 
+                                   for item_id, value in records.items())
+                    kc_util.set_bulk(self.__shared_items_db(), records)
+
+                    old_filename = feed.item_db_filename
+                    feed.item_db_filename = "%s/%s" % (ITEMS_DB_FILENAME, name)
+                    self.feeds_db.replace(name, codec.dumps(feed))
+
+                    self.__close_items_db(old_filename)
+                    self.seen_ids.pop(old_filename, None)
+                    os.remove(old_filename)
+
+            except Exception as er:
+                logging.error("error while migrating the items of %s" % name)
+                logging.debug(er)
+                continue
+
+            migrated += 1
+            logging.info("%s items of %s migrated" % (len(records), name))
+
+        return migrated
+
+    def convert_dbs(self):
+        """ Converts the feeds, the items and the events stored with pickle to the binary format.
+
+        The records are converted by batches, the conversion can be run again
+        after an error.
+
+        Returns:
+            int: The number of records converted.
+
+        """
+        with self.lock:
+            converted = kc_util.convert_db(self.feeds_db)
+            converted += kc_util.convert_db(self.events_db)
+
+        for name, feed in self.get_feeds():
+            try:
+                with self.lock:
+                    with self.__items_db(feed.item_db_filename) as (items_db, prefix):
+                        converted += kc_util.convert_db(items_db, prefix)
+
+            except IOError as er:
+                logging.error("error while converting the items of %s" % name)
+                logging.debug(er)
+
+        logging.info("%s records converted" % converted)
+
+        return converted
+
+    def index_dates(self):
+        """ Adds the items stored before the index of publication dates to the index.
+
+        The index can be rebuilt after an error, the items already
+        indexed are indexed again.
+
+        Returns:
+            int: The number of items indexed.
+
+        """
+        indexed = 0
+
+        for name in self.get_feeds_name():
+            items = self.get_items(name, ["published_ts", "published_date"])
+            dates = [(int(item_id), item.published_ts or 
+                      Item.get_timestamp({"published": item.published_date}))
+                     for item_id, item in items]
+
+            self.__index_dates(name, dates)
+            indexed += len(dates)
+
+        return indexed
+
+    def update_articles(self, wait=False):
+        """ Stores the text of the extracted web pages in the items.
+
+        Args:
+            wait (boolean, optional): Wait for the articles in progress,
+            otherwise only the finished articles are stored.
+
+        Returns:
+            int: The number of items updated.
+
+        """
+        if not self.extractor:
+            return 0
+
+        updated = 0
+        for (name, item_db_filename, item_id), text in self.extractor.results(wait):
+            try:
+                with self.lock:
+                    with self.__items_db(item_db_filename) as (items_db, prefix):
+                        if not items_db.get("%s%s" % (prefix, item_id)):
+                            # the item has been removed
+                            continue
+
+                    # only the body is written, the item is unchanged
+                    if not self.bodies_db.set("%s/%s" % (name, item_id), codec.pack_text(text)):
+                        logging.error("can't store the article of the item %s: %s" % \
+                                      (item_id, self.bodies_db.error()))
+                        continue
+
+                    self.__log_events("update", name, [item_id])
+
+            except IOError as er:
+                # the feed has been removed
+                logging.debug(er)
+                continue
+            except Exception as er:
+                logging.error(er)
+                continue
+
+            updated += 1
+            logging.debug("article of the item %s updated" % item_id)
+
+        return updated
+
+    def close(self):
+        """ Closes all databases, connections and workers.
+
+        """
+        if self.extractor:
+            self.extractor.close()
+
+        with self.lock:
+            for filename in self.items_dbs.keys():
+                self.__close_items_db(filename)
+
+            if self.shared_items_db:
+                self.shared_items_db.close()
+                self.shared_items_db = None
+
+            self.feeds_db.close()
+            self.events_db.close()
+            self.dates_db.close()
+            self.bodies_db.close()
+
+            if self.dedup_index:
+                self.dedup_index.close()
+
+            # a fetcher only needs the method "parse"
+            if hasattr(self.fetcher, "close"):
+                self.fetcher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def has_feed(self, name):
+        """ Returns true or false if the feed exists.
+
+        Args:
+            name (str): Name of the feed.
+
+        """
+        return bool(self.feeds_db.get(name))
+
+    ###########################################################################
+    # Fetch and store
+    ###########################################################################
+
+    def __imap(self, func, iterable, concurrency):
+        """ Applies a function to each element with a pool of threads.
+
+        Results are yielded in the calling thread as soon as they are ready.
+
+        Args:
+            func (function): The function to apply.
+            iterable (list): The elements.
+            concurrency (int): Number of threads.
+
+        Yields:
+            obj: The result of the function for each element.
+
+        """
+        pool = ThreadPool(max(1, concurrency))
+        try:
+            for result in pool.imap_unordered(func, iterable):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def __fetch_feed(self, url, etag=None, modified=None):
+        """ Downloads and parses a feed.
+
+        This method doesn't touch the databases, it can be called by many threads.
+
+        Args:
+            url (str): The feed url.
+            etag (unicode, optional): Unique tag provided by the feed server.
+            modified (str, optional): Date provided by the feed server.
+
+        Returns:
+            feedparser.FeedParserDict: The feed parsed or None if there is an error.
+
+        """
+        try:
+            logging.debug("start parsing %s" % url)
+            feed_parsed = self.fetcher.parse(url, etag=etag, modified=modified)
+
+            if feed_parsed.status not in self.feed_status_ok + [304]:
                 logging.error("error status %s for \n(%s)" % \
                              (feed_parsed.status, url))
                 return
@@ -87,29 +707,66 @@ class Collector:
         except AttributeError as er: 
             # feed_parsed.status can be null 
             # if there is an error with the url
-            feed_parsed = None
-            if not hasattr(feed_parsed, "status"):
-                logging.error("error with the url: %s" % url)
-            else:
-                logging.error(er)
+            logging.error("error with the url: %s" % url)
+            logging.debug(er)
             return
         except Exception as er:
             logging.error(er)
             return
 
-        # generate a new random feed file name for the database of items
-        random_letters = ''.join(random.choice(string.ascii_letters) for _ in range(5))
-        file_name = "%s/%s_%s.kct" % (WORK_DIR, name, random_letters)
+        return feed_parsed
+
+    def __store_feed(self, name, url, tag, feed_parsed, language=None):
+        """ Stores a new feed and his items.
+
+        Args:
+            name (str): Name of the feed.
+            url (str): The feed url.
+            tag (str): The tag chosen. 
+            feed_parsed (feedparser.FeedParserDict): The feed parsed.
+            language (str, optional): Code of the language declared for the feed.
+
+        Returns:
+            Feed: The new feed added.
+
+        """
+        if not feed_parsed:
+            return
+
+        if SHARED_ITEMS_DB:
+            file_name = "%s/%s" % (ITEMS_DB_FILENAME, name)
+        else:
+            # generate a new random feed file name for the database of items
+            random_letters = ''.join(random.choice(string.ascii_letters) for _ in range(5))
+            file_name = "%s/%s_%s%s" % (WORK_DIR, name, random_letters, DB_EXT)
+
+        guesser = self.__language_guesser(name, language)
             
         try:
-            items_db = kc.DB() # open or create the Feed database
-            items_db.open(file_name, kc.DB.OWRITER | kc.DB.OCREATE)
-
-            # parse each entry by creating a new Item object 
-            for entry in reversed(feed_parsed["entries"]):
-                item = Item(entry)
-                items_db.add(item.id, pickle.dumps(item))
-                logging.debug('add item "%s"' % item.title)
+            # open or create the Feed database
+            with self.__items_db(file_name, create=True) as (items_db, prefix):
+
+                # parse each entry by creating a new Item object 
+                records = {}
+                articles = []
+                dates = []
+                fingerprints = []
+                for entry in reversed(feed_parsed["entries"]):
+                    item = Item(entry, guesser)
+                    key = "%s%s" % (prefix, item.id)
+
+                    # the first item is kept when two entries have the same id
+                    if key not in records:
+                        fingerprint = self.__flag_duplicate(name, item)
+                        fingerprints.append((item.id, fingerprint, item.duplicate_of))
+                        records[key] = codec.dumps(item)
+                        articles.append((item.id, item.webpage_url))
+                        dates.append((item.id, item.published_ts))
+                        logging.debug('add item "%s"' % item.title)
+
+                # all items are written at once
+                kc_util.set_bulk(items_db, records)
+                self.seen_ids[file_name] = array("L", sorted(item_id for item_id, _ in articles))
 
         except Exception as er:
             logging.error("error while adding items for %s" % name)
@@ -117,10 +774,13 @@ class Collector:
             logging.debug("feed keys => %s" % feed_parsed['feed'].keys())
             logging.debug(er)
 
-            items_db.close()
+            if self.__namespace(file_name):
+                # nothing has been written in the shared database
+                return
 
             try: 
-                # remove the item database
+                # remove the item database
+                self.__close_items_db(file_name)
                 os.remove(file_name)
             except OSError as er:
                 logging.error("remove db file after an error")
@@ -128,152 +788,735 @@ class Collector:
                  
             return
 
-        items_db.close()
+        self.__add_fingerprints(name, fingerprints)
+        self.__extract_articles(name, file_name, articles)
+        self.__index_dates(name, dates)
 
         feed = Feed(name, file_name, url, tag,
                     etag=feed_parsed.get('etag', None), 
-                    modified=feed_parsed.get('modified', None))
+                    modified=feed_parsed.get('modified', None),
+                    language=language,
+                    detected_language=guesser.detected_language)
 
-        self.feeds_db.add(name, pickle.dumps(feed))
+        self.feeds_db.add(name, codec.dumps(feed))
+        self.__log_events("add", name, [item_id for item_id, _ in articles])
         logging.info("feed %s added", name)
 
         return feed 
-        
-    def update_feed(self, name):
-        """ Updates a feed by adding new items to the actual collection.
-        
+
+    def __update_items(self, feed, feed_parsed):
+        """ Adds the new items of a parsed feed to the feed collection.
+
         Args:
-            name (str): Name of the feed.
-        
+            feed (Feed): The feed to update.
+            feed_parsed (feedparser.FeedParserDict): The feed parsed.
+
         Returns:
-            boolean: True if new items has been added with the update.
+            boolean: True if new items has been added.
 
         """
-        feed = self.get_feed(name)
+        if not feed_parsed:
+            return False
 
-        try:
-            feed_parsed = feedparser.parse(feed.url,
-                                           etag=feed.etag, 
-                                           modified=feed.modified)
+        if feed_parsed.status == 304:
+            logging.info('nothing to do, the feed "%s" is up to date' % feed.name)
+            return False
 
-            if feed_parsed.status == 304:
-                logging.info('nothing to do, the feed "%s" is up to date' % name)
-                return False
+        records = {}
+        articles = []
+        dates = []
+        fingerprints = []
+        guesser = self.__language_guesser(feed.name, feed.language, feed.detected_language)
 
-        except AttributeError:
-            # feed can be None with get_feed() and that is ok
-            if feed: 
-                # feedparser.parse() can return None too
-                logging.error("error with the url: %s" % feed.url)
-            return False;
-        
-        updated=False
-        
         try:
-            items_db = kc.DB()
-            items_db.open(feed.item_db_filename, kc.DB.OWRITER)
+            with self.__items_db(feed.item_db_filename) as (items_db, prefix):
+                seen_ids = self.__seen_ids(feed.name, feed.item_db_filename, items_db, prefix)
+                lookups_avoided = 0
             
-            for entry in reversed(feed_parsed["entries"]):
-                item_id = Item.get_id(entry)
-
-                # add a new item if the id doesn't exists
-                if not items_db.get(item_id):
-                    updated = True
-                    item = Item(entry)
-                    self.items_db.append(item)
-                    logging.info('add a new item : "%s"' % item.title)
+                published_ids = set()
+                for entry in reversed(feed_parsed["entries"]):
+                    item_id = Item.get_id(entry)
+                    key = "%s%s" % (prefix, item_id)
+                    published_ids.add(item_id)
+
+                    # the known items are skipped without reading the database
+                    if self.__is_seen(seen_ids, item_id):
+                        lookups_avoided += 1
+                        continue
+
+                    # add a new item if the id doesn't exists
+                    if key not in records and not items_db.get(key):
+                        item = Item(entry, guesser)
+                        fingerprint = self.__flag_duplicate(feed.name, item)
+                        fingerprints.append((item.id, fingerprint, item.duplicate_of))
+                        records[key] = codec.dumps(item)
+                        articles.append((item.id, item.webpage_url))
+                        dates.append((item.id, item.published_ts))
+                        logging.info('add a new item : "%s"' % item.title)
+
+                # all new items are written at once
+                kc_util.set_bulk(items_db, records)
+                for item_id, _ in articles:
+                    bisect.insort(seen_ids, item_id)
+
+            self.lookups_avoided += lookups_avoided
+            logging.debug("%s known items of %s skipped" % (lookups_avoided, feed.name))
 
         except Exception as err:
             logging.error(err)
+            return False
 
-        finally:
-            items_db.close()
+        self.__prune_removed_ids(feed.name, published_ids)
+        # the fingerprints of items not stored would be found as originals
+        self.__add_fingerprints(feed.name, fingerprints)
+        self.__extract_articles(feed.name, feed.item_db_filename, articles)
+        self.__index_dates(feed.name, dates)
+        self.__log_events("add", feed.name, [item_id for item_id, _ in articles])
 
-        return updated
+        # keep the state of the server for the next conditional request,
+        # only once the items are stored: the next response can be a 304
+        etag = feed_parsed.get('etag', None)
+        modified = feed_parsed.get('modified', None)
+        feed_changed = (etag, modified) != (feed.etag, feed.modified)
+        feed.etag, feed.modified = etag, modified
 
-    def rm_feed(self, name):
-        """ Removes a feed with his name.
+        if guesser.detected_language != feed.detected_language:
+            feed.detected_language = guesser.detected_language
+            feed_changed = True
+            logging.info('language "%s" detected for the feed "%s"' % \
+                         (feed.detected_language, feed.name))
+
+        if feed_changed:
+            self.feeds_db.replace(feed.name, codec.dumps(feed))
+
+        return bool(records)
+
+    def __extract_articles(self, name, item_db_filename, articles):
+        """ Starts the extraction of the linked web pages of new items.
+
+        Args:
+            name (str): Name of the feed.
+            item_db_filename (str): Name of the items database.
+            articles (list of tuple): The item ids and the web page urls.
+
+        """
+        if not self.extractor:
+            return
+
+        for item_id, url in articles:
+            self.extractor.submit((name, item_db_filename, item_id), url)
+
+    def __flag_duplicate(self, name, item):
+        """ Flags a new item near-duplicate of a stored item.
+
+        The fingerprint is added to the index once the item is stored
+        (see __add_fingerprints).
 
-        The feed is removed from the feed and the item database.
-        
         Args:
             name (str): Name of the feed.
+            item (Item): The new item.
 
         Returns:
-            boolean: True if the item has been removed.
+            int: The fingerprint of the item or None.
+
+        """
+        if not self.dedup_index:
+            return
+
+        reference = "%s/%s" % (name, item.id)
+        fingerprint = simhash(item.title + u" " + item.abstract)
+
+        item.duplicate_of = self.dedup_index.find(fingerprint, exclude=reference, feed=name)
+        if item.duplicate_of:
+            logging.info('the item "%s" is a duplicate of %s' % (item.title, item.duplicate_of))
+
+        return fingerprint
+
+    def __add_fingerprints(self, name, fingerprints):
+        """ Adds the fingerprints of stored items to the index.
+
+        Args:
+            name (str): Name of the feed.
+            fingerprints (list of tuple): The item ids, their fingerprints 
+                and the references of their originals.
+
+        """
+        if not self.dedup_index:
+            return
+
+        try:
+            for item_id, fingerprint, duplicate_of in fingerprints:
+                self.dedup_index.add("%s/%s" % (name, item_id), fingerprint, duplicate_of)
+        except IOError as er:
+            logging.error(er)
+
+    def __rm_fingerprints(self, name, item_ids=None):
+        """ Removes the fingerprints of the items of a feed from the index.
+
+        The duplicates of the removed items get their new original.
+
+        Args:
+            name (str): Name of the feed.
+            item_ids (list, optional): Ids of the items, defaults to all items.
+
+        """
+        if not self.dedup_index:
+            return
+
+        try:
+            if item_ids is None:
+                originals = self.dedup_index.rm_feed(name)
+            else:
+                originals = self.dedup_index.rm(["%s/%s" % (name, item_id) for item_id in item_ids])
+        except IOError as er:
+            logging.error(er)
+            return
+
+        self.__set_originals(originals)
+
+    def __set_originals(self, originals):
+        """ Updates the original of duplicate items.
+
+        An "update" event is logged for each item: an item no more
+        duplicate is read again by the consumers.
+
+        Args:
+            originals (dict): The reference of the original by reference of
+            item, None if the item is no more a duplicate.
+
+        """
+        items_by_feed = {}
+        for reference, original in originals.items():
+            items_by_feed.setdefault(feed_name(reference), []).append(
+                    (int(reference.rsplit("/", 1)[1]), original))
+
+        for name, items in items_by_feed.items():
+            feed = self.get_feed(name)
+            if not feed:
+                continue
+
+            try:
+                with self.__items_db(feed.item_db_filename) as (items_db, prefix):
+                    records = {}
+                    for item_id, original in items:
+                        key = "%s%s" % (prefix, item_id)
+                        record = items_db.get(key)
+                        if record:
+                            item = codec.loads(record)
+                            item.duplicate_of = original
+                            records[key] = codec.dumps(item)
+                    kc_util.set_bulk(items_db, records)
+            except IOError as er:
+                logging.error(er)
+                continue
+
+            self.__log_events("update", name, [item_id for item_id, _ in items])
+
+    def __seen_ids(self, name, item_db_filename, items_db, prefix):
+        """ Returns the ids of the items of a feed.
+
+        The ids are read from the keys of the database the first time,
+        the values are not read. The ids of the items removed are included.
+
+        Args:
+            name (str): Name of the feed.
+            item_db_filename (str): Name of the items database.
+            items_db (kyotocabinet.DB): The database of items.
+            prefix (str): The prefix of the keys of the items.
+
+        Returns:
+            array.array: The sorted ids (unsigned long, 64 bits).
+
+        """
+        if item_db_filename not in self.seen_ids:
+            item_ids = set(int(item_id) for item_id in kc_util.gen_keys(items_db.cursor(), prefix))
+            item_ids.update(int(item_id) for item_id in
+                            kc_util.gen_keys(self.dates_db.cursor(), "r/%s/" % name))
+            self.seen_ids[item_db_filename] = array("L", sorted(item_ids))
+
+        return self.seen_ids[item_db_filename]
+
+    @staticmethod
+    def __is_seen(seen_ids, item_id):
+        """ Returns True if an item id is in the sorted ids of a feed.
+
+        Args:
+            seen_ids (array.array): The sorted ids.
+            item_id (int): The item id.
+
+        Returns:
+            boolean: True if the item is known.
+
+        """
+        i = bisect.bisect_left(seen_ids, item_id)
+        return i < len(seen_ids) and seen_ids[i] == item_id
+
+    def __language_guesser(self, name, language=None, detected_language=None):
+        """ Returns the guesser of the language of the items of a feed.
+
+        The guesser is kept between two updates, so the sampling goes on.
+
+        Args:
+            name (str): Name of the feed.
+            language (str, optional): Code of the language declared for the feed.
+            detected_language (str, optional): Code of the language detected for the feed.
+
+        Returns:
+            LanguageGuesser: The guesser of the feed.
+
+        """
+        if name not in self.language_guessers:
+            self.language_guessers[name] = LanguageGuesser(
+                    language, detected_language, cache=self.language_cache)
+
+        return self.language_guessers[name]
+
+    ###########################################################################
+    # Event log
+    ###########################################################################
+
+    def __log_events(self, action, name, item_ids):
+        """ Appends events to the log, one event by item.
+
+        Args:
+            action (str): "add", "update", "tag", "rm" or "rm_feed".
+            name (str): Name of the feed.
+            item_ids (list): Ids of the items changed.
+
+        """
+        if not item_ids:
+            return
+
+        with self.lock:
+            records = {}
+            for item_id in item_ids:
+                self.event_seq += 1
+                event = Event(self.event_seq, action, name,
+                              item_id and int(item_id))
+                records[Event.key(self.event_seq)] = codec.dumps(event)
+
+            try:
+                kc_util.set_bulk(self.events_db, records)
+            except IOError as er:
+                # the sequence numbers are not used
+                self.event_seq -= len(records)
+                logging.error(er)
+
+    def __feed_name(self, item_db_filename):
+        """ Returns the name of the feed of a database of items.
+
+        Args:
+            item_db_filename (str): Name of the items database.
+
+        Returns:
+            str: Name of the feed or None.
+
+        """
+        namespace = self.__namespace(item_db_filename)
+        if namespace:
+            return namespace
+
+        for name, feed in self.get_feeds():
+            if feed.item_db_filename == item_db_filename:
+                return name
+
+    ###########################################################################
+    # Bodies
+    ###########################################################################
+
+    def __load_body(self, name, item_id, item):
+        """ Sets the text of the web page of an item from the database of bodies.
+
+        The items stored before the database of bodies keep their text.
+
+        Args:
+            name (str): Name of the feed.
+            item_id (str): Id of the item.
+            item (Item): The item.
+
+        Returns:
+            Item: The item.
+
+        """
+        with self.lock:
+            text = self.bodies_db.get("%s/%s" % (name, item_id))
+
+        if text is not None:
+            item.webpage_text = codec.unpack_text(text)
+
+        return item
+
+    def __rm_bodies(self, name, item_ids=None):
+        """ Removes the texts of the web pages of the items of a feed.
+
+        Args:
+            name (str): Name of the feed.
+            item_ids (list, optional): Ids of the items, defaults to all items.
+
+        """
+        with self.lock:
+            if item_ids is None:
+                keys = self.bodies_db.match_prefix("%s/" % name)
+            else:
+                keys = ["%s/%s" % (name, item_id) for item_id in item_ids]
+
+            removed = self.bodies_db.remove_bulk(keys, True) if keys else 0
+            if removed < 0:
+                logging.error("can't remove the bodies of %s: %s" % \
+                              (name, self.bodies_db.error()))
+            elif removed:
+                self.removed_items[BODIES_DB_FILENAME] = \
+                        self.removed_items.get(BODIES_DB_FILENAME, 0) + removed
+
+    ###########################################################################
+    # Date index
+    ###########################################################################
+
+    def __index_dates(self, name, dates):
+        """ Adds items to the index of publication dates.
+
+        Keys of the database:
+         - "t/<timestamp>/<feed name>/<item id>": the items sorted by date;
+         - "f/<feed name>/<item id>": the timestamp, to remove the items of a feed;
+         - "r/<feed name>/<item id>": the items removed (see __add_removed_ids).
+
+        An item without a publication date is indexed at the time of the collect.
+
+        Args:
+            name (str): Name of the feed.
+            dates (list of tuple): The item ids and the timestamps of publication.
+
+        """
+        now = int(time.time())
+
+        records = {}
+        for item_id, timestamp in dates:
+            timestamp = now if timestamp is None else int(timestamp)
+            records[self.__date_key(timestamp, name, item_id)] = ""
+            records["f/%s/%s" % (name, item_id)] = str(timestamp)
+
+        try:
+            kc_util.set_bulk(self.dates_db, records)
+        except IOError as er:
+            logging.error(er)
+
+    def __rm_dates(self, name, item_ids=None):
+        """ Removes the items of a feed from the index of publication dates.
+
+        Args:
+            name (str): Name of the feed.
+            item_ids (list, optional): Ids of the items, defaults to all items.
+
+        """
+        prefix = "f/%s/" % name
+        if item_ids is None:
+            keys = self.dates_db.match_prefix(prefix)
+        else:
+            keys = ["%s%s" % (prefix, item_id) for item_id in item_ids]
+
+        for key, timestamp in self.dates_db.get_bulk(keys, False).items():
+            keys.append(self.__date_key(int(timestamp), name, key[len(prefix):]))
+        if item_ids is None:
+            # the ids of the items removed are forgotten with the feed
+            keys.extend(self.dates_db.match_prefix("r/%s/" % name))
+
+        if keys and self.dates_db.remove_bulk(keys, True) < 0:
+            logging.error("can't remove the dates of %s: %s" % (name, self.dates_db.error()))
+
+    def __add_removed_ids(self, name, item_ids):
+        """ Records the ids of the items removed from a feed.
+
+        The ids are read with the ids of the known items after a restart,
+        so the items still published are not added again (see __seen_ids).
+
+        Args:
+            name (str): Name of the feed.
+            item_ids (list): Ids of the items.
+
+        """
+        try:
+            kc_util.set_bulk(self.dates_db, dict(("r/%s/%s" % (name, item_id), "")
+                                                 for item_id in item_ids))
+        except IOError as er:
+            logging.error(er)
+
+    def __prune_removed_ids(self, name, published_ids):
+        """ Forgets the ids of the items removed which are not published anymore.
+
+        Args:
+            name (str): Name of the feed.
+            published_ids (set of int): Ids of the items published by the feed.
+
+        """
+        prefix = "r/%s/" % name
+        keys = [key for key in self.dates_db.match_prefix(prefix)
+                if int(key[len(prefix):]) not in published_ids]
+
+        if keys and self.dates_db.remove_bulk(keys, True) < 0:
+            logging.error("can't remove the ids of %s: %s" % (name, self.dates_db.error()))
+
+    @staticmethod
+    def __date_key(timestamp, name, item_id):
+        """ Returns the key of an item in the index of publication dates.
+
+        The timestamps have a fixed width, so the keys are sorted by date.
+
+        Args:
+            timestamp (int): Timestamp of the publication.
+            name (str): Name of the feed.
+            item_id (int): Id of the item.
+
+        Returns:
+            str: The key.
+
+        """
+        return "t/%012d/%s/%s" % (max(timestamp, 0), name, item_id)
+
+    ###########################################################################
+    # Items databases
+    ###########################################################################
+
+    @contextmanager
+    def __items_db(self, item_db_filename, create=False):
+        """ Opens the database of items of a feed.
+
+        The keys of the items are the prefix followed by the item id.
+        The prefix is empty if the feed has its own database file.
+
+        The database is taken from the open databases if possible
+        and it stays open after use.
+
+        Args:
+            item_db_filename (str): Name of the items database.
+            create (boolean, optional): Create the database if it doesn't exist.
+
+        Yields:
+            tuple (kyotocabinet.DB, str): The database and the prefix of the keys.
+
+        Raises:
+            IOError: The database can't be opened.
+
+        """
+        namespace = self.__namespace(item_db_filename)
+        if namespace:
+            with self.lock:
+                items_db = self.__shared_items_db()
+                self.shared_items_db_users += 1
+
+            try:
+                yield items_db, "%s/" % namespace
+            finally:
+                with self.lock:
+                    self.shared_items_db_users -= 1
+            return
+
+        with self.lock:
+            items_db = self.__open_items_db(item_db_filename, create)
+
+        try:
+            yield items_db, ""
+        finally:
+            with self.lock:
+                self.__release_items_db(item_db_filename)
+
+    def __open_items_db(self, item_db_filename, create=False):
+        """ Returns an open database of items and marks it as used.
+
+        The lock must be held.
+
+        Args:
+            item_db_filename (str): Name of the items database.
+            create (boolean, optional): Create the database if it doesn't exist.
+
+        Returns:
+            kyotocabinet.DB: The database.
+
+        Raises:
+            IOError: The database can't be opened.
 
         """
-        feed = self.get_feed(name)
-        
-        # remove the item database
-        try:
-            os.remove(feed.item_db_filename)
+        if item_db_filename in self.items_dbs:
+            entry = self.items_dbs.pop(item_db_filename)
+        else:
+            mode = storage.OWRITER
+            if create:
+                mode |= storage.OCREATE
 
-        except AttributeError as er:   
-            # feed can be None with get_feed()
-            if feed:
-                logging.error(er)
-            return False
-        except OSError as er:
-            # print the error and quit if the file exists
-            if os.path.isfile(feed.item_db_filename):
-                logging.error(er)
-                return False
-            logging.debug(er)
+            items_db = storage.new_db()
+            if not items_db.open(item_db_filename, mode):
+                raise IOError("can't open %s: %s" % (item_db_filename, items_db.error()))
+            entry = [items_db, 0]
 
-        # remove the feed from the feeds database 
-        self.feeds_db.remove(name)
-        logging.info("feed %s removed", name)
+        # the most recently used database is the last one
+        entry[1] += 1
+        self.items_dbs[item_db_filename] = entry
 
-        return True
+        return entry[0]
 
-    def update_feed_tag(self, name, tag):
-        """ Updates the category/tag of a feed.
+    def __release_items_db(self, item_db_filename):
+        """ Marks a database of items as unused.
+
+        The least recently used databases are closed if too many are open,
+        a database in use is never closed.
+        The lock must be held.
 
         Args:
-            name (str): Name of the feed.
-            tag (str): Category/tag of the feed.
+            item_db_filename (str): Name of the items database.
 
         """
-        feed = self.get_feed(name)
-        feed.tag = tag
-        self.feeds_db.replace(name, pickle.dumps(feed))
+        entry = self.items_dbs.get(item_db_filename)
+        if entry:
+            entry[1] -= 1
 
-    def update_item_tag(self, item_db_filename, item_id, tag):
-        """ Updates the category/tag of an item.
+        for filename, (_, users) in self.items_dbs.items():
+            if len(self.items_dbs) <= self.items_dbs_size:
+                break
+            if not users:
+                self.__close_items_db(filename)
+
+    def __close_items_db(self, item_db_filename):
+        """ Closes a database of items if it is open.
+
+        The lock must be held.
 
         Args:
             item_db_filename (str): Name of the items database.
-            item_id (int): Id of the item to update.
-            tag (str): Category/tag of the item.
+
+        """
+        entry = self.items_dbs.pop(item_db_filename, None)
+        if entry:
+            entry[0].close()
+
+    def __compact_items_db(self, filename, removed, ratio):
+        """ Rebuilds a database of items in a new file which replaces the old file.
+
+        A SQLite database is rebuilt in place (VACUUM): the readers of other
+        processes keep the file they opened.
+
+        The lock must be held.
+
+        Args:
+            filename (str): Name of the database file.
+            removed (int): Number of items removed since the last compaction.
+            ratio (float): Part of the items removed to rebuild the database.
 
         Returns:
-            Item: The updated item is returned.
+            boolean: True if the database has been rebuilt.
+
+        Raises:
+            IOError: The database can't be read or written.
+            OSError: The new file can't replace the old file.
 
         """
+        opened = False
+        if filename == ITEMS_DB_FILENAME:
+            if self.shared_items_db_users:
+                return False
+            items_db = self.__shared_items_db()
+
+        elif filename == BODIES_DB_FILENAME:
+            # the bodies are only read with the lock
+            items_db = self.bodies_db
+
+        elif filename in self.items_dbs:
+            items_db, users = self.items_dbs[filename]
+            if users:
+                return False
+
+        else:
+            items_db = storage.new_db()
+            if not items_db.open(filename, storage.OWRITER):
+                # the feed has been removed
+                self.removed_items.pop(filename, None)
+                return False
+            opened = True
+
+        if removed < ratio * (len(items_db) + removed):
+            if opened:
+                items_db.close()
+            return False
+
+        old_size = items_db.size()
+        if isinstance(items_db, storage.SQLiteDB):
+            try:
+                if not items_db.vacuum():
+                    raise IOError("can't compact %s: %s" % (filename, items_db.error()))
+                new_size = items_db.size()
+            finally:
+                if opened:
+                    items_db.close()
+
+            self.removed_items.pop(filename, None)
+            logging.info("%s compacted from %s to %s bytes" % (filename, old_size, new_size))
+            return True
+
+        root, ext = os.path.splitext(filename)
+        new_filename = "%s_compact%s" % (root, ext)
+        new_db = storage.new_db()
+        if not new_db.open(new_filename, storage.OWRITER | storage.OCREATE | storage.OTRUNCATE):
+            raise IOError("can't open %s: %s" % (new_filename, new_db.error()))
+
         try:
-            items_db = kc.DB()
-            items_db.open(item_db_filename, kc.DB.OWRITER)
+            # the items are copied by batches
+            records = {}
+            for key, record in kc_util.gen_records(items_db.cursor()):
+                records[key] = record
 
-            item = pickle.loads(items_db.get(item_id))
-            item.tag = tag
+                if len(records) >= 1000:
+                    kc_util.set_bulk(new_db, records)
+                    records = {}
 
-            items_db.replace(item_id, pickle.dumps(item)) 
-        except Exception as er:
-            logging.error(er)
+            kc_util.set_bulk(new_db, records)
+            new_size = new_db.size()
         finally:
+            new_db.close()
+
+        if filename == ITEMS_DB_FILENAME:
+            self.shared_items_db.close()
+            self.shared_items_db = None
+        elif filename in self.items_dbs:
+            self.__close_items_db(filename)
+        else:
             items_db.close()
 
-        return item
+        os.rename(new_filename, filename)
+        if filename == BODIES_DB_FILENAME:
+            self.bodies_db.open(BODIES_DB_FILENAME, storage.OWRITER | storage.OCREATE)
+        self.removed_items.pop(filename, None)
+        logging.info("%s compacted from %s to %s bytes" % (filename, old_size, new_size))
 
-    def has_feed(self, name):
-        """ Returns true or false if the feed exists.
+        return True
+
+    def __shared_items_db(self):
+        """ Returns the database of items shared by feeds.
+
+        Returns:
+            kyotocabinet.DB: The shared database, opened the first time.
+
+        """
+        with self.lock:
+            if not self.shared_items_db:
+                items_db = storage.new_db()
+                if not items_db.open(ITEMS_DB_FILENAME, storage.OWRITER | storage.OCREATE):
+                    raise IOError("can't open %s: %s" % (ITEMS_DB_FILENAME, items_db.error()))
+                self.shared_items_db = items_db
+
+        return self.shared_items_db
+
+    @staticmethod
+    def __namespace(item_db_filename):
+        """ Returns the feed namespace of an item database filename.
 
         Args:
-            name (str): Name of the feed.
+            item_db_filename (str): Name of the items database.
+
+        Returns:
+            str: The namespace in the shared database or None for a database file.
 
         """
-        return bool(self.feeds_db.get(name))
+        shared_prefix = "%s/" % ITEMS_DB_FILENAME
+        if item_db_filename.startswith(shared_prefix):
+            return item_db_filename[len(shared_prefix):]
 
     ###########################################################################
     # Print 
@@ -314,19 +1557,26 @@ class Collector:
     # Getter
     ###########################################################################
 
-    def get_text_from_items(self, name):
+    def get_text_from_items(self, name, duplicates=False):
         """ Returns a generator of texts from items.
 
         The title, abstract and webpage text are extracted.
 
         Args:
             name (str): Name of the feed.
+            duplicates (boolean, optional): Also returns the near-duplicate items.
 
         Yields:
             tuple (Item, str): A generator of tuples.
 
         """
-        for _, item in self.get_items(name):
+        for item_id, item in self.get_items(name, Item.header_fields):
+            if item.duplicate_of and not duplicates:
+                continue
+
+            # the body of the duplicates is not read
+            self.__load_body(name, item_id, item)
+
             text = item.title+" "
             text += item.abstract+" "
             text += item.webpage_text+" "
@@ -344,9 +1594,9 @@ class Collector:
             Feed: a feed object.
 
         """
-        pickle_feed = self.feeds_db.get(name)
+        feed_record = self.feeds_db.get(name)
         try:
-            return pickle.loads(pickle_feed)
+            return codec.loads(feed_record)
 
         except TypeError:
             logging.info('the feed with the name "%s" doesn\'t exists' % name)
@@ -366,24 +1616,43 @@ class Collector:
         except Exception as er:
             logging.error(er)
 
-    def get_items(self, name):
+    def get_feeds_name(self):
+        """ Returns the names of the feeds.
+
+        Only the keys are read, the feeds are not decoded.
+
+        Returns:
+            list of str: A list of names.
+
+        """
+        return list(kc_util.gen_keys(self.feeds_db.cursor()))
+
+    def get_items(self, name, fields=None):
         """ Returns feed's items with the generator.
+
+        The text of the web page is only read if the field "webpage_text" is asked,
+        otherwise the items have an empty text (see Item.header_fields). The other
+        fields not asked are not decoded (the large texts are not decompressed):
+        they have their default value or are unset.
         
         Args:
             name (str): Name of the feed.
+            fields (list of str, optional): Fields of the items read, defaults to all.
 
         Yields:
             tuple (str, Item): A generator of tuple (item id, item obj).
 
         """
         feed = self.get_feed(name)
+        body = fields is None or "webpage_text" in fields
 
         try:
-            items_db = kc.DB()
-            items_db.open(feed.item_db_filename, kc.DB.OREADER)
-
-            for item in kc_util.gen_db(items_db.cursor()):
-                yield item
+            with self.__items_db(feed.item_db_filename) as (items_db, prefix):
+                for item_id, item_record in kc_util.gen_records(items_db.cursor(), prefix):
+                    item = codec.loads(item_record, fields)
+                    if body:
+                        self.__load_body(name, item_id, item)
+                    yield item_id, item
 
         except AttributeError as er:   
             # feed can be None
@@ -392,16 +1661,156 @@ class Collector:
 
         except Exception as er:
             logging.error(er)
-            
-        finally:
-            items_db.close()
+
+
+    def get_item(self, name, item_id, fields=None):
+        """ Retrieves an item of a feed from its id.
+
+        Args:
+            name (str): Name of the feed.
+            item_id (int): Id of the item.
+            fields (list of str, optional): Fields of the item read, defaults to all
+            (see get_items).
+
+        Returns:
+            Item: The item or None if the item doesn't exist.
+
+        """
+        feed = self.get_feed(name)
+        if not feed:
+            return None
+
+        try:
+            with self.__items_db(feed.item_db_filename) as (items_db, prefix):
+                item_record = items_db.get("%s%s" % (prefix, item_id))
+
+        except Exception as er:
+            logging.error(er)
+            return None
+
+        if not item_record:
+            return None
+
+        item = codec.loads(item_record, fields)
+        if fields is None or "webpage_text" in fields:
+            self.__load_body(name, item_id, item)
+
+        return item
+
+    def get_item_dates(self, name):
+        """ Returns the publication dates of the items of a feed.
+
+        Only the index of publication dates is read.
+
+        Args:
+            name (str): Name of the feed.
+
+        Returns:
+            list of tuple (str, int): The item ids and the timestamps
+            sorted by publication date.
+
+        """
+        prefix = "f/%s/" % name
+        records = self.dates_db.get_bulk(self.dates_db.match_prefix(prefix), False)
+
+        return sorted(((key[len(prefix):], int(timestamp))
+                       for key, timestamp in records.items()), key=lambda r: r[1])
+
+    def get_items_since(self, timestamp, feeds=None):
+        """ Returns the items published since a date.
+
+        Args:
+            timestamp (float): Timestamp of the first date.
+            feeds (list of str, optional): Names of the feeds, defaults to all feeds.
+
+        Yields:
+            tuple (str, str, Item): A generator of tuples (feed name, item id, item obj)
+            sorted by publication date.
+
+        """
+        return self.get_items_between(timestamp, None, feeds)
+
+    def get_items_between(self, start, end, feeds=None):
+        """ Returns the items published in a period.
+
+        Only the index of publication dates is scanned,
+        the items out of the period are not read.
+
+        Args:
+            start (float): Timestamp of the first date.
+            end (float): Timestamp of the end of the period (excluded) or None.
+            feeds (list of str, optional): Names of the feeds, defaults to all feeds.
+
+        Yields:
+            tuple (str, str, Item): A generator of tuples (feed name, item id, item obj)
+            sorted by publication date.
+
+        """
+        feeds = feeds and set(feeds)
+        start_key = "%012d/" % max(int(start), 0)
+        end_key = end is not None and "%012d/" % max(int(end), 0) or None
+
+        for key in kc_util.gen_keys(self.dates_db.cursor(), "t/", start_key, end_key):
+            name, item_id = key[13:].rsplit("/", 1)
+            if feeds and name not in feeds:
+                continue
+
+            item = self.get_item(name, item_id)
+            if item:
+                yield name, item_id, item
+
+    def get_events(self, after=0):
+        """ Returns the events of the log after a sequence number.
+
+        Args:
+            after (int, optional): Sequence number of the last event already processed.
+
+        Yields:
+            Event: The events in the order of their sequence number.
+
+        """
+        for _, event in kc_util.gen_db(self.events_db.cursor(), start=Event.key(after + 1)):
+            yield event
+
+    def rm_events(self, seq):
+        """ Removes the events processed by all the consumers of the log.
+
+        The last event is kept: the sequence numbers go on from it
+        after a restart.
+
+        Args:
+            seq (int): Sequence number of the last event to remove, the lowest
+            watermark of the consumers (see Classifier.get_watermark and
+            Indexer.get_watermark).
+
+        Returns:
+            int: The number of events removed.
+
+        """
+        removed = 0
+
+        with self.lock:
+            end = Event.key(min(seq, self.event_seq - 1) + 1)
+            keys = list(kc_util.gen_keys(self.events_db.cursor(), end=end))
+
+            for i in xrange(0, len(keys), 1000):
+                count = self.events_db.remove_bulk(keys[i:i + 1000], True)
+                if count < 0:
+                    logging.error("can't remove the events: %s" % self.events_db.error())
+                    break
+                removed += count
+
+        logging.info("%s events removed" % removed)
+
+        return removed
 
     
-class Feed:
+class Feed(object):
     """ A feed contains all information about a specific feed.  
     
     The purpose of this class is to be stored in a main database of feeds.
     A feed is linked to a database of items, with the item database filename.
+    The filename can be a namespace of the shared database of items (SHARED_ITEMS_DB).
     
     A feed has a tag which can be science, business, sport...
     
@@ -409,6 +1818,9 @@ class Feed:
      - the state of the server with the field 'etag' and 'modified'.
      - the url of the feed server.
 
+    The language declared for the feed and the language detected on its items
+    are hints to guess the language of new items (see LanguageGuesser).
+
     Attributes:
         name (str): Name of the feed.
         item_db_filename (str): Name of the linked database of items.
@@ -416,9 +1828,15 @@ class Feed:
         tag (str): Tag chosen.
         etag (unicode): Unique tag provided by the feed server.
         modified (str): Date provided by the feed server.
+        language (str): Code of the language declared for the feed or None.
+        detected_language (str): Code of the stable language of the items or None.
     
     """
-    def __init__(self, name, item_db_filename, url, tag, etag=None, modified=None):
+    __slots__ = ("name", "item_db_filename", "url", "tag", "etag", "modified",
+                 "language", "detected_language")
+
+    def __init__(self, name, item_db_filename, url, tag, etag=None, modified=None,
+                 language=None, detected_language=None):
         """ Set information about items and the state of the feed server.
 
         Args:
@@ -428,6 +1846,8 @@ class Feed:
             tag (str): Tag chosen.
             etag (unicode, optional): Unique tag provided by the feed server, defaults to None.
             modified (str, optional): Date provided by the feed server, defaults to None.
+            language (str, optional): Code of the language declared for the feed.
+            detected_language (str, optional): Code of the language detected for the feed.
 
         """
         self.name = name
@@ -436,6 +1856,8 @@ class Feed:
         self.tag = tag
         self.etag = etag
         self.modified = modified
+        self.language = language
+        self.detected_language = detected_language
 
     def __str__(self):
         return (
@@ -443,40 +1865,64 @@ class Feed:
             "url         : %s\n"
             "tag         : %s\n"
             "etag        : %s\n"
-            "modified    : %s" % (
+            "modified    : %s\n"
+            "language    : %s" % (
                 self.item_db_filename,
                 self.url, self.tag,
                 self.etag or "",
-                self.modified or ""))
+                self.modified or "",
+                self.language or self.detected_language or ""))
+
+# the feeds stored without a language have the defaults
+codec.register(1, Feed, Feed.__slots__,
+               {"language": None, "detected_language": None})
 
 
-class Item:
+class Item(object):
     """ An Item encapsulate information about a specific feed item.
 
     Attributes:
         id (int): The id of the item.
         title (unicode): Title of the item.
         webpage_url (unicode): Url of the linked web page.
-        webpage_text (str): Text extracted from the web page.
+        webpage_text (unicode): Text extracted from the web page (the body).
         published_date (unicode): Date of the publication.
+        published_ts (float): Timestamp of the publication or None
+        if the date can't be read.
         abstract (unicode): Abstract about the item.
         language (str): Language of the item.
         tag (str): Category/Tag of the item.
+        duplicate_of (str): Reference "feed name/item id" of a near-duplicate
+        item stored before or None.
 
     The tag is not set from the contrustor but with the method "update_item_tag".
+    The text of the web page is stored apart from the other fields
+    (see Collector.get_items).
 
     """
+    __slots__ = ("id", "title", "webpage_url", "webpage_text", "published_date",
+                 "published_ts", "abstract", "language", "tag", "duplicate_of")
+
     language_code = {"fr": u"french", "en":u"english"}
+
+    # fields stored in the database of items, without the body
+    header_fields = ("id", "title", "webpage_url", "published_date", "published_ts",
+                     "abstract", "language", "tag", "duplicate_of")
     
-    def __init__(self, item_data):
+    def __init__(self, item_data, guesser=None):
         """ Populates variables by parsing a provided dictionary.
 
         Args:
             item_data (feedparser.FeedParserDict): A dictionary full of item information.
+            guesser (LanguageGuesser, optional): Guesses the language with the hints
+            of the feed, defaults to a detection on the abstract.
 
         """
-        abstract = BeautifulSoup.BeautifulSoup(item_data["summary"]).text
-        language = guessLanguage(abstract) or item_data["title_detail"]["language"] 
+        abstract = html_to_text(item_data["summary"])
+        if guesser:
+            language = guesser.guess(abstract, item_data["title_detail"].get("language"))
+        else:
+            language = guessLanguage(abstract) or item_data["title_detail"]["language"] 
         
         try:
             self.language = self.language_code[language]
@@ -489,22 +1935,19 @@ class Item:
                 
         self.webpage_url = item_data["link"]
         self.published_date = item_data["published"]
+        self.published_ts = Item.get_timestamp(item_data)
         self.title = item_data["title"]
         self.abstract = abstract
 
         # hash from the title and the feed url
         self.id = Item.get_id(item_data)
         
+        # the text of the linked web page is set later 
+        # by the article extractor (see Collector.update_articles)
         self.webpage_text = u""
-        if ACTIVE_ACTICLE_EXTRACTOR:
-            try:
-                # extract the text of the linked web page. 
-                extractor = Extractor(extractor='ArticleExtractor', url=self.webpage_url)
-                self.webpage_text = extractor.getText()
-            except Exception as er:
-                logging.warning("can't extract the article")
-                logging.warning('url was "%s"'%self.webpage_url)
-                logging.debug(er)
+
+        # set by the collector (see Collector.__flag_duplicate)
+        self.duplicate_of = None
     
     def __str__(self):
         s = (
@@ -524,6 +1967,9 @@ class Item:
         if hasattr(self, "tag"):
             s += "\ncategorie   : %s" % self.tag
 
+        if self.duplicate_of:
+            s += "\nduplicate of: %s" % self.duplicate_of
+
         return s.encode("utf-8", "remplace")
     
     @staticmethod
@@ -541,7 +1987,235 @@ class Item:
         """
         return abs(hash(item_data["title"]+item_data["title_detail"]["base"]))
 
-        
+    @staticmethod
+    def get_timestamp(item_data):
+        """ Returns the timestamp of the publication date of an item.
+
+        The date parsed by feedparser is used if possible, otherwise the date
+        is read like "Tue, 04 Nov 2014 02:19:30 GMT".
+
+        Args:
+            item_data (feedparser.FeedParserDict): A dictionary full of item information.
+
+        Returns:
+            float: The timestamp or None if the date can't be read.
+
+        """
+        published_parsed = item_data.get("published_parsed")
+        try:
+            if published_parsed:
+                # feedparser gives the date in UTC
+                return float(calendar.timegm(published_parsed))
+
+            return float(mktime_tz(parsedate_tz(item_data.get("published"))))
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+# the items stored without the attributes have the defaults,
+# the tag stays unset until "update_item_tag"
+codec.register(2, Item, Item.__slots__,
+               {"webpage_text": u"", "published_ts": None, "duplicate_of": None})
+
+
+class Event(object):
+    """ A change of the items of a feed, stored in the event log of the collector.
+
+    The actions are:
+     - "add": a new item is stored;
+     - "update": the text of the linked web page is stored, or the item
+       is no more the duplicate of a removed item;
+     - "tag": the tag of the item has changed;
+     - "rm": the item is removed (see Collector.rm_items);
+     - "rm_feed": the feed and its items are removed (the item id is None).
+
+    Attributes:
+        seq (int): Sequence number of the event.
+        action (str): The change.
+        name (str): Name of the feed.
+        item_id (int): Id of the item.
+
+    """
+    __slots__ = ("seq", "action", "name", "item_id")
+
+    def __init__(self, seq, action, name, item_id):
+        """ Sets the change.
+
+        Args:
+            seq (int): Sequence number of the event.
+            action (str): The change.
+            name (str): Name of the feed.
+            item_id (int): Id of the item.
+
+        """
+        self.seq = seq
+        self.action = action
+        self.name = name
+        self.item_id = item_id
+
+    def __str__(self):
+        return "%s %s %s %s" % (self.seq, self.action, self.name, self.item_id)
+
+    @staticmethod
+    def key(seq):
+        """ Returns the key of an event, the keys are sorted by sequence number.
+
+        Args:
+            seq (int): Sequence number of the event.
+
+        Returns:
+            str: The key.
+
+        """
+        return "%020d" % seq
+
+codec.register(7, Event, Event.__slots__)
+
+
+class LanguageGuesser:
+    """ Guesses the language of the items of a feed.
+
+    The language declared for the feed, or else the stable language detected
+    on its items, is used for most items. The abstract of an item is only
+    detected:
+     - for one item in "sample_rate", to follow a change of language;
+     - when the feed has no hint yet;
+     - when the hints disagree (declared and detected language of the feed,
+       language of the item title).
+
+    The feed language is detected when the same language is found for
+    "stable_votes" items in a row. The languages of short abstracts are kept
+    in a cache by hash, the cache can be shared by the guessers of many feeds.
+
+    Examples:
+    >>> guesser = LanguageGuesser("fr")
+    >>> guesser.guess(u"Le gouvernement a annoncé mardi ...", "fr")
+    'fr'
+
+    Attributes:
+        language (str): Code of the language declared for the feed or None.
+        detected_language (str): Code of the stable language of the items or None.
+        sample_rate (int): One item in "sample_rate" is detected.
+        stable_votes (int): Number of detections in a row to trust a language.
+        cache (OrderedDict): Languages of short abstracts by hash.
+        candidate (str): Code of the language of the last detections.
+        votes (int): Number of detections in a row of the candidate.
+        count (int): Number of items since the last detection.
+        detections (int): Number of abstracts really detected.
+
+    """
+    unknown = "UNKNOWN"
+
+    def __init__(self, language=None, detected_language=None,
+                 sample_rate=LANGUAGE_SAMPLE_RATE, stable_votes=LANGUAGE_STABLE_VOTES,
+                 cache=None):
+        """ Sets the hints of the feed.
+
+        Args:
+            language (str, optional): Code of the language declared for the feed.
+            detected_language (str, optional): Code of the language detected for the feed.
+            sample_rate (int, optional): One item in "sample_rate" is detected.
+            stable_votes (int, optional): Number of detections in a row to trust a language.
+            cache (OrderedDict, optional): Languages of short abstracts by hash.
+
+        """
+        self.language = self.__code(language)
+        self.detected_language = self.__code(detected_language)
+        self.sample_rate = sample_rate
+        self.stable_votes = stable_votes
+        self.cache = OrderedDict() if cache is None else cache
+        self.candidate = self.detected_language
+        self.votes = stable_votes if self.detected_language else 0
+        self.count = 0
+        self.detections = 0
+
+    def guess(self, abstract, title_language=None):
+        """ Returns the language of an item.
+
+        Args:
+            abstract (unicode): Abstract of the item.
+            title_language (str, optional): Language of the item title given by the feed.
+
+        Returns:
+            str: The code of the language.
+
+        """
+        hint = self.language or self.detected_language
+        title_language = self.__code(title_language)
+
+        disagree = (self.language and self.detected_language and
+                    self.language != self.detected_language) or \
+                   (hint and title_language and title_language != hint)
+
+        self.count += 1
+        if hint and not disagree and self.count < self.sample_rate:
+            return hint
+        self.count = 0
+
+        language = self.__detect(abstract)
+        if language == self.unknown:
+            return hint or title_language or language
+
+        self.__vote(language)
+        return language
+
+    def __detect(self, abstract):
+        """ Detects the language of an abstract, short abstracts are cached.
+
+        Args:
+            abstract (unicode): Abstract of the item.
+
+        Returns:
+            str: The code of the language or "UNKNOWN".
+
+        """
+        if len(abstract) > LANGUAGE_CACHE_MAX_LENGTH:
+            self.detections += 1
+            return guessLanguage(abstract)
+
+        key = hash(abstract)
+        language = self.cache.pop(key, None)
+        if not language:
+            self.detections += 1
+            language = guessLanguage(abstract)
+
+        # the most recently used language is at the end
+        self.cache[key] = language
+        if len(self.cache) > LANGUAGE_CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+        return language
+
+    def __vote(self, language):
+        """ Counts a detection to find the stable language of the feed.
+
+        Args:
+            language (str): The code of the language detected.
+
+        """
+        if language == self.candidate:
+            self.votes += 1
+        else:
+            self.candidate, self.votes = language, 1
+
+        if self.votes >= self.stable_votes:
+            self.detected_language = language
+
+    @staticmethod
+    def __code(language):
+        """ Returns the code of a language like "fr" for "FR" or "fr-FR".
+
+        Args:
+            language (str): The language or None.
+
+        Returns:
+            str: The code of the language or None.
+
+        """
+        if not language:
+            return None
+        return str(language[:2].lower())
+
+
 ###########################################################################
 # Collector Example
 ###########################################################################
@@ -553,13 +2227,11 @@ if __name__ == "__main__":
     
     def add_feeds_test():
         logging.info("add feeds")
-        for name, url, tag, _ in feeds:
-            collector.add_feed(name, url, tag)
+        collector.add_feeds(feeds)
             
     def update_feeds_test():
         logging.info("update feeds")
-        for name, _,_,_ in feeds:
-            collector.update_feed(name)
+        collector.update_feeds([name for name, _,_,_ in feeds])
 
     def rm_feeds_test():
         logging.info("remove feeds")
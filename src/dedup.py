@@ -0,0 +1,292 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Finds the near-duplicate items of the feeds.
+#
+
+import storage
+import kyotocabinetutil as kc_util
+
+import re, hashlib
+from collections import Counter
+
+from settings import DEDUP_DB_FILENAME, DEDUP_MAX_DISTANCE
+
+import logging
+if __name__ == "__main__":
+    format_str = "%(asctime)s %(levelname)s %(funcName)s: %(message)s"
+    logging.basicConfig(format=format_str, level=logging.DEBUG)
+
+FINGERPRINT_BITS = 64
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def simhash(text):
+    """ Returns the SimHash fingerprint of a text.
+
+    Each word votes for the bits of its hash, weighted by its frequency.
+    Two texts with the same words mostly have fingerprints
+    with only a few different bits.
+
+    Args:
+        text (unicode): The text.
+
+    Returns:
+        int: The 64 bits fingerprint or None if the text has no word.
+
+    """
+    words = Counter(WORD_RE.findall(text.lower()))
+    if not words:
+        return None
+
+    votes = [0] * FINGERPRINT_BITS
+    for word, count in words.iteritems():
+        word_hash = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:16], 16)
+        for bit in range(FINGERPRINT_BITS):
+            if word_hash >> bit & 1:
+                votes[bit] += count
+            else:
+                votes[bit] -= count
+
+    return sum(1 << bit for bit, vote in enumerate(votes) if vote > 0)
+
+def feed_name(reference):
+    """ Returns the name of the feed of an item.
+
+    Args:
+        reference (str): Reference of the item "feed name/item id".
+
+    Returns:
+        str: Name of the feed.
+
+    """
+    return reference.rsplit("/", 1)[0]
+
+def distance(fingerprint_1, fingerprint_2):
+    """ Returns the number of different bits of two fingerprints.
+
+    Args:
+        fingerprint_1 (int): The first fingerprint.
+        fingerprint_2 (int): The second fingerprint.
+
+    Returns:
+        int: The Hamming distance.
+
+    """
+    return bin(fingerprint_1 ^ fingerprint_2).count("1")
+
+
+class DuplicateIndex:
+    """ An index of fingerprints to find near-duplicate items.
+
+    An item is a duplicate of another item if their fingerprints have at
+    most "max_distance" different bits. The fingerprints are split in
+    max_distance + 1 bands: two near-duplicates have at least one identical
+    band, so only the fingerprints sharing a band are compared (LSH banding).
+
+    The items are referenced by "feed name/item id". Keys of the database:
+     - "b<band>/<band value>/<reference>": the fingerprint, for the lookups;
+     - "r/<reference>": the fingerprint, to remove the items of a feed;
+     - "o/<reference>": the reference of the original of a duplicate;
+     - "d/<original reference>/<reference>": empty, the duplicates of an item.
+
+    When an original is removed, its first duplicate becomes the original
+    of the other duplicates (see rm).
+
+    Examples:
+    >>> index = DuplicateIndex()
+    >>> index.add("lemonde/123", simhash(u"Un séisme frappe le Népal ..."))
+    >>> index.find(simhash(u"Un séisme frappe le Népal! ..."))
+    'lemonde/123'
+    >>> index.close()
+
+    Attributes:
+        max_distance (int): Maximum number of different bits of near-duplicates.
+        bands (list of tuple): The first bit and the mask of each band.
+        db (kyotocabinet.DB): The database of fingerprints.
+
+    """
+    def __init__(self, filename=DEDUP_DB_FILENAME, max_distance=DEDUP_MAX_DISTANCE):
+        """ Opens or creates the database of fingerprints.
+
+        Args:
+            filename (str, optional): Name of the database.
+            max_distance (int, optional): Maximum number of different bits of near-duplicates.
+
+        """
+        self.max_distance = max_distance
+
+        count = max_distance + 1
+        limits = [FINGERPRINT_BITS * i / count for i in range(count + 1)]
+        self.bands = [(start, (1 << (end - start)) - 1)
+                      for start, end in zip(limits, limits[1:])]
+
+        self.db = storage.new_db()
+        self.db.open(filename, storage.OWRITER | storage.OCREATE)
+
+    def find(self, fingerprint, exclude=None, feed=None):
+        """ Returns an item near-duplicate of a fingerprint.
+
+        Args:
+            fingerprint (int): The fingerprint.
+            exclude (str, optional): Reference of an item never returned.
+            feed (str, optional): Name of a feed whose items are never returned.
+
+        Returns:
+            str: The reference of the item or None.
+
+        """
+        if fingerprint is None:
+            return None
+
+        for prefix in self.__band_prefixes(fingerprint):
+            for key in self.db.match_prefix(prefix):
+                reference = key[len(prefix):]
+                if reference == exclude or feed_name(reference) == feed:
+                    continue
+
+                if distance(fingerprint, int(self.db.get(key))) <= self.max_distance:
+                    return reference
+
+    def add(self, reference, fingerprint, duplicate_of=None):
+        """ Adds the fingerprint of an item.
+
+        Args:
+            reference (str): Reference of the item "feed name/item id".
+            fingerprint (int): The fingerprint.
+            duplicate_of (str, optional): Reference of the original of the item.
+
+        """
+        if fingerprint is None:
+            return
+
+        records = dict((prefix + reference, str(fingerprint))
+                       for prefix in self.__band_prefixes(fingerprint))
+        records["r/%s" % reference] = str(fingerprint)
+        if duplicate_of:
+            records.update(self.__duplicate_records(reference, duplicate_of))
+
+        kc_util.set_bulk(self.db, records)
+
+    def rm_feed(self, name):
+        """ Removes the fingerprints of the items of a feed.
+
+        Args:
+            name (str): Name of the feed.
+
+        Returns:
+            dict: The new original of the duplicates of the removed items
+            by reference (None for the new originals), see rm.
+
+        Raises:
+            IOError: The fingerprints can't be removed.
+
+        """
+        return self.rm([key[2:] for key in self.db.match_prefix("r/%s/" % name)])
+
+    def rm(self, references):
+        """ Removes the fingerprints of items.
+
+        The duplicates of a removed item get a new original: the first one
+        (by reference) is no more a duplicate, the others are its duplicates.
+
+        Args:
+            references (list of str): References of the items "feed name/item id".
+
+        Returns:
+            dict: The new original of the duplicates of the removed items
+            by reference (None for the new originals).
+
+        Raises:
+            IOError: The fingerprints can't be removed.
+
+        """
+        keys = ["r/%s" % reference for reference in references]
+        if not keys:
+            return {}
+
+        for key, fingerprint in self.db.get_bulk(keys, False).items():
+            keys += [band_prefix + key[2:]
+                     for band_prefix in self.__band_prefixes(int(fingerprint))]
+
+        # the removed items as duplicates
+        originals = self.db.get_bulk(["o/%s" % reference for reference in references], False)
+        for key, original in originals.items():
+            keys += [key, "d/%s/%s" % (original, key[2:])]
+
+        # the duplicates of the removed items
+        removed = set(references)
+        originals, records = {}, {}
+        for reference in references:
+            prefix = "d/%s/" % reference
+            duplicates = []
+            for key in self.db.match_prefix(prefix):
+                keys.append(key)
+                if key[len(prefix):] not in removed:
+                    duplicates.append(key[len(prefix):])
+
+            if duplicates:
+                duplicates.sort()
+                keys.append("o/%s" % duplicates[0])
+                originals[duplicates[0]] = None
+                for duplicate in duplicates[1:]:
+                    originals[duplicate] = duplicates[0]
+                    records.update(self.__duplicate_records(duplicate, duplicates[0]))
+
+        if self.db.remove_bulk(keys, True) < 0:
+            raise IOError("can't remove the fingerprints: %s" % self.db.error())
+        kc_util.set_bulk(self.db, records)
+
+        return originals
+
+    def close(self):
+        """ Closes the database of fingerprints.
+
+        """
+        self.db.close()
+
+    def __duplicate_records(self, reference, original):
+        """ Returns the records linking a duplicate to its original.
+
+        Args:
+            reference (str): Reference of the duplicate.
+            original (str): Reference of the original.
+
+        Returns:
+            dict: The records.
+
+        """
+        return {"o/%s" % reference: original, "d/%s/%s" % (original, reference): ""}
+
+    def __band_prefixes(self, fingerprint):
+        """ Returns the prefixes of the keys of the bands of a fingerprint.
+
+        Args:
+            fingerprint (int): The fingerprint.
+
+        Returns:
+            list of str: A prefix by band.
+
+        """
+        return ["b%d/%x/" % (band, fingerprint >> start & mask)
+                for band, (start, mask) in enumerate(self.bands)]
+
+###########################################################################
+# DuplicateIndex Example
+###########################################################################
+
+if __name__ == "__main__":
+    from collector import Collector
+    from manager import Manager
+
+    collector = Collector(dedup_index=DuplicateIndex())
+    collector.add_feeds(Manager.get_feeds_info())
+
+    def print_duplicates_test():
+        for name in collector.get_feeds_name():
+            for item_id, item in collector.get_items(name, ["title", "duplicate_of"]):
+                if item.duplicate_of:
+                    logging.info("%s/%s duplicate of %s: %s" % \
+                            (name, item_id, item.duplicate_of, item.title))
+
+    print_duplicates_test()
+    collector.close()
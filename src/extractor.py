@@ -0,0 +1,443 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Extracts the text of articles with a pool of processes.
+#
+
+import pickle, hashlib
+import storage
+import kyotocabinetutil as kc_util
+
+import time, urllib2, socket, itertools, Queue
+from multiprocessing import Pool, Queue as ProcessQueue, TimeoutError
+
+from settings import EXTRACTOR_PROCESSES, EXTRACTOR_TIMEOUT, \
+        EXTRACTION_CACHE_FILENAME
+
+import logging
+if __name__ == "__main__":
+    format_str = "%(asctime)s %(levelname)s %(funcName)s: %(message)s"
+    logging.basicConfig(format=format_str, level=logging.DEBUG)
+
+WAIT_STEP = 0.1 # seconds between two checks of an article not started
+READ_SIZE = 16384 # bytes read at once from a web page
+
+# queue of the started articles (task, start time), set in the workers
+started_queue = None
+
+def init_worker(queue):
+    """ Sets the queue of the started articles in a worker process.
+
+    Args:
+        queue (multiprocessing.Queue): The queue of the started articles.
+
+    """
+    global started_queue
+    started_queue = queue
+
+def run_task(task, url, timeout, etag, modified):
+    """ Reports the start of an article and extracts it.
+
+    The function is called in a worker process, the deadline of the article
+    starts when it is reported.
+
+    Args:
+        task (int): Number of the article.
+        url (unicode): Url of the web page.
+        timeout (float): Deadline in seconds to download the page.
+        etag (str): Unique tag of the previous download.
+        modified (str): Date of the previous download.
+
+    Returns:
+        tuple (unicode, str, str): See extract_article.
+
+    """
+    if started_queue:
+        started_queue.put((task, time.time()))
+    return extract_article(url, timeout, etag, modified)
+
+def extract_article(url, timeout=EXTRACTOR_TIMEOUT, etag=None, modified=None):
+    """ Downloads a web page and returns the text of the article.
+
+    The function is called in a worker process.
+    Boilerpipe is imported here, so the Java virtual machine
+    is started by the workers and never by the main process.
+
+    With the etag or the modified date of a previous download, the request
+    is a conditional GET and the article is not extracted again if the web
+    page has not been modified.
+
+    The timeout is the one of each socket operation and the deadline of the
+    whole download: a web page sent slowly is not read after the deadline.
+
+    Args:
+        url (unicode): Url of the web page.
+        timeout (float, optional): Deadline in seconds to download the page.
+        etag (str, optional): Unique tag of the previous download.
+        modified (str, optional): Date of the previous download.
+
+    Returns:
+        tuple (unicode, str, str): The text of the article, the etag and the
+        modified date of the web page, or None if it has not been modified.
+
+    Raises:
+        socket.timeout: The web page is not downloaded before the deadline.
+
+    """
+    deadline = time.time() + timeout
+
+    request = urllib2.Request(url)
+    if etag:
+        request.add_header("If-None-Match", etag)
+    if modified:
+        request.add_header("If-Modified-Since", modified)
+
+    try:
+        response = urllib2.urlopen(request, timeout=timeout)
+    except urllib2.HTTPError as er:
+        if er.code == 304:
+            return
+        raise
+    except urllib2.URLError as er:
+        if isinstance(er.reason, socket.timeout):
+            raise er.reason
+        raise
+
+    chunks = []
+    while True:
+        if time.time() > deadline:
+            raise socket.timeout("the web page is not downloaded after %s seconds" % timeout)
+
+        chunk = response.read(READ_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+
+    charset = response.headers.getparam("charset") or "utf-8"
+    html = "".join(chunks).decode(charset, "replace")
+
+    from boilerpipe.extract import Extractor
+    text = Extractor(extractor='ArticleExtractor', html=html).getText()
+
+    return text, response.headers.get("etag"), response.headers.get("last-modified")
+
+
+class ArticleExtractor:
+    """ Extracts articles in the background with a pool of processes.
+
+    Articles are submitted with a key, the results are collected later
+    without waiting for the slow ones. The deadline of an article starts
+    when a worker starts it: the articles waiting for a worker don't expire.
+
+    The extracted texts are kept in a cache by url, with the etag and the
+    modified date of the web page. An article in the cache is not extracted 
+    again: without etag and modified date, the cached text is returned,
+    otherwise the web page is downloaded again only if it has been modified.
+
+    The articles submitted are also recorded in the cache until their result
+    is returned: the articles not returned before a close are submitted again
+    by the next extractor.
+
+    Examples:
+    >>> extractor = ArticleExtractor()
+    >>> extractor.submit("key", "http://www.lemonde.fr/sante/article/...")
+    >>> list(extractor.results(wait=True))
+    [('key', u'Travailler en horaires décalés ...')]
+    >>> extractor.close()
+
+    Attributes:
+        processes (int): Number of worker processes.
+        timeout (float): Deadline in seconds for an article.
+        pool (multiprocessing.Pool): The workers.
+        pending (dict): Articles in progress by key 
+        (async result, url, task number, cached text).
+        started (dict): Start time of the articles started by task number.
+        started_queue (multiprocessing.Queue): The articles started by the workers.
+        ready (list of tuple): Articles found in the cache (key, text).
+        cache_filename (str): Name of the cache database.
+        cache_db (kyotocabinet.DB): The cache of extracted articles by url.
+        tasks (iterator): Numbers of the articles.
+        hits (int): Number of articles not extracted thanks to the cache.
+
+    """
+    def __init__(self, processes=EXTRACTOR_PROCESSES, timeout=EXTRACTOR_TIMEOUT,
+                 cache_filename=EXTRACTION_CACHE_FILENAME):
+        """ Starts the workers, sets the deadline and opens the cache.
+
+        The workers are started before any other thread of the collector.
+
+        Args:
+            processes (int, optional): Number of worker processes.
+            timeout (float, optional): Deadline in seconds for an article.
+            cache_filename (str, optional): Name of the cache database.
+
+        """
+        self.processes = processes
+        self.timeout = timeout
+        self.started_queue = ProcessQueue()
+        self.pool = Pool(processes, init_worker, (self.started_queue,))
+        self.pending = {}
+        self.started = {}
+        self.tasks = itertools.count()
+        self.ready = []
+        self.cache_filename = cache_filename
+        self.cache_db = None
+        self.hits = 0
+
+        self.__resume()
+
+    def submit(self, key, url):
+        """ Starts the extraction of an article.
+
+        Args:
+            key (obj): The key returned with the result, it can be pickled.
+            url (unicode): Url of the web page.
+
+        """
+        self.__cache().set(self.__submitted_key(key), pickle.dumps((key, url)))
+
+        text, etag, modified = self.__get_cache(url)
+
+        if text is not None and not (etag or modified):
+            self.hits += 1
+            self.ready.append((key, text))
+            return
+
+        if not self.pool: # closed
+            self.pool = Pool(self.processes, init_worker, (self.started_queue,))
+
+        task = next(self.tasks)
+        result = self.pool.apply_async(run_task, 
+                                       (task, url, self.timeout, etag, modified))
+        self.pending[key] = (result, url, task, text)
+
+    def results(self, wait=False):
+        """ Returns a generator of extracted articles.
+
+        Articles in error or after the deadline are dropped, except the
+        articles of the cache which are not revalidated in time: their
+        cached text is returned.
+
+        Args:
+            wait (boolean, optional): Wait for all articles (until their deadline),
+            otherwise only finished articles are returned.
+
+        Yields:
+            tuple (obj, unicode): The key and the text of the article.
+
+        """
+        ready, self.ready = self.ready, []
+        for key, text in ready:
+            yield key, text
+            self.__forget(key)
+
+        for key, (result, url, task, text) in self.pending.items():
+            if wait:
+                self.__wait(result, task)
+            elif not result.ready() and not self.__expired(task):
+                continue
+
+            del self.pending[key]
+            self.started.pop(task, None)
+            try:
+                if not result.ready():
+                    raise TimeoutError()
+
+                extracted = result.get()
+                if extracted is None: 
+                    # not modified since the cached extraction
+                    self.hits += 1
+                else:
+                    self.__set_cache(url, *extracted)
+                    text = extracted[0]
+
+                yield key, text
+
+            except (TimeoutError, socket.timeout):
+                logging.warning("can't extract the article before the deadline")
+                logging.warning('url was "%s"' % url)
+                if text is not None:
+                    # the cached text is still the best known
+                    yield key, text
+            except Exception as er:
+                logging.warning("can't extract the article")
+                logging.warning('url was "%s"' % url)
+                logging.debug(er)
+
+            self.__forget(key)
+
+    def __resume(self):
+        """ Submits again the articles of a previous extractor not returned.
+
+        """
+        records = list(kc_util.gen_records(self.__cache().cursor(), "p/"))
+        for _, record in records:
+            self.submit(*pickle.loads(record))
+
+        if records:
+            logging.info("%s articles submitted again" % len(records))
+
+    def __forget(self, key):
+        """ Removes the record of an article returned.
+
+        Args:
+            key (obj): The key of the article.
+
+        """
+        self.__cache().remove(self.__submitted_key(key))
+
+    @staticmethod
+    def __submitted_key(key):
+        """ Returns the key of the record of an article submitted.
+
+        Args:
+            key (obj): The key of the article.
+
+        Returns:
+            str: The key "p/<hash of the key>", the urls of the cache don't
+            start with "p/".
+
+        """
+        return "p/%s" % hashlib.sha1(pickle.dumps(key)).hexdigest()
+
+    def __read_started(self):
+        """ Reads the start times of the articles started by the workers.
+
+        """
+        while True:
+            try:
+                task, start = self.started_queue.get_nowait()
+            except Queue.Empty:
+                return
+            self.started[task] = start
+
+    def __expired(self, task):
+        """ Returns True if the deadline of a started article is over.
+
+        Args:
+            task (int): Number of the article.
+
+        Returns:
+            boolean: False if the article is not started.
+
+        """
+        self.__read_started()
+        start = self.started.get(task)
+        return start is not None and time.time() - start > self.timeout
+
+    def __wait(self, result, task):
+        """ Waits for an article until it is ready or after its deadline.
+
+        Args:
+            result (multiprocessing.pool.AsyncResult): The article in progress.
+            task (int): Number of the article.
+
+        """
+        while not result.ready():
+            self.__read_started()
+            start = self.started.get(task)
+            if start is None:
+                # waiting for a worker
+                result.wait(WAIT_STEP)
+                continue
+
+            remaining = start + self.timeout - time.time()
+            if remaining <= 0:
+                return
+            result.wait(remaining)
+
+    def close(self):
+        """ Stops the workers and closes the cache.
+
+        Articles in progress are dropped, the next extractor submits them again.
+
+        """
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.pending = {}
+        self.started = {}
+        self.ready = []
+
+        if self.cache_db:
+            self.cache_db.close()
+            self.cache_db = None
+
+    ###########################################################################
+    # Cache
+    ###########################################################################
+
+    def __get_cache(self, url):
+        """ Returns an article from the cache.
+
+        Args:
+            url (unicode): Url of the web page.
+
+        Returns:
+            tuple (unicode, str, str): The text, the etag and the modified date,
+            the text is None if the article is not in the cache.
+
+        """
+        pickle_article = self.__cache().get(url.encode("utf-8"))
+        if not pickle_article:
+            return None, None, None
+
+        return pickle.loads(pickle_article)
+
+    def __set_cache(self, url, text, etag, modified):
+        """ Stores an article in the cache.
+
+        Args:
+            url (unicode): Url of the web page.
+            text (unicode): The text of the article.
+            etag (str): Unique tag of the web page.
+            modified (str): Date of the web page.
+
+        """
+        self.__cache().set(url.encode("utf-8"), pickle.dumps((text, etag, modified)))
+
+    def __cache(self):
+        """ Returns the cache database, opened the first time.
+
+        Returns:
+            kyotocabinet.DB: The cache of extracted articles by url.
+
+        """
+        if not self.cache_db:
+            self.cache_db = storage.new_db()
+            self.cache_db.open(self.cache_filename, storage.OWRITER | storage.OCREATE)
+
+        return self.cache_db
+
+###########################################################################
+# ArticleExtractor Example
+###########################################################################
+
+if __name__ == "__main__":
+    from collector import Collector
+    from manager import Manager
+    import random
+
+    collector = Collector(extractor=ArticleExtractor())
+
+    def extract_articles_test():
+        name, url, tag, _ = random.choice(Manager.get_feeds_info())
+        collector.add_feed(name, url, tag)
+        logging.info("feed added, %s articles in progress" % len(collector.extractor.pending))
+
+        logging.info("%s articles extracted" % collector.update_articles(wait=True))
+        collector.print_items(name)
+        collector.rm_feed(name)
+
+        return name, url, tag
+
+    def extract_cached_articles_test(name, url, tag):
+        hits = collector.extractor.hits
+        collector.add_feed(name, url, tag)
+        collector.update_articles(wait=True)
+        logging.info("%s articles from the cache" % (collector.extractor.hits - hits))
+        collector.rm_feed(name)
+
+    extract_cached_articles_test(*extract_articles_test())
+    collector.close()
@@ -0,0 +1,353 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Downloads feeds with persistent connections.
+#
+
+import httplib, urlparse, socket, threading, time, zlib
+import feedparser
+
+from settings import FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT, \
+        FETCH_MAX_CONNECTIONS_PER_HOST, FETCH_MAX_REDIRECTS
+
+import logging
+if __name__ == "__main__":
+    format_str = "%(asctime)s %(levelname)s %(funcName)s: %(message)s"
+    logging.basicConfig(format=format_str, level=logging.DEBUG)
+
+class Fetcher:
+    """ Downloads feeds and hands the raw bytes to feedparser.
+
+    Connections are kept alive in a pool by host, so the TCP connection and
+    the TLS session are reused between two feeds of the same server.
+    Compressed bodies (gzip, deflate) are always requested.
+
+    A fetcher can be shared by many threads.
+
+    Examples:
+    >>> fetcher = Fetcher()
+    >>> feed_parsed = fetcher.parse("http://www.lemonde.fr/sante/rss_full.xml")
+    >>> feed_parsed.status
+    200
+    >>> fetcher.parse(feed_parsed.href, etag=feed_parsed.etag).status
+    304
+    >>> fetcher.close()
+
+    Attributes:
+        connect_timeout (float): Deadline in seconds to open a connection.
+        read_timeout (float): Deadline in seconds to read a response.
+        max_connections (int): Maximum number of connections by host.
+        max_redirects (int): Maximum number of redirections followed.
+        pools (dict): Idle connections by host (scheme, host, port).
+        slots (dict): Semaphores limiting the connections by host.
+        lock (threading.Lock): Protects the pools.
+
+    """
+    redirect_status = [301, 302, 303, 307, 308]
+    chunk_size = 16384
+
+    def __init__(self, connect_timeout=FETCH_CONNECT_TIMEOUT,
+                 read_timeout=FETCH_READ_TIMEOUT,
+                 max_connections=FETCH_MAX_CONNECTIONS_PER_HOST,
+                 max_redirects=FETCH_MAX_REDIRECTS):
+        """ Sets the deadlines and the size of the pools.
+
+        Args:
+            connect_timeout (float, optional): Deadline in seconds to open a connection.
+            read_timeout (float, optional): Deadline in seconds to read a response.
+            max_connections (int, optional): Maximum number of connections by host.
+            max_redirects (int, optional): Maximum number of redirections followed.
+
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        self.max_redirects = max_redirects
+        self.pools = {}
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def parse(self, url, etag=None, modified=None):
+        """ Downloads and parses a feed.
+
+        The result is like the result of feedparser.parse(url),
+        with the status, the etag, the modified date and the url of the response.
+
+        Args:
+            url (str): The feed url.
+            etag (unicode, optional): Unique tag provided by the feed server.
+            modified (str, optional): Date provided by the feed server.
+
+        Returns:
+            feedparser.FeedParserDict: The feed parsed.
+
+        """
+        status, final_url, headers, body = self.fetch(url, etag, modified)
+
+        if status == 304:
+            feed_parsed = feedparser.FeedParserDict(
+                    feed=feedparser.FeedParserDict(), entries=[], bozo=0)
+        else:
+            # the body has no url: the final url is the base of the relative
+            # links and of the ids of the items (see Item.get_id)
+            response_headers = dict(headers)
+            response_headers["content-location"] = urlparse.urljoin(
+                    final_url, headers.get("content-location", ""))
+            feed_parsed = feedparser.parse(body, response_headers=response_headers)
+
+        feed_parsed["status"] = status
+        feed_parsed["href"] = final_url
+        feed_parsed["headers"] = headers
+
+        # keep the previous validators when the server doesn't send them again
+        feed_parsed["etag"] = headers.get("etag", etag)
+        feed_parsed["modified"] = headers.get("last-modified", modified)
+
+        return feed_parsed
+
+    def fetch(self, url, etag=None, modified=None, headers=None):
+        """ Downloads a document with a conditional GET.
+
+        Redirections are followed and the body is decompressed.
+
+        Args:
+            url (str): The document url.
+            etag (unicode, optional): Unique tag provided by the server.
+            modified (str, optional): Date provided by the server.
+            headers (dict, optional): Additional request headers.
+
+        Returns:
+            tuple (int, str, dict, str): The status, the final url,
+            the response headers (lowercase names) and the body.
+
+        Raises:
+            IOError: Too many redirections or the deadline is exceeded.
+
+        """
+        request_headers = {
+            "User-Agent": feedparser.USER_AGENT,
+            "Accept": feedparser.ACCEPT_HEADER,
+            "Accept-Encoding": "gzip, deflate",
+        }
+        if etag:
+            request_headers["If-None-Match"] = etag.encode("utf-8")
+        if modified:
+            request_headers["If-Modified-Since"] = modified
+        request_headers.update(headers or {})
+
+        for _ in range(self.max_redirects + 1):
+            status, response_headers, body = self.__request(url, request_headers)
+
+            if status not in self.redirect_status or "location" not in response_headers:
+                return status, url, response_headers, self.__decode(response_headers, body)
+
+            url = urlparse.urljoin(url, response_headers["location"])
+            logging.debug("redirected (%s) to %s" % (status, url))
+
+        raise IOError("too many redirections for %s" % url)
+
+    def close(self):
+        """ Closes all idle connections.
+
+        """
+        with self.lock:
+            pools, self.pools = self.pools, {}
+
+        for connections in pools.values():
+            for connection in connections:
+                connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    ###########################################################################
+    # Connections
+    ###########################################################################
+
+    def __request(self, url, headers):
+        """ Sends a GET request with a pooled connection.
+
+        A reused connection can be closed by the server at any time,
+        in this case the request is sent again with a new connection.
+
+        Args:
+            url (str): The document url.
+            headers (dict): The request headers.
+
+        Returns:
+            tuple (int, dict, str): The status, the response headers and the raw body.
+
+        """
+        parts = urlparse.urlsplit(url)
+        host = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        with self.__slot(host):
+            connection, reused = self.__get_connection(host)
+            try:
+                response, body = self.__send(connection, path, headers)
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                # the idle connection was closed by the server
+                connection, _ = self.__get_connection(host, reuse=False)
+                response, body = self.__send(connection, path, headers)
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.__put_connection(host, connection)
+
+        response_headers = dict((name.lower(), value)
+                                for name, value in response.getheaders())
+
+        return response.status, response_headers, body
+
+    def __send(self, connection, path, headers):
+        """ Sends the request and reads the whole response before the deadline.
+
+        Args:
+            connection (httplib.HTTPConnection): An open connection.
+            path (str): The path of the document.
+            headers (dict): The request headers.
+
+        Returns:
+            tuple (httplib.HTTPResponse, str): The response and the raw body.
+
+        """
+        deadline = time.time() + self.read_timeout
+
+        connection.request("GET", path, headers=headers)
+        # the connect timeout is replaced by the read timeout
+        connection.sock.settimeout(self.read_timeout)
+        response = connection.getresponse()
+
+        chunks = []
+        while True:
+            if time.time() > deadline:
+                response.close()
+                connection.close()
+                raise IOError("read deadline exceeded for %s" % path)
+
+            chunk = response.read(self.chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+        return response, "".join(chunks)
+
+    def __get_connection(self, host, reuse=True):
+        """ Returns an idle connection of the pool or a new connection.
+
+        Args:
+            host (tuple): The scheme, host name and port.
+            reuse (boolean, optional): False to always open a new connection.
+
+        Returns:
+            tuple (httplib.HTTPConnection, boolean): The connection
+            and True if the connection comes from the pool.
+
+        """
+        if reuse:
+            with self.lock:
+                connections = self.pools.get(host)
+                if connections:
+                    return connections.pop(), True
+
+        scheme, hostname, port = host
+        if scheme == "https":
+            connection = httplib.HTTPSConnection(hostname, port,
+                                                 timeout=self.connect_timeout)
+        else:
+            connection = httplib.HTTPConnection(hostname, port,
+                                                timeout=self.connect_timeout)
+        connection.connect()
+
+        return connection, False
+
+    def __put_connection(self, host, connection):
+        """ Puts a connection back to the pool.
+
+        Args:
+            host (tuple): The scheme, host name and port.
+            connection (httplib.HTTPConnection): The connection to keep alive.
+
+        """
+        with self.lock:
+            connections = self.pools.setdefault(host, [])
+            if len(connections) < self.max_connections:
+                connections.append(connection)
+                return
+
+        connection.close()
+
+    def __slot(self, host):
+        """ Returns the semaphore limiting the connections to a host.
+
+        Args:
+            host (tuple): The scheme, host name and port.
+
+        Returns:
+            threading.BoundedSemaphore: The semaphore of the host.
+
+        """
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.max_connections)
+            return self.slots[host]
+
+    @staticmethod
+    def __decode(headers, body):
+        """ Decompresses a body according to the content encoding.
+
+        Args:
+            headers (dict): The response headers.
+            body (str): The raw body.
+
+        Returns:
+            str: The decompressed body.
+
+        """
+        encoding = headers.get("content-encoding", "").lower()
+        try:
+            if encoding in ("gzip", "x-gzip"):
+                return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            if encoding == "deflate":
+                try:
+                    return zlib.decompress(body)
+                except zlib.error:
+                    # raw deflate stream without the zlib header
+                    return zlib.decompress(body, -zlib.MAX_WBITS)
+        except zlib.error as er:
+            logging.warning("can't decompress the body (%s)" % encoding)
+            logging.debug(er)
+
+        return body
+
+###########################################################################
+# Fetcher Example
+###########################################################################
+
+if __name__ == "__main__":
+    from manager import Manager
+    fetcher = Fetcher()
+
+    def parse_feeds_test():
+        for name, url, _, _ in Manager.get_feeds_info():
+            start = time.time()
+            feed_parsed = fetcher.parse(url)
+            logging.info("%s: status %s, %s entries in %.2fs" % \
+                    (name, feed_parsed.status, len(feed_parsed.entries),
+                     time.time() - start))
+
+    ## the second pass reuses the connections
+    parse_feeds_test()
+    parse_feeds_test()
+    fetcher.close()
+    ##
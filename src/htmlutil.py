@@ -0,0 +1,77 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Html util.
+#
+
+import re
+import BeautifulSoup
+
+# a start or end tag, attribute values without "<" or ">"
+TAG_RE = re.compile(r"""<(?:/?[a-zA-Z][-_.:a-zA-Z0-9]*)"""
+                    r"""(?:\s+[^\s<>"'=/]+(?:\s*=\s*(?:"[^"<>]*"|'[^'<>]*'|[^\s<>"']+))?)*"""
+                    r"""\s*/?>""")
+
+# a reference without ";" is rewritten by the sgml parser of BeautifulSoup
+AMBIGUOUS_REF_RE = re.compile(r"&(?:#[0-9]+(?![0-9;])|[a-zA-Z][-.a-zA-Z0-9]*(?![-.a-zA-Z0-9;]))")
+
+# an incomplete reference at the end is dropped by BeautifulSoup
+INCOMPLETE_REF_RE = re.compile(r"&(?:[a-zA-Z][a-zA-Z0-9]*|#[0-9]*)?\Z")
+
+# the content of these tags is read as raw text by BeautifulSoup
+RAW_TEXT_RE = re.compile(r"<(?:script|textarea)[\s/>]", re.IGNORECASE)
+
+def html_to_text(html):
+    """ Returns the text of a html fragment.
+
+    The text is the same as BeautifulSoup.BeautifulSoup(html).text:
+    the text between two tags is stripped and joined without separator,
+    the entities and the character references are kept as they are.
+
+    The tags are removed with a regular expression, BeautifulSoup is only
+    used when the fragment can't be read this way: comments, declarations,
+    a "<" outside a tag, script or textarea, a reference without ";"
+    or at the end of the fragment.
+
+    Args:
+        html (unicode): The html fragment.
+
+    Returns:
+        unicode: The text of the fragment.
+
+    """
+    if isinstance(html, unicode) and not RAW_TEXT_RE.search(html):
+        texts = TAG_RE.split(html)
+        if not any(u"<" in text or AMBIGUOUS_REF_RE.search(text) for text in texts) \
+                and not INCOMPLETE_REF_RE.search(texts[-1]):
+            return u"".join(text.strip() for text in texts)
+
+    return BeautifulSoup.BeautifulSoup(html).text
+
+###########################################################################
+# Html util Example
+###########################################################################
+
+if __name__ == "__main__":
+    import timeit
+    import feedparser
+    from manager import Manager
+
+    def benchmark_test():
+        summaries = []
+        for _, url, _, _ in Manager.get_feeds_info():
+            summaries += [entry["summary"] for entry in feedparser.parse(url).entries
+                          if "summary" in entry]
+
+        different = [summary for summary in summaries
+                     if html_to_text(summary) != BeautifulSoup.BeautifulSoup(summary).text]
+        print("%s summaries, %s different texts" % (len(summaries), len(different)))
+
+        soup_time = timeit.timeit(
+                lambda: [BeautifulSoup.BeautifulSoup(s).text for s in summaries], number=10)
+        fast_time = timeit.timeit(
+                lambda: [html_to_text(s) for s in summaries], number=10)
+        print("BeautifulSoup: %.3fs, html_to_text: %.3fs (x%.1f)" % \
+                (soup_time, fast_time, soup_time / max(fast_time, 1e-9)))
+
+    benchmark_test()
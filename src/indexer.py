@@ -5,12 +5,13 @@
 #
 
 import os, shutil
+import storage
 from whoosh.index import create_in, open_dir
-from whoosh.fields import Schema, NUMERIC, TEXT, KEYWORD
+from whoosh.fields import Schema, NUMERIC, TEXT, KEYWORD, ID
 from whoosh.qparser import QueryParser
 from collector import Collector, Collector, Feed, Item
 
-from settings import INDEX_DIR
+from settings import INDEX_DIR, INDEXER_STATE_FILENAME
 
 import logging
 if __name__ == "__main__":
@@ -18,6 +19,9 @@ if __name__ == "__main__":
     logging.basicConfig(format=format_str, level=logging.DEBUG)
 
 SCHEMA = Schema(
+    # "feed name/item id", the item ids are not unique across the feeds
+    key=ID(unique=True, stored=True),
+    feed=ID(stored=True),
     # item attributes
     item_id=NUMERIC(stored=True),
     title=TEXT(stored=True), \
@@ -36,8 +40,14 @@ class Indexer:
     A field of an RSS item can be stored or just indexed. 
     When stored, the field is returned with the results.
 
+    After a first indexing with "add_feeds", "update" only indexes the
+    changes of the collector since the last event processed (watermark).
+    The documents are found by their key "feed name/item id".
+
     Attributes:
         collector (Collector): A Collector instance.
+        ix (whoosh.index.Index): The index.
+        state_db (kyotocabinet.DB): State of the indexer (the watermark).
 
     """
     def __init__(self, collector):
@@ -58,8 +68,20 @@ class Indexer:
             # open last index 
             self.ix = open_dir(INDEX_DIR)
 
+        self.state_db = storage.new_db()
+        self.state_db.open(INDEXER_STATE_FILENAME,
+                           storage.OWRITER | storage.OCREATE)
+
+        if "key" not in self.ix.schema:
+            # the documents of an older index can't be found by their key
+            logging.info("rebuild the index at %s" % INDEX_DIR)
+            self.ix = create_in(INDEX_DIR, SCHEMA)
+            self.add_feeds()
+
     def add_feed(self, name):
         """ Indexing an RSS feed by adding all items to the index.
+
+        The near-duplicates of items from other feeds are not indexed.
         
         Args:
             name (str): Name of the feed.
@@ -68,25 +90,127 @@ class Indexer:
         logging.debug('index feed "%s"' % name)
         with self.ix.writer() as w:
             for item_id, item in self.collector.get_items(name):
-                logging.debug('add item "%s" to the index.' % item.title)
-                w.add_document(
-                    item_id=item_id,
-                    title=item.title,
-                    webpage_url=item.webpage_url,
-                    text=item.webpage_text,
-                    published=item.published_date,
-                    abstract=item.abstract,
-                    language=item.language,
-                    tag=hasattr(item, "tag") and unicode(item.tag) or u"",
-                    predite=u"")
+                if item.duplicate_of:
+                    continue
+
+                self.__add_document(w, name, item_id, item)
 
     def add_feeds(self):
         """ Indexing all RSS feeds by adding all items to the index.
+
+        The next changes are indexed with "update".
         
         """
-        for name, _ in self.collector.get_feeds():
+        # the events until now are included
+        watermark = self.collector.event_seq
+
+        for name in self.collector.get_feeds_name():
             self.add_feed(name)
 
+        self.set_watermark(watermark)
+
+    def update(self):
+        """ Indexes the changes of the collector since the last event processed.
+
+        New items are added, the items with a new web page text or a new tag
+        are indexed again, the items removed and the items of the removed
+        feeds are removed from the index.
+
+        Returns:
+            int: The number of items indexed.
+
+        """
+        watermark = self.get_watermark()
+        indexed = 0
+
+        with self.ix.writer() as w:
+            for event in self.collector.get_events(watermark):
+                watermark = event.seq
+                if event.action == "rm_feed":
+                    w.delete_by_term("feed", unicode(event.name))
+                    continue
+
+                key = self.__key(event.name, event.item_id)
+                if event.action == "rm":
+                    w.delete_by_term("key", key)
+                    continue
+
+                item = self.collector.get_item(event.name, event.item_id)
+                if not item or item.duplicate_of:
+                    # the removed items and the duplicates are not indexed
+                    w.delete_by_term("key", key)
+                    continue
+
+                self.__add_document(w, event.name, str(event.item_id), item, True)
+                indexed += 1
+
+        self.set_watermark(watermark)
+        logging.info("%s items indexed" % indexed)
+
+        return indexed
+
+    def get_watermark(self):
+        """ Returns the sequence number of the last event of the collector processed.
+
+        Returns:
+            int: Sequence number of the event, 0 if no event has been processed.
+
+        """
+        return int(self.state_db.get("events_watermark") or 0)
+
+    def set_watermark(self, seq):
+        """ Stores the sequence number of the last event of the collector processed.
+
+        Args:
+            seq (int): Sequence number of the event.
+
+        """
+        self.state_db.set("events_watermark", str(seq))
+
+    def close(self):
+        """ Closes the state of the indexer.
+
+        """
+        self.state_db.close()
+
+    def __key(self, name, item_id):
+        """ Returns the key of the document of an item.
+
+        Args:
+            name (str): Name of the feed.
+            item_id (str): Id of the item.
+
+        Returns:
+            unicode: The key "feed name/item id".
+
+        """
+        return u"%s/%s" % (name, item_id)
+
+    def __add_document(self, writer, name, item_id, item, replace=False):
+        """ Adds an item to the index.
+
+        Args:
+            writer (whoosh.writing.IndexWriter): The writer of the index.
+            name (str): Name of the feed.
+            item_id (str): Id of the item.
+            item (Item): The item.
+            replace (boolean, optional): Replace the document of the same key.
+
+        """
+        logging.debug('add item "%s" to the index.' % item.title)
+        add = writer.update_document if replace else writer.add_document
+        add(key=self.__key(name, item_id),
+            feed=unicode(name),
+            item_id=item_id,
+            title=item.title,
+            webpage_url=item.webpage_url,
+            text=item.webpage_text,
+            published=item.published_date,
+            abstract=item.abstract,
+            language=item.language,
+            tag=hasattr(item, "tag") and unicode(item.tag) or u"",
+            predite=u"")
+
     def rm_feed(self, field, keyword, print_search=True):
         """ Deletes any documents matching the query.
 
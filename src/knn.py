@@ -0,0 +1,439 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Scores a vector against many reference vectors at once (k-NN).
+#
+
+import storage
+import kyotocabinetutil as kc_util
+
+import heapq
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    # the engine scores the vectors in pure python
+    np = sparse = None
+
+from settings import K_ITEM, MIN_COS_SINE, POSTINGS_DB_FILENAME
+
+import logging
+if __name__ == "__main__":
+    format_str = "%(asctime)s %(levelname)s %(funcName)s: %(message)s"
+    logging.basicConfig(format=format_str, level=logging.DEBUG)
+
+# the similarities are rounded two digits after the decimal point: the raw
+# similarities this close to a limit are rounded before being compared
+ROUND_MARGIN = 0.01
+
+def scalar_product(u, v):
+    """ Returns the tf-idf scalar product of two sparse vectors.
+
+    The vectors should be sorted by word index according to increasing values
+    of the key (from low to high values).
+    The complexity is O(len(u)+len(v)) in the worst case.
+
+    Args:
+        u (Vector): The u vector.
+        v (Vector): The v vector.
+
+    Returns:
+        float: The tf-idf scalar product.
+
+    """
+    sp = 0.0
+    u_indexes, v_indexes = u.indexes, v.indexes
+    n1 = len(u_indexes)
+    n2 = len(v_indexes)
+    i = j = 0
+    while (i < n1 and j < n2):
+        if u_indexes[i] > v_indexes[j]:
+            j += 1
+        elif v_indexes[j] > u_indexes[i]:
+            i += 1
+        else:
+            sp += u.weights[i] * v.weights[j]
+            i += 1
+            j += 1
+
+    return sp
+
+def nearest(sims, k=K_ITEM, min_sim=MIN_COS_SINE):
+    """ Returns the k-nearest neighbors of a vector from its similarities.
+
+    The similarities are rounded two digits after the decimal point and the
+    ones not above min_sim are dropped. The neighbors are the ones of a
+    stable sort by similarity: the equal similarities are sorted by position.
+
+    Args:
+        sims (iterable of tuple): The similarities (sim, position, key).
+        k (int, optional): The number of neighbors (defaults is K_ITEM).
+        min_sim (float, optional): The minimum similarity of a neighbor
+            (defaults is MIN_COS_SINE).
+
+    Returns:
+        list of tuples (key, sim): The k-nearest neighbors, sorted by similarity.
+
+    """
+    neighbors = []
+    for sim, position, key in sims:
+        sim = round(float(sim), 2)
+        if sim > min_sim:
+            neighbors.append((sim, position, key))
+
+    neighbors = heapq.nlargest(k, neighbors, key=lambda neighbor: neighbor[:2])
+    neighbors.reverse()
+
+    return [(key, sim) for sim, _, key in neighbors]
+
+
+class KNNEngine:
+    """ Finds the k-nearest neighbors of a vector among reference vectors.
+
+    The reference vectors are loaded once. With NumPy and SciPy, their
+    weights are the rows of a CSR sparse matrix: a vector is scored against
+    all of them with one sparse matrix-vector product, and the k best rows
+    are taken by partial selection (numpy.partition) instead of a full sort.
+    Without them, the vectors are kept in memory and scored one by one.
+
+    The neighbors are the ones of the cosine similarity loop of the
+    classifier: the similarities are rounded two digits after the decimal
+    point, the ones not above min_sim are dropped and the equal similarities
+    keep the order of the names.
+
+    Examples:
+    >>> engine = KNNEngine(names, vectors, norms)
+    >>> engine.kNN(vector, norm)
+    [('ART', 0.13), ('SPORT', 0.2), ('ART', 0.6)]
+
+    Attributes:
+        names (list of str): The names of the reference vectors.
+        rows (list of str): The names of the loaded vectors, by row.
+        tags (list of str): The tags of the loaded vectors, by row.
+        norms (list of float): The norms of the loaded vectors, by row
+            (None for normalized vectors).
+        matrix (scipy.sparse.csr_matrix): The weights, one row per vector
+            (None without SciPy).
+        vectors (list of Vector): The vectors, by row (None with SciPy).
+        k (int): The number of neighbors.
+        min_sim (float): The minimum similarity of a neighbor.
+
+    """
+    def __init__(self, names, vectors, norms=None, k=K_ITEM, min_sim=MIN_COS_SINE):
+        """ Loads the reference vectors.
+
+        Args:
+            names (list of str): The names of the reference vectors.
+            vectors (dict): The vectors by name, the missing names are skipped.
+            norms (dict, optional): The norms by name, None for normalized vectors.
+            k (int, optional): The number of neighbors (defaults is K_ITEM).
+            min_sim (float, optional): The minimum similarity of a neighbor
+                (defaults is MIN_COS_SINE).
+
+        """
+        self.names = names
+        self.rows = [name for name in names if name in vectors]
+        self.tags = [vectors[name].tag for name in self.rows]
+        self.norms = None if norms is None else [float(norms[name]) for name in self.rows]
+        self.k = k
+        self.min_sim = min_sim
+        self.__names = set(names)
+
+        if sparse:
+            self.vectors = None
+            self.matrix = self.__csr_matrix([vectors[name] for name in self.rows])
+            if self.norms is not None:
+                self.norms = np.array(self.norms, dtype=np.float64)
+        else:
+            self.matrix = None
+            self.vectors = [vectors[name] for name in self.rows]
+
+        logging.debug("%s vectors loaded" % len(self.rows))
+
+    def __csr_matrix(self, vectors):
+        """ Returns the weights of the vectors as a CSR sparse matrix.
+
+        Args:
+            vectors (list of Vector): The vectors sorted by word index.
+
+        Returns:
+            scipy.sparse.csr_matrix: One row per vector.
+
+        """
+        indptr = np.zeros(len(vectors) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(vector.indexes) for vector in vectors])
+
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        data = np.empty(indptr[-1], dtype=np.float64)
+        for row, vector in enumerate(vectors):
+            # the arrays are read without copy
+            indices[indptr[row]:indptr[row + 1]] = np.frombuffer(vector.indexes, dtype=np.int32) \
+                    if vector.indexes else []
+            data[indptr[row]:indptr[row + 1]] = np.frombuffer(vector.weights, dtype=np.float64) \
+                    if vector.weights else []
+
+        columns = int(indices.max()) + 1 if len(indices) else 0
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(vectors), columns))
+
+    def covers(self, name):
+        """ Returns True if a vector is one of the reference vectors.
+
+        Args:
+            name (str): The name of the vector.
+
+        Returns:
+            boolean: True if the engine was loaded with this name.
+
+        """
+        return name in self.__names
+
+    def scores(self, u, u_norm=None):
+        """ Returns the cosine similarities of a vector with the reference vectors.
+
+        Args:
+            u (Vector): The vector to evaluate.
+            u_norm (float, optional): The norm of the vector, None for normalized vectors.
+
+        Returns:
+            numpy.ndarray or list of float: The similarities by row (not rounded).
+
+        """
+        if sparse:
+            x = np.zeros(self.matrix.shape[1], dtype=np.float64)
+            for index, weight in zip(u.indexes, u.weights):
+                if index < len(x):
+                    x[index] = weight
+
+            sims = self.matrix.dot(x)
+            if self.norms is not None:
+                denominators = self.norms * float(u_norm)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    sims = np.where(denominators != 0., sims / denominators, 0.)
+            return sims
+
+        sims = [scalar_product(u, v) for v in self.vectors]
+        if self.norms is not None:
+            sims = [sim / (v_norm * float(u_norm)) if v_norm * float(u_norm) else 0.
+                    for sim, v_norm in zip(sims, self.norms)]
+        return sims
+
+    def kNN(self, u, u_norm=None):
+        """ Returns the k-nearest neighbors of a vector.
+
+        Args:
+            u (Vector): The vector to evaluate.
+            u_norm (float, optional): The norm of the vector, None for normalized vectors.
+
+        Returns:
+            list of tuples (tag, sim): The k-nearest neighbors, sorted by similarity.
+
+        """
+        sims = self.scores(u, u_norm)
+
+        if sparse:
+            candidates = np.flatnonzero(sims > self.min_sim - ROUND_MARGIN)
+            if len(candidates) > self.k:
+                # the similarity of the k-th best row, without sorting
+                kth = len(candidates) - self.k
+                limit = np.partition(sims[candidates], kth)[kth]
+                candidates = candidates[sims[candidates] >= limit - 2 * ROUND_MARGIN]
+        else:
+            candidates = xrange(len(sims))
+
+        return [(self.tags[row], sim) for row, sim
+                in nearest(((sims[row], row, row) for row in candidates), self.k, self.min_sim)]
+
+
+class PostingsIndex:
+    """ An inverted index of the vectors, from a word to the vectors having it.
+
+    A posting is the weight of a word in a vector: a vector is scored
+    against the vectors sharing its words by accumulating the products of
+    the weights over the postings of its words, the other vectors are not
+    read. The work depends on the number of postings of the words of the
+    vector, not on the number of vectors.
+
+    The postings are sorted by word index. Keys of the database:
+     - "<word index on 10 digits>/<vector name>": the weight as string.
+
+    Examples:
+    >>> index = PostingsIndex()
+    >>> index.add("vecteur_1", vector_1)
+    >>> index.scores(vector_2)
+    {'vecteur_1': 1.5}
+    >>> index.close()
+
+    Attributes:
+        db (kyotocabinet.DB): The database of postings.
+
+    """
+    def __init__(self, filename=POSTINGS_DB_FILENAME):
+        """ Opens or creates the database of postings.
+
+        Args:
+            filename (str, optional): Name of the database.
+
+        """
+        self.db = storage.new_db()
+        self.db.open(filename, storage.OWRITER | storage.OCREATE)
+
+    def add(self, name, vector):
+        """ Adds or updates the postings of a vector.
+
+        Args:
+            name (str): The name of the vector.
+            vector (Vector): The vector.
+
+        """
+        # repr keeps all the digits of the weight
+        kc_util.set_bulk(self.db, dict((self.__key(index, name), repr(weight)) for index, weight
+                                       in zip(vector.indexes, vector.weights)))
+
+    def rm(self, name, vector):
+        """ Removes the postings of a vector.
+
+        Args:
+            name (str): The name of the vector.
+            vector (Vector): The vector stored.
+
+        Raises:
+            IOError: The postings can't be removed.
+
+        """
+        keys = [self.__key(index, name) for index in vector.indexes]
+        if keys and self.db.remove_bulk(keys, True) < 0:
+            raise IOError("can't remove the postings: %s" % self.db.error())
+
+    def scores(self, u):
+        """ Returns the scalar products of a vector with the vectors sharing its words.
+
+        The products are summed by increasing word index, like scalar_product.
+
+        Args:
+            u (Vector): The vector.
+
+        Returns:
+            dict: The scalar products by vector name.
+
+        """
+        sims = {}
+        for index, u_weight in zip(u.indexes, u.weights):
+            for name, weight in kc_util.gen_records(self.db.cursor(), self.__key(index, "")):
+                sims[name] = sims.get(name, 0.0) + u_weight * float(weight)
+
+        return sims
+
+    def __len__(self):
+        """ Returns the number of postings.
+
+        """
+        return len(self.db)
+
+    def clear(self):
+        """ Removes all the postings.
+
+        """
+        self.db.clear()
+
+    def close(self):
+        """ Closes the database of postings.
+
+        """
+        self.db.close()
+
+    def __key(self, index, name):
+        """ Returns the key of a posting.
+
+        Args:
+            index (int): The word index.
+            name (str): The name of the vector.
+
+        Returns:
+            str: The key.
+
+        """
+        return "%010d/%s" % (index, name)
+
+###########################################################################
+# KNNEngine Example
+###########################################################################
+
+if __name__ == "__main__":
+    import os, random, time
+    from array import array
+
+    import codec
+    import storage
+    import kyotocabinetutil as kc_util
+    from classifier import Vector
+    from settings import WORK_DIR, DB_EXT
+
+    VOCABULARY, WORDS, QUERIES = 20000, 50, 5
+    TAGS = ["SPORT", "ART", "SANTE", "ECONOMIE"]
+
+    def random_vector(rand):
+        indexes = array("i", sorted(rand.sample(xrange(VOCABULARY), WORDS)))
+        tfs = array("d", (rand.random() for _ in indexes))
+        weights = array("d", (tf * rand.uniform(0.5, 5.) for tf in tfs))
+        return Vector(indexes, tfs, weights, rand.choice(TAGS))
+
+    def norm(vector):
+        return sum(weight**2 for weight in vector.weights) ** 0.5
+
+    def loop_kNN(vectors_db, norms_db, u, u_norm, names):
+        # the cosine similarity loop, one read per reference vector
+        max_sim = []
+        for name in names:
+            v = codec.loads(vectors_db.get(name))
+            sim = round(scalar_product(u, v) / (u_norm * float(norms_db.get(name))), 2)
+            if sim > MIN_COS_SINE:
+                max_sim.append((v.tag, sim))
+        max_sim.sort(key=lambda tag_sim: tag_sim[1])
+        return max_sim[-K_ITEM:]
+
+    def benchmark(size):
+        rand = random.Random(size)
+        filenames = ["%s/BenchmarkVectors%s" % (WORK_DIR, DB_EXT),
+                     "%s/BenchmarkNorms%s" % (WORK_DIR, DB_EXT)]
+        vectors_db, norms_db = storage.new_db(), storage.new_db()
+        for db, filename in zip([vectors_db, norms_db], filenames):
+            db.open(filename, storage.OWRITER | storage.OCREATE | storage.OTRUNCATE)
+
+        names = ["vector_%s" % i for i in xrange(size)]
+        vectors = dict((name, random_vector(rand)) for name in names)
+        norms = dict((name, norm(vector)) for name, vector in vectors.items())
+        kc_util.set_bulk(vectors_db, dict((name, codec.dumps(vector))
+                                          for name, vector in vectors.items()))
+        kc_util.set_bulk(norms_db, norms)
+        queries = [random_vector(rand) for _ in xrange(QUERIES)]
+
+        start = time.time()
+        expected = [loop_kNN(vectors_db, norms_db, u, norm(u), names) for u in queries]
+        loop_time = (time.time() - start) / QUERIES
+
+        start = time.time()
+        engine = KNNEngine(names, kc_util.get_bulk(vectors_db, names),
+                           dict((name, float(norms_db.get(name))) for name in names))
+        load_time = time.time() - start
+
+        start = time.time()
+        results = [engine.kNN(u, norm(u)) for u in queries]
+        engine_time = (time.time() - start) / QUERIES
+
+        logging.info("%s vectors: loop %.1f ms, engine %.1f ms (x%.0f, load %.1f s), same results: %s" \
+                % (size, loop_time * 1000, engine_time * 1000, loop_time / engine_time,
+                   load_time, results == expected))
+
+        for db, filename in zip([vectors_db, norms_db], filenames):
+            db.close()
+            os.remove(filename)
+
+    if not os.path.exists(WORK_DIR):
+        os.makedirs(WORK_DIR)
+
+    logging.info("engine: %s" % ("numpy/scipy" if sparse else "pure python"))
+    for size in [1000, 10000, 100000]:
+        benchmark(size)
+
+# see the src/classifier.py for more
@@ -4,27 +4,224 @@
 # Kyoto cabinet util.
 #
 
-import pickle
+import codec
 
-def gen_db(cursor):
+class LazyValue(object):
+    """ A value read from a database, decoded the first time it is used.
+
+    Attributes:
+        record (str): The record of the codec or the old pickle.
+
+    """
+    __slots__ = ("record", "_value")
+
+    def __init__(self, record):
+        self.record = record
+
+    @property
+    def value(self):
+        """ object: The decoded value. """
+        try:
+            return self._value
+        except AttributeError:
+            self._value = codec.loads(self.record)
+            return self._value
+
+def gen_records(cursor, prefix="", start=None, end=None):
+    """ Returns a generator of raw records from a kyoto cabinet database.
+
+    The values are not decoded. With a prefix, only entries with a key
+    starting with the prefix are read and the prefix is removed from the keys.
+    With a range, only the keys from "start" (included) to "end" (excluded)
+    are read, in the order of the keys (the bounds are given without the prefix).
+    The database must be sorted by key (a tree database .kct of kyoto cabinet
+    or a SQLiteDB) for the prefix and the range.
+
+    Args:
+        cursor (kyotocabinet.cursor): The cursor of the db.
+        prefix (str, optional): The prefix of the keys.
+        start (str, optional): The first key of the range.
+        end (str, optional): The end of the range (excluded).
+
+    Yields:
+        tuple (str, str): A generator of tuples (key, record).
+
+    """
+    first = prefix + (start or "")
+    if first:
+        cursor.jump(first)
+    else:
+        cursor.jump()
+
+    last = end is not None and prefix + end
+    while True:
+        rec = cursor.get(True)
+        if not rec or not rec[0].startswith(prefix) or (last and rec[0] >= last):
+            break
+
+        yield rec[0][len(prefix):], rec[1]
+
+def gen_db(cursor, prefix="", start=None, end=None, lazy=False):
     """ Returns a generator of items from a kyoto cabinet database.
     
     Return tuples with:
     - name of the entry
-    - object stored for the entry. 
+    - object stored for the entry (a record of the codec or an old pickle). 
+
+    With a prefix, only entries with a key starting with the prefix are read
+    and the prefix is removed from the name of the entry. The range is the
+    one of gen_records. With "lazy", the objects are only decoded when they
+    are used, so an entry can be skipped at the cost of reading its record.
     
     Args:
         cursor (kyotocabinet.cursor): The cursor of the db.
+        prefix (str, optional): The prefix of the keys.
+        start (str, optional): The first key of the range.
+        end (str, optional): The end of the range (excluded).
+        lazy (boolean, optional): Returns LazyValue objects.
 
     Yields:
         tuple (str, obj): A generator of tuples.
 
     """
-    cursor.jump()
-            
+    for key, record in gen_records(cursor, prefix, start, end):
+        yield key, LazyValue(record) if lazy else codec.loads(record)
+
+def gen_keys(cursor, prefix="", start=None, end=None):
+    """ Returns a generator of keys from a kyoto cabinet database.
+
+    The values are not read. The prefix and the range are the ones
+    of gen_records.
+
+    Args:
+        cursor (kyotocabinet.cursor): The cursor of the db.
+        prefix (str, optional): The prefix of the keys.
+        start (str, optional): The first key of the range.
+        end (str, optional): The end of the range (excluded).
+
+    Yields:
+        str: A generator of keys.
+
+    """
+    first = prefix + (start or "")
+    if first:
+        cursor.jump(first)
+    else:
+        cursor.jump()
+
+    last = end is not None and prefix + end
     while True:
-        rec = cursor.get(True)
-        if not rec: 
+        key = cursor.get_key(True)
+        if not key or not key.startswith(prefix) or (last and key >= last):
             break
 
-        yield rec[0], pickle.loads(rec[1])
+        yield key[len(prefix):]
+
+def get_bulk(db, keys, prefix="", lazy=False):
+    """ Returns the objects of many keys with a single read.
+
+    Args:
+        db (kyotocabinet.DB): The database.
+        keys (list of str): The keys, without the prefix.
+        prefix (str, optional): The prefix of the keys.
+        lazy (boolean, optional): Returns LazyValue objects.
+
+    Returns:
+        dict: The objects by key, the missing keys are not in the dict.
+
+    """
+    records = db.get_bulk(["%s%s" % (prefix, key) for key in keys], False)
+
+    return dict((key[len(prefix):], LazyValue(record) if lazy else codec.loads(record))
+                for key, record in records.items())
+
+def set_bulk(db, records):
+    """ Stores many records with a single transaction.
+
+    All records are stored or none of them if there is an error.
+    
+    Args:
+        db (kyotocabinet.DB): The database.
+        records (dict): The records to store (key, serialized value).
+
+    Raises:
+        IOError: The transaction is aborted.
+
+    """
+    if not records:
+        return
+
+    if not db.begin_transaction():
+        raise IOError("can't begin the transaction: %s" % db.error())
+
+    try:
+        stored = db.set_bulk(records, False)
+    except:
+        db.end_transaction(False)
+        raise
+
+    if stored != len(records):
+        error = db.error()
+        db.end_transaction(False)
+        raise IOError("transaction aborted: %s" % error)
+
+    if not db.end_transaction(True):
+        raise IOError("can't commit the transaction: %s" % db.error())
+
+def remove_prefix(db, prefix):
+    """ Removes all records with a key starting with the prefix.
+
+    All records are removed or none of them if there is an error.
+
+    Args:
+        db (kyotocabinet.DB): The database.
+        prefix (str): The prefix of the keys.
+
+    Raises:
+        IOError: The records can't be removed.
+
+    """
+    keys = db.match_prefix(prefix)
+    if keys and db.remove_bulk(keys, True) < 0:
+        raise IOError("can't remove the records: %s" % db.error())
+
+def convert_db(db, prefix=""):
+    """ Converts the pickles of the registered classes to records of the codec.
+
+    The records are written by batches of 1000 with a transaction,
+    the values which are not pickles of a registered class are unchanged.
+
+    Args:
+        db (kyotocabinet.DB): The database.
+        prefix (str, optional): The prefix of the keys.
+
+    Returns:
+        int: The number of records converted.
+
+    Raises:
+        IOError: A batch can't be written.
+
+    """
+    converted = 0
+    records = {}
+
+    for key, record in gen_records(db.cursor(), prefix):
+        if codec.is_record(record):
+            continue
+
+        try:
+            obj = codec.loads_pickle(record)
+        except Exception:
+            # not a pickle
+            continue
+
+        if type(obj) in codec.CODES:
+            records[prefix + key] = codec.dumps(obj)
+
+        if len(records) >= 1000:
+            set_bulk(db, records)
+            converted += len(records)
+            records = {}
+
+    set_bulk(db, records)
+    return converted + len(records)
@@ -38,28 +38,89 @@ class Manager():
     def add_feeds(self):
         """ Populates the feed manager with some feeds.
 
-        Name, url and tag are extracted from the file at "$URLS_FILE".
+        Name, url, tag and language are extracted from the file at "$URLS_FILE".
 
         """
-        for name, url, tag, _ in self.get_feeds_info():
-            self.collector.add_feed(name, url, tag) 
+        self.collector.add_feeds(self.get_feeds_info())
 
     def add_texts_vectors(self):
         """ Populates the classifier with texts and vectors.
 
         Information is extracted from the feed manager.
+        The next changes are added with "update_texts_vectors".
 
         """
+        # the events until now are included
+        watermark = self.collector.event_seq
+
+        feeds = []
         for name, feed in self.collector.get_feeds():
+            text = [text for _, text in self.collector.get_text_from_items(name)]
+            feeds.append((name, feed.tag, "".join(text)))
+
+        # the dictionary is written once for all texts
+        self.classifier.add_texts(feed_text for _, _, feed_text in feeds)
+
+        for name, tag, feed_text in feeds:
+            self.classifier.add_vector(name, feed_text, tag)
+
+            logging.debug('vector added %s %s ' % (name, tag))
+
+        self.classifier.set_idf()
+        self.classifier.set_tfidf_norm()
+        self.classifier.set_watermark(watermark)
+
+    def update_texts_vectors(self):
+        """ Updates the classifier with the changes of the collector since the last call.
+
+        Only the feeds with new items, new web page texts or items removed
+        are read again: their texts are counted again in the dictionary.
+        The vectors and the texts of the removed feeds are removed.
+
+        Returns:
+            int: The number of vectors updated.
+
+        """
+        watermark = self.classifier.get_watermark()
+
+        names, removed = set(), set()
+        for event in self.collector.get_events(watermark):
+            watermark = event.seq
+            if event.action == "rm_feed":
+                names.discard(event.name)
+                removed.add(event.name)
+            elif event.action in ("add", "update", "rm"):
+                names.add(event.name)
+                removed.discard(event.name)
+
+        # the words of the old texts are not counted anymore by the idf,
+        # the items removed from a feed included (one pass on the dictionary)
+        self.classifier.rm_texts(removed | names)
+        for name in removed:
+            self.classifier.rm_vector(name)
+
+        for name in names:
+            feed = self.collector.get_feed(name)
+            if not feed:
+                self.classifier.rm_vector(name)
+                continue
+
             text = [text for _, text in self.collector.get_text_from_items(name)]
             feed_text = "".join(text)
+
             self.classifier.add_text(feed_text)
+            if self.classifier.get_vector(name):
+                self.classifier.rm_vector(name)
             self.classifier.add_vector(name, feed_text, feed.tag)
 
-            logging.debug('vector added %s %s ' % (name, feed.tag))
+            logging.debug('vector updated %s %s ' % (name, feed.tag))
 
-        self.classifier.set_idf()
-        self.classifier.set_tfidf_norm()
+        if names or removed:
+            self.classifier.set_idf()
+            self.classifier.set_tfidf_norm()
+        self.classifier.set_watermark(watermark)
+
+        return len(names)
 
     def add_general_feed(self, name, url):
         """ Adds a general feed to the feed manager with unspecified categories.
@@ -105,7 +166,7 @@ class Manager():
 
             # update the item with the category
             self.classifier.update_vector_tag(u_evaluate, tag)
-            self.collector.update_item_tag(feed.item_db_filename, item.id, tag)
+            self.collector.update_item_tag(feed.item_db_filename, item.id, tag, name)
 
             logging.info("item %s added with category %s" % (u_evaluate, tag)) 
 
@@ -149,7 +210,7 @@ class Manager():
          - name (str): Name of the feed.
          - url (str): Url of the feed.
          - tag (str): The tag attached.
-         - language (str): The language of the feed.
+         - language (str): The language code of the feed ("fr", "en").
 
         Returns:
             list of tuple: Return a list with feed information.
@@ -161,13 +222,13 @@ class Manager():
             lines = f.readlines()
 
         for line in lines:
-            item = line.split(" ")
+            item = line.strip().split(" ")
             if (item[0].startswith("#") or len(item) < 2):
                 continue
             
             # unpack and sort variables 
             tag, name, url, language = item
-            infos.append((name, url, tag, language))
+            infos.append((name, url, tag, language.lower()))
 
         return infos
 
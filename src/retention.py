@@ -0,0 +1,213 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Removes the old items of the feeds
+# and compacts the databases of items.
+#
+
+import threading, time
+
+from settings import RETENTION_MAX_AGE, RETENTION_MAX_ITEMS, RETENTION_FEEDS, \
+        RETENTION_INTERVAL, RETENTION_COMPACT_RATIO
+
+import logging
+if __name__ == "__main__":
+    format_str = "%(asctime)s %(levelname)s %(funcName)s: %(message)s"
+    logging.basicConfig(format=format_str, level=logging.DEBUG)
+
+class Retention:
+    """ Removes the old items of the feeds of a collector in the background.
+
+    An item is removed if it is older than the maximum age or if the feed
+    has more than the maximum number of items (the oldest are removed).
+    The limits are the same for all feeds, except for the feeds with
+    their own policy (RETENTION_FEEDS). A limit set to None keeps the items.
+
+    The age of an item is the age of its publication date, read from
+    the index of publication dates of the collector (see Collector.index_dates
+    for the items stored before the index).
+
+    After the removals, the databases of items with many items removed are
+    rebuilt (see Collector.compact_items_dbs), so the files shrink.
+
+    Examples:
+    >>> retention = Retention(Collector(), max_age=7*24*3600)
+    >>> retention.poll()
+    {'lemonde_sport': 12, 'nytimes_sport': 0}
+    >>> retention.start() # until retention.stop() is called
+    >>> retention.close()
+
+    Attributes:
+        collector (Collector): The collector of the feeds.
+        max_age (int): Maximum age of the items in seconds or None.
+        max_items (int): Maximum number of items by feed or None.
+        policies (dict): The maximum age and number of items by feed name.
+        interval (float): Time in seconds between two runs.
+        compact_ratio (float): Part of the items removed to rebuild a database.
+        stopped (threading.Event): Set to stop the background job.
+        thread (threading.Thread): The background job or None.
+        removed (int): Number of items removed.
+
+    """
+    def __init__(self, collector, max_age=RETENTION_MAX_AGE, max_items=RETENTION_MAX_ITEMS,
+                 policies=RETENTION_FEEDS, interval=RETENTION_INTERVAL,
+                 compact_ratio=RETENTION_COMPACT_RATIO):
+        """ Sets the retention policy.
+
+        Args:
+            collector (Collector): The collector of the feeds.
+            max_age (int, optional): Maximum age of the items in seconds or None.
+            max_items (int, optional): Maximum number of items by feed or None.
+            policies (dict, optional): The maximum age and number of items by feed name.
+            interval (float, optional): Time in seconds between two runs.
+            compact_ratio (float, optional): Part of the items removed to rebuild a database.
+
+        """
+        self.collector = collector
+        self.max_age = max_age
+        self.max_items = max_items
+        self.policies = policies
+        self.interval = interval
+        self.compact_ratio = compact_ratio
+        self.stopped = threading.Event()
+        self.thread = None
+        self.removed = 0
+
+    def get_policy(self, name):
+        """ Returns the retention policy of a feed.
+
+        Args:
+            name (str): Name of the feed.
+
+        Returns:
+            tuple (int, int): The maximum age and the maximum number of items.
+
+        """
+        return self.policies.get(name, (self.max_age, self.max_items))
+
+    def expire(self, name, now=None):
+        """ Removes the items of a feed out of its retention policy.
+
+        Args:
+            name (str): Name of the feed.
+            now (float, optional): The current time, defaults to time.time().
+
+        Returns:
+            int: The number of items removed.
+
+        """
+        now = now or time.time()
+        max_age, max_items = self.get_policy(name)
+
+        # the most recent items first
+        dates = self.collector.get_item_dates(name)[::-1]
+
+        kept = len(dates)
+        if max_items is not None:
+            kept = min(kept, max_items)
+        if max_age is not None:
+            kept = min(kept, len([1 for _, timestamp in dates
+                                  if timestamp >= now - max_age]))
+
+        expired = [item_id for item_id, _ in dates[kept:]]
+        if not expired:
+            return 0
+
+        return self.collector.rm_items(name, expired)
+
+    def poll(self, now=None):
+        """ Removes the old items of all feeds and compacts the databases.
+
+        Args:
+            now (float, optional): The current time, defaults to time.time().
+
+        Returns:
+            dict: The number of items removed by feed name.
+
+        """
+        removed = {}
+        for name in self.collector.get_feeds_name():
+            removed[name] = self.expire(name, now)
+
+        compacted = self.collector.compact_items_dbs(self.compact_ratio)
+
+        self.removed += sum(removed.values())
+        logging.info("%s items removed, %s databases compacted" % \
+                     (sum(removed.values()), compacted))
+
+        return removed
+
+    def run(self):
+        """ Removes the old items every interval until the job is stopped.
+
+        """
+        logging.info("retention started")
+
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception as er:
+                logging.error(er)
+
+            self.stopped.wait(self.interval)
+
+        logging.info("retention stopped after %s items removed" % self.removed)
+
+    def start(self):
+        """ Starts the background job.
+
+        Returns:
+            threading.Thread: The thread of the job.
+
+        """
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="retention")
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self.thread
+
+    def stop(self):
+        """ Stops the job started with "run" or "start".
+
+        """
+        self.stopped.set()
+
+    def close(self):
+        """ Stops the background job and waits for the end of the current run.
+
+        """
+        self.stop()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+###########################################################################
+# Retention Example
+###########################################################################
+
+if __name__ == "__main__":
+    from collector import Collector
+    from manager import Manager
+
+    collector = Collector()
+    collector.add_feeds(Manager.get_feeds_info())
+
+    def print_item_counts_test():
+        for name in collector.get_feeds_name():
+            print("%s: %s items" % (name, len(collector.get_item_dates(name))))
+
+    ## keep the last 5 items of each feed
+    print_item_counts_test()
+    with Retention(collector, max_items=5) as retention:
+        retention.poll()
+    print_item_counts_test()
+    ##
+
+    collector.close()
@@ -0,0 +1,367 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Updates the feeds at the pace of their publications.
+#
+
+import pickle
+import storage
+import kyotocabinetutil as kc_util
+
+import random, threading, time
+from email.utils import parsedate_tz, mktime_tz
+
+from settings import SCHEDULER_DB_FILENAME, SCHEDULER_DEFAULT_INTERVAL, \
+        SCHEDULER_MIN_INTERVAL, SCHEDULER_MAX_INTERVAL, SCHEDULER_JITTER, \
+        SCHEDULER_CONCURRENCY, SCHEDULER_HISTORY
+
+import logging
+if __name__ == "__main__":
+    format_str = "%(asctime)s %(levelname)s %(funcName)s: %(message)s"
+    logging.basicConfig(format=format_str, level=logging.DEBUG)
+
+class Scheduler:
+    """ Updates the feeds of a collector at the pace of their publications.
+
+    Each feed has its own interval between two updates, learned from:
+     - its cadence, the median time between its last publications;
+     - its rate of updates without new items (304 Not Modified thanks to
+       the etag and the modified date of the feed, or the same items).
+
+    The interval goes from half the cadence for a feed always modified
+    to one and a half the cadence for a feed never modified, between
+    SCHEDULER_MIN_INTERVAL and SCHEDULER_MAX_INTERVAL. A random jitter
+    spreads the updates of the feeds with the same interval.
+
+    The feeds due at the same time are updated together by the collector,
+    with at most "concurrency" feeds downloaded at the same time.
+    The schedules are stored in a database and survive a restart.
+
+    Examples:
+    >>> scheduler = Scheduler(Collector())
+    >>> scheduler.poll()
+    {'lemonde_sport': True, 'nytimes_sport': False}
+    >>> scheduler.get_schedule("nytimes_sport").interval
+    5400.0
+    >>> scheduler.run() # until scheduler.stop() is called by another thread
+    >>> scheduler.close()
+
+    Attributes:
+        collector (Collector): The collector of the feeds.
+        concurrency (int): Maximum number of feeds updated at the same time.
+        jitter (float): Part of the interval changed randomly.
+        schedule_db (kyotocabinet.DB): The schedules by feed name.
+        stopped (threading.Event): Set to stop the scheduler.
+        requests (int): Number of feeds updated.
+        modified (int): Number of feeds updated with new items.
+
+    """
+    # weight of the last update in the rate of updates without new items
+    rate_weight = 0.3
+
+    def __init__(self, collector, concurrency=SCHEDULER_CONCURRENCY,
+                 jitter=SCHEDULER_JITTER):
+        """ Opens or creates the database of schedules.
+
+        Args:
+            collector (Collector): The collector of the feeds.
+            concurrency (int, optional): Maximum number of feeds updated at the same time.
+            jitter (float, optional): Part of the interval changed randomly.
+
+        """
+        self.collector = collector
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.schedule_db = storage.new_db()
+        self.schedule_db.open(SCHEDULER_DB_FILENAME,
+                              storage.OWRITER | storage.OCREATE)
+        self.stopped = threading.Event()
+        self.requests = 0
+        self.modified = 0
+
+    def poll(self, now=None):
+        """ Updates the feeds due and schedules their next update.
+
+        New feeds of the collector are scheduled at a random time of their
+        first interval, the schedules of removed feeds are dropped.
+
+        Args:
+            now (float, optional): The current time, defaults to time.time().
+
+        Returns:
+            dict: True by name of the feeds updated if new items has been added.
+
+        """
+        now = now or time.time()
+        schedules = self.__sync(now)
+
+        due = [name for name, schedule in schedules.items()
+               if schedule.next_time <= now]
+        if not due:
+            return {}
+
+        updated = self.collector.update_feeds(due, self.concurrency)
+
+        records = {}
+        for name in due:
+            schedule = schedules[name]
+            self.__reschedule(schedule, updated[name], now)
+            records[name] = pickle.dumps(schedule)
+
+        kc_util.set_bulk(self.schedule_db, records)
+
+        self.requests += len(due)
+        self.modified += sum(updated.values())
+        logging.info("%s feeds updated, %s with new items" % \
+                     (len(due), sum(updated.values())))
+
+        return updated
+
+    def run(self):
+        """ Updates the feeds until the scheduler is stopped.
+
+        The scheduler sleeps until the next feed is due, and wakes up
+        at least every SCHEDULER_MIN_INTERVAL to find the new feeds.
+
+        """
+        logging.info("scheduler started")
+
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception as er:
+                logging.error(er)
+
+            self.stopped.wait(self.__wait_time())
+
+        logging.info("scheduler stopped after %s updates, %s with new items" % \
+                     (self.requests, self.modified))
+
+    def stop(self):
+        """ Stops the scheduler started with "run".
+
+        """
+        self.stopped.set()
+
+    def get_schedule(self, name):
+        """ Returns the schedule of a feed.
+
+        Args:
+            name (str): Name of the feed.
+
+        Returns:
+            FeedSchedule: The schedule or None if the feed is not scheduled.
+
+        """
+        pickle_schedule = self.schedule_db.get(name)
+        if not pickle_schedule:
+            return None
+
+        return pickle.loads(pickle_schedule)
+
+    def close(self):
+        """ Stops the scheduler and closes the database of schedules.
+
+        """
+        self.stop()
+        self.schedule_db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    ###########################################################################
+    # Schedules
+    ###########################################################################
+
+    def __sync(self, now):
+        """ Returns the schedules of the feeds of the collector.
+
+        Args:
+            now (float): The current time.
+
+        Returns:
+            dict: The schedules by feed name.
+
+        """
+        schedules = dict(kc_util.gen_db(self.schedule_db.cursor()))
+        names = set(self.collector.get_feeds_name())
+
+        for name in set(schedules) - names:
+            del schedules[name]
+            self.schedule_db.remove(name)
+            logging.debug('schedule of "%s" removed' % name)
+
+        records = {}
+        for name in names - set(schedules):
+            cadence = self.__cadence(name) or SCHEDULER_DEFAULT_INTERVAL
+            schedule = FeedSchedule(name, cadence)
+            schedule.interval = self.__interval(schedule)
+
+            # the first updates are spread over the first interval
+            schedule.next_time = now + random.uniform(0, schedule.interval)
+            schedules[name] = schedule
+            records[name] = pickle.dumps(schedule)
+            logging.debug('"%s" scheduled every %ds' % (name, schedule.interval))
+
+        kc_util.set_bulk(self.schedule_db, records)
+
+        return schedules
+
+    def __reschedule(self, schedule, modified, now):
+        """ Learns the interval of a feed after an update and sets the next update.
+
+        Args:
+            schedule (FeedSchedule): The schedule of the feed.
+            modified (boolean): True if new items has been added with the update.
+            now (float): The time of the update.
+
+        """
+        schedule.updates += 1
+        schedule.not_modified_rate += self.rate_weight * \
+                ((0. if modified else 1.) - schedule.not_modified_rate)
+
+        if modified:
+            schedule.cadence = self.__cadence(schedule.name) or schedule.cadence
+
+        schedule.interval = self.__interval(schedule)
+        schedule.next_time = now + schedule.interval * \
+                (1 + random.uniform(-self.jitter, self.jitter))
+
+    def __interval(self, schedule):
+        """ Returns the interval of a feed from its cadence and its rate of updates
+        without new items.
+
+        Args:
+            schedule (FeedSchedule): The schedule of the feed.
+
+        Returns:
+            float: The interval in seconds.
+
+        """
+        interval = schedule.cadence * (0.5 + schedule.not_modified_rate)
+
+        return float(min(max(interval, SCHEDULER_MIN_INTERVAL), SCHEDULER_MAX_INTERVAL))
+
+    def __cadence(self, name):
+        """ Returns the median time between the last publications of a feed.
+
+        Args:
+            name (str): Name of the feed.
+
+        Returns:
+            float: The cadence in seconds or None without enough publication dates.
+
+        """
+        # the items stored before the timestamps have only the date
+        timestamps = [item.published_ts or self.__timestamp(item.published_date)
+                      for _, item in self.collector.get_items(
+                              name, ["published_ts", "published_date"])]
+        timestamps = sorted(ts for ts in timestamps if ts)[-SCHEDULER_HISTORY:]
+
+        gaps = sorted(t_2 - t_1 for t_1, t_2 in zip(timestamps, timestamps[1:])
+                      if t_2 > t_1)
+        if not gaps:
+            return None
+
+        return float(gaps[len(gaps) / 2])
+
+    def __wait_time(self):
+        """ Returns the time to wait until the next feed is due.
+
+        Returns:
+            float: The time in seconds, at most SCHEDULER_MIN_INTERVAL.
+
+        """
+        next_times = [schedule.next_time for _, schedule
+                      in kc_util.gen_db(self.schedule_db.cursor())]
+        if not next_times:
+            return SCHEDULER_MIN_INTERVAL
+
+        return min(max(min(next_times) - time.time(), 1), SCHEDULER_MIN_INTERVAL)
+
+    @staticmethod
+    def __timestamp(date):
+        """ Returns the timestamp of a publication date like
+        "Tue, 04 Nov 2014 02:19:30 GMT".
+
+        Args:
+            date (unicode): The publication date.
+
+        Returns:
+            float: The timestamp or None if the date can't be read.
+
+        """
+        try:
+            return float(mktime_tz(parsedate_tz(date)))
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+
+class FeedSchedule:
+    """ The schedule of the updates of a feed.
+
+    Attributes:
+        name (str): Name of the feed.
+        cadence (float): Median time in seconds between two publications.
+        interval (float): Time in seconds between two updates.
+        next_time (float): Time of the next update.
+        not_modified_rate (float): Moving rate of updates without new items.
+        updates (int): Number of updates.
+
+    """
+    def __init__(self, name, cadence):
+        """ Sets the cadence of the feed.
+
+        Args:
+            name (str): Name of the feed.
+            cadence (float): Median time in seconds between two publications.
+
+        """
+        self.name = name
+        self.cadence = cadence
+        self.interval = cadence
+        self.next_time = 0.
+        self.not_modified_rate = 0.5
+        self.updates = 0
+
+    def __str__(self):
+        return (
+            "cadence     : %ds\n"
+            "interval    : %ds\n"
+            "next update : %s\n"
+            "not modified: %.2f\n"
+            "updates     : %s" % (
+                self.cadence, self.interval,
+                time.ctime(self.next_time),
+                self.not_modified_rate, self.updates))
+
+###########################################################################
+# Scheduler Example
+###########################################################################
+
+if __name__ == "__main__":
+    from collector import Collector
+    from manager import Manager
+
+    collector = Collector()
+    collector.add_feeds(Manager.get_feeds_info())
+    scheduler = Scheduler(collector)
+
+    def print_schedules_test():
+        for name in collector.get_feeds_name():
+            print(name)
+            print(scheduler.get_schedule(name))
+            print("-----------")
+
+    ## run the scheduler for one minute (the feeds due are updated)
+    threading.Timer(60, scheduler.stop).start()
+    scheduler.poll(time.time() + SCHEDULER_MAX_INTERVAL)
+    scheduler.run()
+    print_schedules_test()
+    ##
+
+    scheduler.close()
+    collector.close()
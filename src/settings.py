@@ -13,28 +13,118 @@ def create(directory):
 RESOURCES_DIR = "resources"
 WORK_DIR = create("work_dir")
 
+# storage backend of the databases (see storage.new_db):
+# "kyoto" for kyoto cabinet, "sqlite" for SQLite in WAL mode
+# (the databases can be read by many processes)
+STORAGE_BACKEND = "kyoto"
+STORAGE_MMAP_SIZE = 256 * 1024 * 1024 # bytes of a SQLite database read with mmap
+STORAGE_TIMEOUT = 30 # seconds waited by a SQLite writer for the lock of another process
+DB_EXT = {"kyoto": ".kct", "sqlite": ".sqlite"}[STORAGE_BACKEND]
+
 ###########################################################################
 # Collector 
 ###########################################################################
 
 # because extracting article is slow 
 # sometime, is useful to deactivate this function
+# (articles are extracted in the background, see Collector.update_articles)
 ACTIVE_ACTICLE_EXTRACTOR = False
+EXTRACTOR_PROCESSES = 4 # worker processes of the article extractor
+EXTRACTOR_TIMEOUT = 20 # seconds to download and extract an article
+EXTRACTION_CACHE_FILENAME = "%s/Articles%s"%(WORK_DIR, DB_EXT)
+
+FEEDS_DB_FILENAME = "%s/Feeds%s"%(WORK_DIR, DB_EXT)
+
+# store the items of all feeds in a single database
+# instead of one database file by feed (see Collector.migrate_items_db)
+SHARED_ITEMS_DB = False
+ITEMS_DB_FILENAME = "%s/Items%s"%(WORK_DIR, DB_EXT)
+
+# texts of the linked web pages, stored apart from the items
+# (see Collector.get_items)
+BODIES_DB_FILENAME = "%s/Bodies%s"%(WORK_DIR, DB_EXT)
+
+# the texts of at least this number of bytes are compressed with zlib
+# (the bodies and the large fields of the records, see codec.pack_text)
+COMPRESS_THRESHOLD = 256
+COMPRESS_LEVEL = 6
+
+# maximum number of databases of items kept open by the collector
+ITEMS_DB_CACHE_SIZE = 64
 
-FEEDS_DB_FILENAME = "%s/Feeds.kct"%WORK_DIR
+# ordered log of the changes of the items (see Collector.get_events)
+EVENTS_DB_FILENAME = "%s/Events%s"%(WORK_DIR, DB_EXT)
+
+# items by publication date (see Collector.get_items_between)
+DATES_DB_FILENAME = "%s/Dates%s"%(WORK_DIR, DB_EXT)
+
+# flag the near-duplicate items of the feeds (see DuplicateIndex)
+ACTIVE_DEDUP = False
+DEDUP_DB_FILENAME = "%s/Fingerprints%s"%(WORK_DIR, DB_EXT)
+DEDUP_MAX_DISTANCE = 3 # different bits of the fingerprints of two near-duplicates
 DEFAULT_LANGUAGE_CODE = "fr"
 
+# language of the items (see LanguageGuesser)
+LANGUAGE_SAMPLE_RATE = 10 # one item in ten is checked when the feed language is known
+LANGUAGE_STABLE_VOTES = 3 # same language detected in a row to trust it for the feed
+LANGUAGE_CACHE_MAX_LENGTH = 300 # abstracts up to this length are cached by hash
+LANGUAGE_CACHE_SIZE = 4096
+
+# number of feeds downloaded at the same time 
+# with Collector.add_feeds and Collector.update_feeds
+FEEDS_CONCURRENCY = 8
+
+###########################################################################
+# Fetcher
+###########################################################################
+
+FETCH_CONNECT_TIMEOUT = 10 # seconds to open a connection
+FETCH_READ_TIMEOUT = 30 # seconds to read a whole response
+FETCH_MAX_CONNECTIONS_PER_HOST = 4 # persistent connections by host
+FETCH_MAX_REDIRECTS = 5
+
+###########################################################################
+# Scheduler
+###########################################################################
+
+SCHEDULER_DB_FILENAME = "%s/Schedule%s"%(WORK_DIR, DB_EXT)
+SCHEDULER_DEFAULT_INTERVAL = 3600 # seconds between two updates of a new feed
+SCHEDULER_MIN_INTERVAL = 5*60
+SCHEDULER_MAX_INTERVAL = 24*3600
+SCHEDULER_JITTER = 0.1 # the interval is changed randomly by +/- 10%
+SCHEDULER_CONCURRENCY = 4 # feeds updated at the same time
+SCHEDULER_HISTORY = 20 # last publications used to learn the cadence of a feed
+
+###########################################################################
+# Retention
+###########################################################################
+
+RETENTION_MAX_AGE = 30*24*3600 # seconds, None to keep the old items
+RETENTION_MAX_ITEMS = 1000 # items by feed, None to keep all items
+# policies of some feeds: {"feed name": (max age, max items)}
+RETENTION_FEEDS = {}
+RETENTION_INTERVAL = 3600 # seconds between two runs
+# a database is rebuilt when this part of its items has been removed
+RETENTION_COMPACT_RATIO = 0.3
+
 ###########################################################################
 # Classifier
 ###########################################################################
 
-DICTIONARY_DB_FILENAME = "%s/Dictionary.kct"%WORK_DIR
-VECTOR_DB_FILENAME = "%s/Vectors.kct"%WORK_DIR
-VECTORS_NORM_DB_FILENAME = "%s/VectorsNorm.kct"%WORK_DIR
-CLASSIFIER_STATE_FILENAME = "%s/ClassifierState.kct"%WORK_DIR
+DICTIONARY_DB_FILENAME = "%s/Dictionary%s"%(WORK_DIR, DB_EXT)
+VECTOR_DB_FILENAME = "%s/Vectors%s"%(WORK_DIR, DB_EXT)
+VECTORS_NORM_DB_FILENAME = "%s/VectorsNorm%s"%(WORK_DIR, DB_EXT)
+CLASSIFIER_STATE_FILENAME = "%s/ClassifierState%s"%(WORK_DIR, DB_EXT)
+POSTINGS_DB_FILENAME = "%s/Postings%s"%(WORK_DIR, DB_EXT)
 
 K_ITEM = 5 # size of the k-nearest neighbor
 MIN_COS_SINE = 0.1 # min cosine of the neighbor
+# store the vectors with normalized tf-idf weights: the cosine similarity
+# is a scalar product and the VectorsNorm database is not used
+NORMALIZED_VECTORS = False
+# "postings": the neighbors are searched among the vectors sharing words
+# (inverted index), "matrix": all the vectors are loaded and scored (knn.py)
+KNN_ENGINE = "postings"
 
 ###########################################################################
 # Manager
@@ -47,5 +137,6 @@ URLS_FILE = "%s/urls.txt"%RESOURCES_DIR
 ###########################################################################
 
 INDEX_DIR="%s/index_dir"%WORK_DIR
+INDEXER_STATE_FILENAME = "%s/IndexerState%s"%(WORK_DIR, DB_EXT)
 
 
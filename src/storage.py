@@ -0,0 +1,609 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Storage backends of the databases.
+#
+
+import os, sqlite3, threading
+
+try:
+    import kyotocabinet as kc
+except ImportError:
+    # the SQLite backend doesn't need kyoto cabinet
+    kc = None
+
+from settings import STORAGE_BACKEND, STORAGE_MMAP_SIZE, STORAGE_TIMEOUT
+
+import logging
+if __name__ == "__main__":
+    format_str = "%(asctime)s %(levelname)s %(funcName)s: %(message)s"
+    logging.basicConfig(format=format_str, level=logging.DEBUG)
+
+# open modes, the values of kyoto cabinet
+OREADER = 1 << 0
+OWRITER = 1 << 1
+OCREATE = 1 << 2
+OTRUNCATE = 1 << 3
+
+# number of records read at once by a cursor
+CURSOR_BATCH = 256
+
+def new_db(backend=None):
+    """ Returns a database of the storage backend, not opened yet.
+
+    All backends have the interface of the tree databases of kyoto cabinet
+    used by the project (see SQLiteDB): get/set/add/replace/remove, the bulk
+    methods, match_prefix, the transactions and the cursors sorted by key.
+
+    Examples:
+    >>> db = new_db()
+    >>> db.open(FEEDS_DB_FILENAME, OWRITER | OCREATE)
+    True
+
+    Args:
+        backend (str, optional): "kyoto" or "sqlite", defaults to STORAGE_BACKEND.
+
+    Returns:
+        kyotocabinet.DB or SQLiteDB: The database.
+
+    Raises:
+        ImportError: Kyoto cabinet is not installed.
+        ValueError: The backend is unknown.
+
+    """
+    backend = backend or STORAGE_BACKEND
+
+    if backend == "kyoto":
+        if not kc:
+            raise ImportError("kyotocabinet is needed by the kyoto backend")
+        return kc.DB()
+
+    if backend == "sqlite":
+        return SQLiteDB()
+
+    raise ValueError("unknown storage backend: %s" % backend)
+
+def _blob(data):
+    """ Returns a key or a value as a blob, like kyoto cabinet stores it.
+
+    Args:
+        data (object): A str, an unicode string or a number.
+
+    Returns:
+        buffer: The bytes.
+
+    """
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
+    elif not isinstance(data, str):
+        data = str(data)
+    return buffer(data)
+
+class SQLiteDB:
+    """ A database of records sorted by key stored with SQLite.
+
+    The records are (key, value) byte strings in a table without rowid, so
+    the keys are sorted like in a tree database of kyoto cabinet. The database
+    is in WAL mode and read with memory mapping (STORAGE_MMAP_SIZE): many
+    processes can read it while a process writes, the readers see the last
+    committed transaction.
+
+    The methods return False or None on error like kyoto cabinet, the error
+    is given by "error". A database can be shared by the threads of a process.
+
+    Examples:
+    >>> db = SQLiteDB()
+    >>> db.open("work_dir/Feeds.sqlite", OWRITER | OCREATE)
+    True
+    >>> db.set("key", "value")
+    True
+    >>> db.get("key")
+    'value'
+
+    Attributes:
+        conn (sqlite3.Connection): The connection or None if closed.
+        filename (str): Name of the database file.
+        lock (threading.RLock): Held by a thread during a transaction.
+        transaction (boolean): True during a transaction.
+        last_error (str): The last error.
+
+    """
+    def __init__(self):
+        self.conn = None
+        self.filename = None
+        self.lock = threading.RLock()
+        self.transaction = False
+        self.last_error = "no error"
+
+    def open(self, filename, mode=OWRITER | OCREATE):
+        """ Opens the database file.
+
+        Args:
+            filename (str): Name of the database file.
+            mode (int, optional): OREADER or OWRITER with OCREATE and OTRUNCATE.
+
+        Returns:
+            boolean: False if the database can't be opened.
+
+        """
+        if not mode & OCREATE and not os.path.exists(filename):
+            self.last_error = "no such file: %s" % filename
+            return False
+
+        try:
+            conn = sqlite3.connect(filename, timeout=STORAGE_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+            conn.text_factory = str
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA mmap_size=%d" % STORAGE_MMAP_SIZE)
+
+            if mode & OWRITER:
+                conn.execute("CREATE TABLE IF NOT EXISTS records "
+                             "(key BLOB PRIMARY KEY, value BLOB) WITHOUT ROWID")
+                if mode & OTRUNCATE:
+                    conn.execute("DELETE FROM records")
+            else:
+                conn.execute("PRAGMA query_only=ON")
+
+        except sqlite3.Error as er:
+            self.last_error = "%s: %s" % (filename, er)
+            return False
+
+        self.conn = conn
+        self.filename = filename
+        return True
+
+    def close(self):
+        """ Closes the database, the WAL is written to the file.
+
+        Returns:
+            boolean: False if the database is not opened.
+
+        """
+        with self.lock:
+            if not self.conn:
+                return False
+            self.conn.close()
+            self.conn = None
+        return True
+
+    def error(self):
+        return self.last_error
+
+    def path(self):
+        return self.filename
+
+    ###########################################################################
+    # Records
+    ###########################################################################
+
+    def get(self, key):
+        """ Returns the value of a key.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            str: The value or None if the key doesn't exist.
+
+        """
+        rows = self.execute("SELECT value FROM records WHERE key = ?", (_blob(key),))
+        return str(rows[0][0]) if rows else None
+
+    def set(self, key, value):
+        """ Stores a record, the old value is replaced.
+
+        Returns:
+            boolean: False on error.
+
+        """
+        return self.execute("INSERT OR REPLACE INTO records VALUES (?, ?)",
+                            (_blob(key), _blob(value))) is not None
+
+    def add(self, key, value):
+        """ Stores a record if the key doesn't exist.
+
+        Returns:
+            boolean: False if the key exists.
+
+        """
+        return self.__count("INSERT OR IGNORE INTO records VALUES (?, ?)",
+                            (_blob(key), _blob(value))) > 0
+
+    def replace(self, key, value):
+        """ Replaces the value of an existing key.
+
+        Returns:
+            boolean: False if the key doesn't exist.
+
+        """
+        return self.__count("UPDATE records SET value = ? WHERE key = ?",
+                            (_blob(value), _blob(key))) > 0
+
+    def remove(self, key):
+        """ Removes a record.
+
+        Returns:
+            boolean: False if the key doesn't exist.
+
+        """
+        return self.__count("DELETE FROM records WHERE key = ?", (_blob(key),)) > 0
+
+    def set_bulk(self, records, atomic=True):
+        """ Stores many records.
+
+        Args:
+            records (dict): The values by key.
+            atomic (boolean, optional): Stores the records in a transaction.
+
+        Returns:
+            int: The number of records stored or -1 on error.
+
+        """
+        return self.__bulk("INSERT OR REPLACE INTO records VALUES (?, ?)",
+                           [(_blob(key), _blob(value)) for key, value in records.items()],
+                           atomic)
+
+    def get_bulk(self, keys, atomic=True):
+        """ Returns the values of many keys.
+
+        Args:
+            keys (list of str): The keys.
+            atomic (boolean, optional): Unused, a select is always consistent.
+
+        Returns:
+            dict: The values by key, the missing keys are not in the dict.
+
+        """
+        keys = [_blob(key) for key in keys]
+        values = {}
+
+        # the number of parameters of a query is limited
+        for i in xrange(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self.execute("SELECT key, value FROM records WHERE key IN (%s)" % \
+                                  ",".join("?" * len(batch)), batch) or []
+            values.update((str(key), str(value)) for key, value in rows)
+
+        return values
+
+    def remove_bulk(self, keys, atomic=True):
+        """ Removes many records.
+
+        Args:
+            keys (list of str): The keys.
+            atomic (boolean, optional): Removes the records in a transaction.
+
+        Returns:
+            int: The number of records removed or -1 on error.
+
+        """
+        return self.__bulk("DELETE FROM records WHERE key = ?",
+                           [(_blob(key),) for key in keys], atomic)
+
+    def match_prefix(self, prefix, max=-1):
+        """ Returns the keys starting with a prefix, sorted.
+
+        Args:
+            prefix (str): The prefix.
+            max (int, optional): Maximum number of keys, -1 for all.
+
+        Returns:
+            list of str: The keys.
+
+        """
+        query, args = "SELECT key FROM records WHERE key >= ?", [_blob(prefix)]
+
+        end = _prefix_end(str(_blob(prefix)))
+        if end:
+            query += " AND key < ?"
+            args.append(buffer(end))
+
+        rows = self.execute("%s ORDER BY key LIMIT %d" % (query, max), args) or []
+        return [str(row[0]) for row in rows]
+
+    def count(self):
+        rows = self.execute("SELECT COUNT(*) FROM records")
+        return rows[0][0] if rows else -1
+
+    def __len__(self):
+        return max(self.count(), 0)
+
+    def size(self):
+        """ Returns the size of the database file in bytes.
+
+        """
+        rows = self.execute("SELECT page_count * page_size "
+                              "FROM pragma_page_count(), pragma_page_size()")
+        return rows[0][0] if rows else -1
+
+    def clear(self):
+        return self.execute("DELETE FROM records") is not None
+
+    def vacuum(self):
+        """ Rebuilds the database file in place and empties the WAL.
+
+        The file is not replaced: the connections of the other processes
+        stay valid and see the next writes.
+
+        Returns:
+            boolean: False if the database can't be rebuilt.
+
+        """
+        with self.lock:
+            if self.transaction:
+                self.last_error = "can't vacuum during a transaction"
+                return False
+            if self.execute("VACUUM") is None:
+                return False
+            # the readers of other processes can delay the end of the WAL
+            self.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return True
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    ###########################################################################
+    # Transactions
+    ###########################################################################
+
+    def begin_transaction(self, hard=False):
+        """ Begins a transaction, the other threads wait for its end.
+
+        The database is locked for the writers of the other processes,
+        the readers are not blocked.
+
+        Returns:
+            boolean: False if the transaction can't begin.
+
+        """
+        self.lock.acquire()
+        if self.execute("BEGIN IMMEDIATE") is None:
+            self.lock.release()
+            return False
+        self.transaction = True
+        return True
+
+    def end_transaction(self, commit=True):
+        """ Commits or aborts the transaction.
+
+        Returns:
+            boolean: False on error.
+
+        """
+        try:
+            return self.execute("COMMIT" if commit else "ROLLBACK") is not None
+        finally:
+            self.transaction = False
+            self.lock.release()
+
+    def execute(self, query, args=()):
+        """ Runs a query on the database (used by the cursors).
+
+        Args:
+            query (str): The SQL query.
+            args (tuple, optional): The parameters of the query.
+
+        Returns:
+            list of tuple: The rows or None on error.
+
+        """
+        with self.lock:
+            if not self.conn:
+                self.last_error = "the database is not opened"
+                return None
+            try:
+                return self.conn.execute(query, args).fetchall()
+            except sqlite3.Error as er:
+                self.last_error = str(er)
+                return None
+
+    ###########################################################################
+    # Private
+    ###########################################################################
+
+    def __count(self, query, args):
+        """ Runs a query changing records.
+
+        Returns:
+            int: The number of records changed or -1 on error.
+
+        """
+        with self.lock:
+            if not self.conn:
+                self.last_error = "the database is not opened"
+                return -1
+            try:
+                return self.conn.execute(query, args).rowcount
+            except sqlite3.Error as er:
+                self.last_error = str(er)
+                return -1
+
+    def __bulk(self, query, rows, atomic):
+        """ Runs a query for many rows.
+
+        Returns:
+            int: The number of records changed or -1 on error.
+
+        """
+        with self.lock:
+            if not self.conn:
+                self.last_error = "the database is not opened"
+                return -1
+
+            # in a transaction, the transaction decides
+            own = atomic and not self.transaction
+            try:
+                if own:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                changed = self.conn.executemany(query, rows).rowcount
+                if own:
+                    self.conn.execute("COMMIT")
+                return changed
+
+            except sqlite3.Error as er:
+                self.last_error = str(er)
+                if own:
+                    self.conn.rollback()
+                return -1
+
+class SQLiteCursor:
+    """ A cursor on the records of a SQLiteDB, sorted by key.
+
+    The records are read by batches (CURSOR_BATCH), only the keys are read
+    by "get_key". The records changed after a batch is read are not seen
+    before the next batch.
+
+    Attributes:
+        db (SQLiteDB): The database.
+        rows (list of tuple): The next records of the batch, in reverse order.
+        values (boolean): True if the values of the batch are read.
+        next_key (str): The key from which the next batch is read or None at the end.
+        included (boolean): True if the next batch starts with "next_key".
+
+    """
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.values = False
+        self.next_key = None
+        self.included = True
+
+    def jump(self, key=None):
+        """ Moves to the first record with a key greater or equal than a key.
+
+        Args:
+            key (str, optional): The key, defaults to the first record.
+
+        Returns:
+            boolean: False if there is no record.
+
+        """
+        self.rows = []
+        self.next_key = "" if key is None else str(_blob(key))
+        self.included = True
+        return self.__fill(False)
+
+    def jump_back(self, key=None):
+        """ Moves to the last record with a key lower or equal than a key.
+
+        Args:
+            key (str, optional): The key, defaults to the last record.
+
+        Returns:
+            boolean: False if there is no record.
+
+        """
+        if key is None:
+            rows = self.db.execute("SELECT key FROM records ORDER BY key DESC LIMIT 1")
+        else:
+            rows = self.db.execute("SELECT key FROM records WHERE key <= ? "
+                                              "ORDER BY key DESC LIMIT 1", (_blob(key),))
+        if not rows:
+            self.rows, self.next_key = [], None
+            return False
+
+        return self.jump(str(rows[0][0]))
+
+    def get(self, step=False):
+        """ Returns the current record.
+
+        Args:
+            step (boolean, optional): Moves to the next record.
+
+        Returns:
+            tuple (str, str): The key and the value or None at the end.
+
+        """
+        if not self.__fill(True):
+            return None
+        return self.rows.pop() if step else self.rows[-1]
+
+    def get_key(self, step=False):
+        """ Returns the key of the current record, the value is not read.
+
+        """
+        if not self.__fill(self.values):
+            return None
+        return (self.rows.pop() if step else self.rows[-1])[0]
+
+    def __fill(self, values):
+        """ Reads the next batch if needed.
+
+        Args:
+            values (boolean): The values are needed.
+
+        Returns:
+            boolean: False at the end.
+
+        """
+        if self.rows and values and not self.values:
+            # the batch must be read again with the values
+            self.next_key, self.included, self.rows = self.rows[-1][0], True, []
+
+        if not self.rows and self.next_key is not None:
+            query = "SELECT key%s FROM records WHERE key %s ? ORDER BY key LIMIT %d" % \
+                    (", value" if values else "", ">=" if self.included else ">", CURSOR_BATCH)
+            rows = self.db.execute(query, (buffer(self.next_key),)) or []
+
+            self.rows = [(str(row[0]), str(row[1]) if values else None) for row in reversed(rows)]
+            self.values = values
+            self.next_key = self.rows[0][0] if len(rows) == CURSOR_BATCH else None
+            self.included = False
+
+        return bool(self.rows)
+
+def _prefix_end(prefix):
+    """ Returns the first key after the keys starting with a prefix.
+
+    Args:
+        prefix (str): The prefix.
+
+    Returns:
+        str: The key or None if there is no key after.
+
+    """
+    prefix = prefix.rstrip("\xff")
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+###########################################################################
+# Storage Example
+###########################################################################
+
+if __name__ == "__main__":
+    import sys, time
+    from multiprocessing import Process
+    from settings import WORK_DIR
+    import kyotocabinetutil as kc_util
+
+    filename = "%s/Example.sqlite" % WORK_DIR
+
+    ## a writer and readers in other processes
+    db = new_db("sqlite")
+    db.open(filename, OWRITER | OCREATE | OTRUNCATE)
+
+    def read_test(number):
+        reader = new_db("sqlite")
+        reader.open(filename, OREADER)
+        for _ in range(5):
+            print("reader %s: %s records" % (number, len(list(kc_util.gen_keys(reader.cursor())))))
+            time.sleep(0.1)
+        reader.close()
+
+    readers = [Process(target=read_test, args=(i,)) for i in range(3)]
+    for reader in readers:
+        reader.start()
+
+    for i in range(5):
+        kc_util.set_bulk(db, dict(("key%04d" % (i * 100 + j), "value") for j in range(100)))
+        time.sleep(0.1)
+
+    for reader in readers:
+        reader.join()
+    ##
+
+    db.close()
+    os.remove(filename)
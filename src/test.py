@@ -5,18 +5,31 @@
 #
 
 import unittest
-import os, glob, shutil
+import os, glob, shutil, time, threading, pickle
+import BaseHTTPServer, SocketServer
+from array import array
 
 import settings
-from collector import Collector, Feed, Item
-from classifier import CleanTextUtil, WordInfo, Vector, VectorItem, Classifier
+import codec
+import collector as col
+from collector import Collector, Feed, Item, LanguageGuesser
+from fetcher import Fetcher
+from extractor import ArticleExtractor
+from scheduler import Scheduler
+from retention import Retention
+from dedup import DuplicateIndex, simhash, distance
+from classifier import CleanTextUtil, WordInfo, Vector, LegacyVector, VectorItem, Classifier
+from knn import KNNEngine, PostingsIndex
 from manager import Manager
 import indexer as ind
 
+import storage
 import kyotocabinetutil as kc_util
+from htmlutil import html_to_text
 import feedparser
+import BeautifulSoup
 
-from settings import WORK_DIR
+from settings import WORK_DIR, DB_EXT
 def rm_data_dir():
     try:
         for f in glob.glob("%s/*" % WORK_DIR):
@@ -40,6 +53,7 @@ class TestCollector(unittest.TestCase):
         self.feed_info = Manager.get_feeds_info()
 
     def tearDown(self):
+        self.co.close()
         rm_data_dir()
 
     def test_add_feed(self):
@@ -62,6 +76,27 @@ class TestCollector(unittest.TestCase):
         feed = self.co.add_feed(name, url, tag)
         self.assertIsNone(feed) # 3
 
+    def test_add_feeds(self):
+        """ Tests add_feeds.
+
+        Add feeds with "add_feeds":
+         1- Test if the feeds has been added.
+         2- Test if the feeds exists in the database.
+
+        Try adding feeds already added: 
+         3- Test if the feeds has not been added.
+
+        """
+        feeds = [(name, url, tag) for name, url, tag, _ in self.feed_info]
+
+        added = self.co.add_feeds(feeds, concurrency=4)
+        for name, _, _ in feeds:
+            self.assertIsNotNone(added[name]) # 1
+            self.assertTrue(self.co.has_feed(name)) # 2
+
+        added = self.co.add_feeds(feeds, concurrency=4)
+        self.assertEquals(added, {}) # 3
+
     def test_update_feed(self):
         """ Tests update_feed.
 
@@ -80,6 +115,28 @@ class TestCollector(unittest.TestCase):
             updated = self.co.update_feed(name)
             self.assertFalse(updated) # 1
 
+    def test_update_feeds(self):
+        """ Tests update_feeds.
+
+        Add feeds.
+
+        Try updating feeds with "update_feeds":
+         1- Test if each feed has a result.
+         2- Test if the feeds don't need to be updated.
+         3- Test if an unknown feed is not updated.
+
+        """
+        names = []
+        for name, url, tag, _ in self.feed_info:
+            self.co.add_feed(name, url, tag)
+            names.append(name)
+
+        updated = self.co.update_feeds(names + ["unknown feed"], concurrency=4)
+        self.assertEquals(set(updated), set(names + ["unknown feed"])) # 1
+        for name in names:
+            self.assertFalse(updated[name]) # 2
+        self.assertFalse(updated["unknown feed"]) # 3
+
     def test_rm_feed(self):
         """ Tests rm_feed.
 
@@ -108,6 +165,9 @@ class TestCollector(unittest.TestCase):
          3- Test if the item updated has the tag attribute. 
          4- Test if the item updated has the correct category.
 
+        Update the category with the name of the feed.
+         5- Test if the event of the tag has the name of the feed.
+
         """
         category = "SPORT"
 
@@ -123,6 +183,394 @@ class TestCollector(unittest.TestCase):
         self.assertTrue(hasattr(item_updated, "tag")) # 3
         self.assertEquals(item_updated.tag, category) # 4
 
+        self.co.update_item_tag(feed.item_db_filename, item_id, category, name)
+        self.assertEquals([(e.action, e.name) for e in self.co.get_events(
+                          self.co.event_seq - 1)], [("tag", name)]) # 5
+
+    def test_migrate_items_db(self):
+        """ Tests migrate_items_db.
+
+        Add a feed with its own database file.
+
+        Migrate the items to the shared database:
+         1- Test if the feed has been migrated.
+         2- Test if the feed is linked to the shared database.
+         3- Test if the old database file has been removed.
+         4- Test if the items are the same.
+         5- Test if the feed is not migrated again.
+
+        """
+        name, url, tag = self.feed_info[0][:3]
+        feed = self.co.add_feed(name, url, tag)
+        items = [item_id for item_id, _ in self.co.get_items(name)]
+
+        self.assertEquals(self.co.migrate_items_db(), 1) # 1
+
+        feed_migrated = self.co.get_feed(name)
+        self.assertTrue(feed_migrated.item_db_filename.startswith(
+                settings.ITEMS_DB_FILENAME)) # 2
+        self.assertFalse(os.path.isfile(feed.item_db_filename)) # 3
+
+        items_migrated = [item_id for item_id, _ in self.co.get_items(name)]
+        self.assertEquals(items, items_migrated) # 4
+
+        self.assertEquals(self.co.migrate_items_db(), 0) # 5
+
+    def test_shared_items_db(self):
+        """ Tests the shared database of items.
+
+        Add two feeds in the shared database:
+         1- Test if the feeds are linked to the shared database.
+         2- Test if the items of a feed are not mixed with the other feed.
+
+        Update the tag of an item:
+         3- Test if the item has the tag.
+
+        Remove a feed:
+         4- Test if the items of the feed have been removed.
+         5- Test if the items of the other feed are still there.
+
+        """
+        col.SHARED_ITEMS_DB = True
+        try:
+            (name_1, url_1, tag_1), (name_2, url_2, tag_2) = \
+                    [info[:3] for info in self.feed_info[:2]]
+            feed_1 = self.co.add_feed(name_1, url_1, tag_1)
+            feed_2 = self.co.add_feed(name_2, url_2, tag_2)
+        finally:
+            col.SHARED_ITEMS_DB = False
+
+        self.assertTrue(feed_1.item_db_filename.startswith(
+                settings.ITEMS_DB_FILENAME)) # 1
+
+        items_1 = dict(self.co.get_items(name_1))
+        items_2 = dict(self.co.get_items(name_2))
+        for item_id, item in items_1.items():
+            self.assertEquals(item_id, str(item.id)) # 2
+            self.assertNotIn(item_id, items_2) # 2
+
+        item_id = items_1.keys()[0]
+        self.co.update_item_tag(feed_1.item_db_filename, item_id, "SPORT")
+        self.assertEquals(dict(self.co.get_items(name_1))[item_id].tag, "SPORT") # 3
+
+        self.co.rm_feed(name_1)
+        self.assertEquals(len(self.co.shared_items_db.match_prefix(
+                "%s/" % name_1)), 0) # 4
+        self.assertEquals(len(list(self.co.get_items(name_2))), len(items_2)) # 5
+
+    def test_close(self):
+        """ Tests close.
+
+        Add a feed and read its items twice:
+         1- Test if the database of items stays open.
+         2- Test if the database is reused.
+
+        Close the collector:
+         3- Test if all databases of items are closed.
+
+        """
+        name, url, tag = self.feed_info[0][:3]
+        feed = self.co.add_feed(name, url, tag)
+
+        list(self.co.get_items(name))
+        self.assertIn(feed.item_db_filename, self.co.items_dbs) # 1
+        items_db, _ = self.co.items_dbs[feed.item_db_filename]
+
+        list(self.co.get_items(name))
+        self.assertIs(self.co.items_dbs[feed.item_db_filename][0], items_db) # 2
+
+        self.co.close()
+        self.assertEquals(len(self.co.items_dbs), 0) # 3
+
+    def test_items_dbs_size(self):
+        """ Tests the maximum number of open databases of items.
+
+        Create a collector with only one open database of items.
+        Add feeds and read their items:
+         1- Test if only the last database is open.
+
+        """
+        self.co.close()
+        self.co = Collector(items_dbs_size=1)
+
+        for name, url, tag, _ in self.feed_info:
+            feed = self.co.add_feed(name, url, tag)
+            list(self.co.get_items(name))
+
+        self.assertEquals(self.co.items_dbs.keys(), [feed.item_db_filename]) # 1
+
+    def test_update_articles(self):
+        """ Tests update_articles.
+
+        Add a feed with an article extractor:
+         1- Test if the articles are in progress.
+
+        Store the articles:
+         2- Test if the articles have been stored.
+         3- Test if no more article is in progress.
+         4- Test if an item has the text of its article.
+         5- Test if the text is only read when asked.
+
+        """
+        self.co.close()
+        self.co = Collector(extractor=ArticleExtractor())
+
+        name, url, tag = self.feed_info[0][:3]
+        self.co.add_feed(name, url, tag)
+        self.assertGreater(len(self.co.extractor.pending), 0) # 1
+
+        updated = self.co.update_articles(wait=True)
+        self.assertGreater(updated, 0) # 2
+        self.assertEquals(len(self.co.extractor.pending), 0) # 3
+
+        texts = [item.webpage_text for _, item in self.co.get_items(name)]
+        self.assertTrue(any(texts)) # 4
+
+        texts = [item.webpage_text for _, item in self.co.get_items(name, ["title"])]
+        self.assertFalse(any(texts)) # 5
+
+    def test_seen_ids(self):
+        """ Tests the ids of the known items.
+
+        Add a feed:
+         1- Test if the ids of the items are known.
+
+        Update the feed without the state of the server:
+         2- Test if the known items have been skipped.
+         3- Test if the ids of the items are still known.
+
+        """
+        name, url, tag = self.feed_info[0][:3]
+        feed = self.co.add_feed(name, url, tag)
+        item_ids = sorted(int(item_id) for item_id, _ in self.co.get_items(name))
+        self.assertEquals(list(self.co.seen_ids[feed.item_db_filename]), item_ids) # 1
+
+        # download the whole feed again
+        feed.etag, feed.modified = None, None
+        self.co.feeds_db.replace(name, codec.dumps(feed))
+        self.co.update_feed(name)
+        self.assertGreater(self.co.lookups_avoided, 0) # 2
+
+        item_ids = sorted(int(item_id) for item_id, _ in self.co.get_items(name))
+        self.assertEquals(list(self.co.seen_ids[feed.item_db_filename]), item_ids) # 3
+
+    def test_duplicates(self):
+        """ Tests the near-duplicate items.
+
+        Add the same feed twice with two names:
+         1- Test if the items of the first feed are not duplicates.
+         2- Test if the items of the second feed are duplicates of the first feed.
+         3- Test if the duplicates have no text.
+
+        Remove the first feed:
+         4- Test if the items of the second feed are no more duplicates.
+
+        """
+        self.co.close()
+        self.co = Collector(dedup_index=DuplicateIndex())
+
+        name, url, tag = self.feed_info[0][:3]
+        self.co.add_feed(name, url, tag)
+        self.co.add_feed(name + "_copy", url, tag)
+
+        for _, item in self.co.get_items(name):
+            self.assertIsNone(item.duplicate_of) # 1
+
+        for _, item in self.co.get_items(name + "_copy"):
+            self.assertTrue(item.duplicate_of.startswith(name + "/")) # 2
+
+        self.assertEquals(list(self.co.get_text_from_items(name + "_copy")), []) # 3
+
+        self.co.rm_feed(name)
+        for _, item in self.co.get_items(name + "_copy"):
+            self.assertIsNone(item.duplicate_of) # 4
+
+    def test_get_events(self):
+        """ Tests get_events.
+
+        Add a feed:
+         1- Test if an "add" event is logged by item.
+         2- Test if the events are ordered by sequence number.
+         3- Test if only the events after a sequence number are returned.
+
+        Update the tag of an item, remove the feed:
+         4- Test if a "tag" event and a "rm_feed" event are logged.
+
+        """
+        name, url, tag = self.feed_info[0][:3]
+        feed = self.co.add_feed(name, url, tag)
+        item_id, _ = self.co.get_items(name).next()
+
+        events = list(self.co.get_events())
+        item_ids = sorted(int(i) for i, _ in self.co.get_items(name))
+        self.assertEquals(sorted(e.item_id for e in events if e.action == "add"),
+                          item_ids) # 1
+
+        seqs = [event.seq for event in events]
+        self.assertEquals(seqs, range(1, len(events) + 1)) # 2
+        self.assertEquals([e.seq for e in self.co.get_events(seqs[-2])],
+                          seqs[-1:]) # 3
+
+        after = self.co.event_seq
+        self.co.update_item_tag(feed.item_db_filename, item_id, "SPORT")
+        self.co.rm_feed(name)
+        self.assertEquals([(e.action, e.name) for e in self.co.get_events(after)],
+                          [("tag", name), ("rm_feed", name)]) # 4
+
+    def test_rm_events(self):
+        """ Tests rm_events.
+
+        Add a feed:
+         1- Test if the events are stored with the codec.
+
+        Remove the events until a sequence number:
+         2- Test if only the events after the sequence number are left.
+
+        Remove all events, restart the collector:
+         3- Test if the last event is kept.
+         4- Test if the sequence numbers go on.
+
+        """
+        name, url, tag = self.feed_info[0][:3]
+        self.co.add_feed(name, url, tag)
+        seq = self.co.event_seq
+        self.assertTrue(all(codec.is_record(record) for _, record in
+                            kc_util.gen_records(self.co.events_db.cursor()))) # 1
+
+        self.assertEquals(self.co.rm_events(seq - 2), seq - 2)
+        self.assertEquals([e.seq for e in self.co.get_events()], [seq - 1, seq]) # 2
+
+        self.co.rm_events(seq)
+        self.assertEquals([e.seq for e in self.co.get_events()], [seq]) # 3
+
+        self.co.close()
+        self.co = Collector()
+        self.co.rm_feed(name)
+        self.assertEquals([e.seq for e in self.co.get_events(seq)], [seq + 1]) # 4
+
+    def test_get_item(self):
+        """ Tests get_item.
+
+        Add a feed:
+         1- Test if an item is returned by its id.
+         2- Test if None is returned for an unknown item.
+
+        """
+        name, url, tag = self.feed_info[0][:3]
+        self.co.add_feed(name, url, tag)
+        item_id, item = self.co.get_items(name).next()
+
+        self.assertEquals(self.co.get_item(name, item_id).title, item.title) # 1
+        self.assertIsNone(self.co.get_item(name, 0)) # 2
+
+    def test_get_items_between(self):
+        """ Tests get_items_between and get_items_since.
+
+        Add feeds:
+         1- Test if all items are published since the oldest date.
+         2- Test if the items are sorted by publication date.
+         3- Test if only the items of the period are returned.
+         4- Test if only the items of the feeds chosen are returned.
+
+        Remove a feed:
+         5- Test if the items of the feed are not returned anymore.
+
+        """
+        names = []
+        for name, url, tag, _ in self.feed_info[:2]:
+            self.co.add_feed(name, url, tag)
+            names.append(name)
+
+        items = list(self.co.get_items_since(0))
+        self.assertEquals(len(items), sum(len(list(self.co.get_items(name)))
+                                          for name in names)) # 1
+
+        # the items without a date are indexed at the time of the collect
+        timestamps = [item.published_ts for _, _, item in items if item.published_ts]
+        self.assertEquals(timestamps, sorted(timestamps)) # 2
+
+        start, end = timestamps[len(timestamps) / 2], timestamps[-1]
+        for _, _, item in self.co.get_items_between(start, end):
+            self.assertTrue(start <= item.published_ts < end) # 3
+
+        for name, _, _ in self.co.get_items_since(0, feeds=names[:1]):
+            self.assertEquals(name, names[0]) # 4
+
+        self.co.rm_feed(names[0])
+        for name, _, _ in self.co.get_items_since(0):
+            self.assertEquals(name, names[1]) # 5
+
+    def test_rm_items(self):
+        """ Tests rm_items.
+
+        Add a feed, remove its oldest item:
+         1- Test if the item has been removed.
+         2- Test if the item is not in the index of dates anymore.
+         3- Test if a "rm" event is logged.
+
+        Update the feed:
+         4- Test if the item removed is not added again.
+
+        Restart the collector, download the whole feed again:
+         5- Test if the item removed is not added again.
+
+        """
+        name, url, tag = self.feed_info[0][:3]
+        self.co.add_feed(name, url, tag)
+        item_id, _ = self.co.get_item_dates(name)[0]
+
+        self.assertEquals(self.co.rm_items(name, [item_id]), 1)
+        self.assertIsNone(self.co.get_item(name, item_id)) # 1
+        self.assertNotIn(item_id, [i for i, _ in self.co.get_item_dates(name)]) # 2
+        self.assertEquals([(e.action, str(e.item_id)) for e in self.co.get_events(
+                                self.co.event_seq - 1)], [("rm", item_id)]) # 3
+
+        self.co.update_feed(name)
+        self.assertIsNone(self.co.get_item(name, item_id)) # 4
+
+        self.co.close()
+        self.co = Collector()
+        feed = self.co.get_feed(name)
+        feed.etag, feed.modified = None, None
+        self.co.feeds_db.replace(name, codec.dumps(feed))
+        self.co.update_feed(name)
+        self.assertIsNone(self.co.get_item(name, item_id)) # 5
+
+    def test_compact_items_dbs(self):
+        """ Tests compact_items_dbs.
+
+        Add a feed, remove half of its items:
+         1- Test if the database is rebuilt.
+         2- Test if the file is smaller.
+         3- Test if the items left are still there.
+
+        """
+        name, url, tag = self.feed_info[0][:3]
+        feed = self.co.add_feed(name, url, tag)
+        item_ids = [item_id for item_id, _ in self.co.get_item_dates(name)]
+        self.co.rm_items(name, item_ids[:len(item_ids) / 2])
+
+        size = os.path.getsize(feed.item_db_filename)
+        self.assertEquals(self.co.compact_items_dbs(0.1), 1) # 1
+        self.assertLess(os.path.getsize(feed.item_db_filename), size) # 2
+        self.assertEquals(sorted(item_id for item_id, _ in self.co.get_items(name)),
+                          sorted(item_ids[len(item_ids) / 2:])) # 3
+
+    def test_feed_language(self):
+        """ Tests the language declared for a feed.
+
+        Add a feed with its language:
+         1- Test if the feed has the language.
+         2- Test if the items have the language.
+
+        """
+        name, url, tag, language = self.feed_info[0]
+        feed = self.co.add_feed(name, url, tag, language)
+        self.assertEquals(self.co.get_feed(name).language, language) # 1
+
+        for _, item in self.co.get_items(name):
+            self.assertEquals(item.language, Item.language_code[language]) # 2
+
     def test_has_feed(self):
         """ Tests has_feed.
 
@@ -220,140 +668,1068 @@ class TestCollector(unittest.TestCase):
     def test_get_feeds(self):
         """ Tests get_feeds.
 
-        Add feeds.
+        Add feeds.
+
+        Get feeds and:
+         1- Comparing feed name from the data base with original feeds.
+         2- Comparing feed name from feeds with original feeds.
+         3- Verify if feeds name from the db are equals to feeds obj name attribute. 
+             (1, 2 is not enough for that because the order is not preserved)
+         4- Verify the names of get_feeds_name.
+
+        """
+        feeds_name = []
+        for name, url, tag, _ in self.feed_info:
+            self.co.add_feed(name, url, tag)
+            feeds_name.append(name)
+
+        feeds_name = set(feeds_name)
+        feeds_name_1 = set([name for name, _ in self.co.get_feeds()])
+        self.assertEquals(feeds_name, feeds_name_1) # 1
+
+        feeds_name_2 = set([feed.name for _, feed in self.co.get_feeds()])
+        self.assertEquals(feeds_name, feeds_name_2) # 2
+
+        for name, feed in self.co.get_feeds():
+            self.assertEquals(name, feed.name) # 3
+
+        self.assertEquals(feeds_name, set(self.co.get_feeds_name())) # 4
+
+    def test_get_items(self):
+        """ Tests get_items.
+        
+        Add a feed.
+
+        Get the first item:
+         1- Verify if the item is not None.
+
+        Get all items:
+         2- Verify if the id from the db are equals to the item id attribute.
+
+        """
+        name, url, tag, _ = self.feed_info[0]
+        feed = self.co.add_feed(name, url, tag)
+
+        item_id, item = self.co.get_items(name).next()
+        self.assertIsNotNone(item) # 1
+
+        for item_id, item in self.co.get_items(name):
+            self.assertEquals(item_id, str(item.id)) # 2
+
+    def test_get_items_fields(self):
+        """ Tests get_items and get_item with some fields.
+
+        Add a feed and store the text of an article.
+
+        Get the items without the text:
+         1- Verify if the items have an empty text.
+         2- Verify if the other fields are read.
+
+        Get the items with the text:
+         3- Verify if the item has the text of its article.
+         4- Verify if get_item reads the text only when asked.
+
+        """
+        name, url, tag, _ = self.feed_info[0]
+        feed = self.co.add_feed(name, url, tag)
+        item_id, item = self.co.get_items(name).next()
+        self.co.bodies_db.set("%s/%s" % (name, item_id), u"texte é".encode("utf-8"))
+
+        for _, header in self.co.get_items(name, Item.header_fields):
+            self.assertEquals(header.webpage_text, u"") # 1
+            self.assertTrue(header.title) # 2
+
+        items = dict(self.co.get_items(name, ["webpage_text"]))
+        self.assertEquals(items[item_id].webpage_text, u"texte é") # 3
+
+        self.assertEquals(self.co.get_item(name, item_id, ["title"]).webpage_text, u"") # 4
+        self.assertEquals(self.co.get_item(name, item_id).webpage_text, u"texte é") # 4
+
+
+class TestFeed(unittest.TestCase):
+    """ Tests the Feed class.
+
+    """
+    def setUp(self):
+        feed_info = Manager.get_feeds_info()
+        self.name, self.url, self.tag, _ = feed_info[0]
+
+    def tearDown(self):
+        rm_data_dir()
+
+    def test___init__(self):
+        """ Tests the constructor.
+
+        Create a new Feed instance.
+         1- Verify if there is an instance.
+
+        """
+        feed = Feed(self.name, "lemonde_sante_ZhxYv.kct", self.url, self.tag,
+                    etag="128732871823", 
+                    modified="2014-12-06 13:25:12,432")
+
+        self.assertIsNotNone(feed) # 1
+
+    def test___str__(self):
+        """ Tests the print method.
+
+        Create a new feed.
+        Print the feed.
+
+        """
+        feed = Feed(self.name, "lemonde_sante_ZhxYv.kct", self.url, self.tag,
+                    etag="128732871823", 
+                    modified="2014-12-06 13:25:12,432")
+
+        print(feed)
+
+
+class TestItem(unittest.TestCase):
+    """ Tests the Item class.
+
+    """
+    def setUp(self):
+        feed_info = Manager.get_feeds_info()
+        _, url, _, _ = feed_info[0]
+        feed_parsed = feedparser.parse(url)
+
+        self.item_entry = feed_parsed["entries"][0]
+
+    def tearDown(self):
+        rm_data_dir()
+
+    def test___init__(self):
+        """ Tests the constructor.
+
+        Create a new Item instance.
+         1- Verify if there is an instance.
+
+        """
+        item = Item(self.item_entry)
+        self.assertIsNotNone(item) # 1
+
+    def test___str__(self):
+        """ Tests the print method.
+
+        Create a new item.
+        Print the item.
+
+        """
+        item = Item(self.item_entry)
+        print (item)
+
+    def test_get_id(self):
+        """ Tests get_id.
+
+        Get id:
+         1- Verify in the id is an integer.
+         2- Compare two id for the same data.
+
+        """
+        item_data = {"title":"lemonde", 
+                "title_detail": {"base":"www.lemonde.fr"}}
+        item_id = Item.get_id(item_data)
+
+        self.assertIsInstance(item_id, int) # 1
+
+        item_id_ = Item.get_id(item_data)
+        self.assertEquals(item_id, item_id_) # 2
+
+    def test_get_timestamp(self):
+        """ Tests get_timestamp.
+
+        Get the timestamp of a publication date:
+         1- Verify the timestamp of a date in GMT.
+         2- Verify the timestamp of a date with a time zone.
+         3- Verify if None is returned for a wrong date.
+         4- Verify if the item has the timestamp of its date.
+
+        """
+        item_data = {"published": "Tue, 04 Nov 2014 02:19:30 GMT"}
+        self.assertEquals(Item.get_timestamp(item_data), 1415067570.0) # 1
+
+        item_data = {"published": "Tue, 04 Nov 2014 03:19:30 +0100"}
+        self.assertEquals(Item.get_timestamp(item_data), 1415067570.0) # 2
+
+        item_data = {"published": "yesterday"}
+        self.assertIsNone(Item.get_timestamp(item_data)) # 3
+
+        item = Item(self.item_entry)
+        self.assertEquals(item.published_ts, Item.get_timestamp(self.item_entry)) # 4
+
+    def test_html_to_text(self):
+        """ Tests html_to_text.
+
+        Get the text of html fragments:
+         1- Compare with the text of BeautifulSoup for well formed fragments.
+         2- Compare with the text of BeautifulSoup for fragments read by BeautifulSoup.
+         3- Compare with the text of BeautifulSoup for the abstract of the item.
+
+        """
+        fragments = [u"", u"<p>Hello <b>world</b></p>",
+                     u"<p class='a'>\n  caf\xe9 &amp; th\xe9 &#233;\n</p><br/>",
+                     u'<a href="http://www.lemonde.fr/?a=1&b=2">link</a> end']
+        for fragment in fragments:
+            self.assertEquals(html_to_text(fragment),
+                              BeautifulSoup.BeautifulSoup(fragment).text) # 1
+
+        fragments = [u"<!-- comment -->text", u"a < b", u"AT&T rocks",
+                     u"<script>var a = '<b>';</script>text", u"end &amp"]
+        for fragment in fragments:
+            self.assertEquals(html_to_text(fragment),
+                              BeautifulSoup.BeautifulSoup(fragment).text) # 2
+
+        summary = self.item_entry["summary"]
+        self.assertEquals(html_to_text(summary),
+                          BeautifulSoup.BeautifulSoup(summary).text) # 3
+
+
+class TestLanguageGuesser(unittest.TestCase):
+    """ Tests the LanguageGuesser class.
+
+    """
+    def setUp(self):
+        self.abstract_fr = u"Le gouvernement a annoncé mardi une série de " \
+                u"mesures pour les hôpitaux et les médecins de la région."
+        self.abstract_en = u"The government announced on Tuesday a series of " \
+                u"measures for the hospitals and the doctors of the region."
+
+    def test_guess(self):
+        """ Tests guess.
+
+        Guess with the language declared for the feed:
+         1- Test if the declared language is returned.
+         2- Test if only one item in "sample_rate" is detected.
+
+        Guess when the language of the title disagrees:
+         3- Test if each item is detected.
+         4- Test if the detected language is returned.
+
+        Guess without language:
+         5- Test if the language is detected.
+
+        """
+        guesser = LanguageGuesser("FR", sample_rate=4)
+        languages = [guesser.guess(self.abstract_fr + unicode(i)) for i in range(8)]
+        self.assertEquals(set(languages), set(["fr"])) # 1
+        self.assertEquals(guesser.detections, 2) # 2
+
+        guesser = LanguageGuesser("fr", sample_rate=4)
+        languages = [guesser.guess(self.abstract_en + unicode(i), "en-US") for i in range(3)]
+        self.assertEquals(guesser.detections, 3) # 3
+        self.assertEquals(languages, ["en"] * 3) # 4
+
+        guesser = LanguageGuesser()
+        self.assertEquals(guesser.guess(self.abstract_en), "en") # 5
+
+    def test_detected_language(self):
+        """ Tests the detection of the feed language.
+
+        Guess items without language:
+         1- Test if there is no feed language before "stable_votes" items.
+         2- Test if the feed language is detected after "stable_votes" items.
+         3- Test if the next items are not detected.
+
+        """
+        guesser = LanguageGuesser(stable_votes=3, sample_rate=10)
+        for i in range(2):
+            guesser.guess(self.abstract_fr + unicode(i))
+        self.assertIsNone(guesser.detected_language) # 1
+
+        guesser.guess(self.abstract_fr + u"2")
+        self.assertEquals(guesser.detected_language, "fr") # 2
+
+        detections = guesser.detections
+        guesser.guess(self.abstract_en)
+        self.assertEquals(guesser.detections, detections) # 3
+
+    def test_cache(self):
+        """ Tests the cache of short abstracts.
+
+        Guess the same abstract twice:
+         1- Test if the abstract is detected once.
+
+        Guess with another guesser sharing the cache:
+         2- Test if the abstract is not detected again.
+
+        """
+        guesser = LanguageGuesser()
+        guesser.guess(self.abstract_en)
+        guesser.guess(self.abstract_en)
+        self.assertEquals(guesser.detections, 1) # 1
+
+        guesser_ = LanguageGuesser(cache=guesser.cache)
+        guesser_.guess(self.abstract_en)
+        self.assertEquals(guesser_.detections, 0) # 2
+
+
+class TestFetcher(unittest.TestCase):
+    """ Tests the Fetcher class.
+
+    """
+    def setUp(self):
+        self.fetcher = Fetcher()
+        self.feed_info = Manager.get_feeds_info()
+
+    def tearDown(self):
+        self.fetcher.close()
+
+    def test_parse(self):
+        """ Tests parse.
+
+        Parse a feed:
+         1- Verify the status is ok.
+         2- Verify there are entries.
+         3- Verify the entries are the same as feedparser.parse.
+         4- Verify the ids of the items are the same as feedparser.parse.
+
+        """
+        _, url, _, _ = self.feed_info[0]
+
+        feed_parsed = self.fetcher.parse(url)
+        self.assertIn(feed_parsed.status, Collector.feed_status_ok) # 1
+        self.assertGreater(len(feed_parsed.entries), 0) # 2
+
+        entries = feedparser.parse(url).entries
+        self.assertEquals([entry.title for entry in feed_parsed.entries],
+                          [entry.title for entry in entries]) # 3
+        self.assertEquals([Item.get_id(entry) for entry in feed_parsed.entries],
+                          [Item.get_id(entry) for entry in entries]) # 4
+
+    def test_fetch(self):
+        """ Tests fetch.
+
+        Fetch a feed twice:
+         1- Verify the body is not empty.
+         2- Verify a connection is kept alive in the pool.
+         3- Verify the second body is the same.
+
+        """
+        _, url, _, _ = self.feed_info[0]
+
+        _, _, headers, body = self.fetcher.fetch(url)
+        self.assertGreater(len(body), 0) # 1
+        if headers.get("connection", "").lower() != "close":
+            self.assertGreater(len(self.fetcher.pools), 0) # 2
+
+        _, _, _, body_2 = self.fetcher.fetch(url)
+        self.assertEquals(len(body), len(body_2)) # 3
+
+    def test_close(self):
+        """ Tests close.
+
+        Fetch a feed.
+        Close the fetcher:
+         1- Verify there is no more idle connection.
+
+        """
+        _, url, _, _ = self.feed_info[0]
+        self.fetcher.fetch(url)
+        self.fetcher.close()
+
+        self.assertEquals(self.fetcher.pools, {}) # 1
+
+
+class TestArticleExtractor(unittest.TestCase):
+    """ Tests the ArticleExtractor class.
+
+    """
+    def setUp(self):
+        _, url, _, _ = Manager.get_feeds_info()[0]
+        self.urls = [entry.link for entry in feedparser.parse(url).entries[:3]]
+        self.extractor = ArticleExtractor(processes=2)
+
+    def tearDown(self):
+        self.extractor.close()
+        rm_data_dir()
+
+    def test_submit(self):
+        """ Tests submit.
+
+        Submit articles:
+         1- Verify the articles are in progress.
+
+        """
+        for url in self.urls:
+            self.extractor.submit(url, url)
+
+        self.assertEquals(set(self.extractor.pending), set(self.urls)) # 1
+
+    def test_results(self):
+        """ Tests results.
+
+        Submit articles and wait for the results:
+         1- Verify the keys are the submitted keys.
+         2- Verify a text has been extracted.
+         3- Verify no more article is in progress.
+
+        """
+        for url in self.urls:
+            self.extractor.submit(url, url)
+
+        results = dict(self.extractor.results(wait=True))
+        self.assertTrue(set(results) <= set(self.urls)) # 1
+        self.assertTrue(any(results.values())) # 2
+        self.assertEquals(self.extractor.pending, {}) # 3
+
+    def test_cache(self):
+        """ Tests the cache of articles.
+
+        Extract an article twice:
+         1- Verify the first article is not from the cache.
+         2- Verify the second article is from the cache.
+         3- Verify the texts are the same.
+
+        """
+        url = self.urls[0]
+
+        self.extractor.submit(url, url)
+        text = dict(self.extractor.results(wait=True)).get(url)
+        self.assertEquals(self.extractor.hits, 0) # 1
+
+        self.extractor.submit(url, url)
+        text_cached = dict(self.extractor.results(wait=True)).get(url)
+        self.assertEquals(self.extractor.hits, 1) # 2
+        self.assertEquals(text, text_cached) # 3
+
+    def test_close(self):
+        """ Tests close.
+
+        Submit an article and close the extractor:
+         1- Verify the workers are stopped.
+         2- Verify no more article is in progress.
+
+        Start a new extractor:
+         3- Verify the article is submitted again.
+         4- Verify the article is not submitted again once returned.
+
+        """
+        self.extractor.submit(self.urls[0], self.urls[0])
+        self.extractor.close()
+
+        self.assertIsNone(self.extractor.pool) # 1
+        self.assertEquals(self.extractor.pending, {}) # 2
+
+        self.extractor = ArticleExtractor(processes=1)
+        self.assertEquals(self.extractor.pending.keys(), [self.urls[0]]) # 3
+
+        list(self.extractor.results(wait=True))
+        self.extractor.close()
+        self.extractor = ArticleExtractor(processes=1)
+        self.assertEquals(self.extractor.pending, {}) # 4
+
+    def test_deadline(self):
+        """ Tests the deadline of the articles.
+
+        Cache articles and serve "304 Not Modified" after a delay,
+        submit more articles than workers:
+         1- Verify the articles waiting for a worker are not dropped.
+
+        Serve after the deadline:
+         2- Verify the cached texts are returned.
+
+        """
+        delay = [0.4]
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(delay[0])
+                self.send_response(304)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever).start()
+
+        extractor = ArticleExtractor(processes=1, timeout=1)
+        urls = [u"http://127.0.0.1:%s/%s" % (server.server_address[1], i) for i in range(4)]
+        for url in urls:
+            extractor._ArticleExtractor__set_cache(url, u"text", "etag", None)
+
+        try:
+            for url in urls:
+                extractor.submit(url, url)
+            self.assertEquals(dict(extractor.results(wait=True)),
+                              dict((url, u"text") for url in urls)) # 1
+
+            delay[0] = 3
+            extractor.submit(urls[0], urls[0])
+            self.assertEquals(list(extractor.results(wait=True)), [(urls[0], u"text")]) # 2
+        finally:
+            server.shutdown()
+            extractor.close()
+
+
+class TestScheduler(unittest.TestCase):
+    """ Tests the Scheduler class.
+
+    """
+    def setUp(self):
+        self.co = Collector()
+        self.names = []
+        for name, url, tag, language in Manager.get_feeds_info()[:2]:
+            self.co.add_feed(name, url, tag, language)
+            self.names.append(name)
+
+        self.scheduler = Scheduler(self.co)
+
+    def tearDown(self):
+        self.scheduler.close()
+        self.co.close()
+        rm_data_dir()
+
+    def test_poll(self):
+        """ Tests poll.
+
+        Poll after the first interval of all feeds:
+         1- Verify all feeds have been updated.
+         2- Verify the next updates are in the future.
+         3- Verify the intervals are between the limits.
+
+        Poll again at the same time:
+         4- Verify no feed is updated.
+
+        """
+        now = time.time() + settings.SCHEDULER_MAX_INTERVAL
+        updated = self.scheduler.poll(now)
+        self.assertEquals(set(updated), set(self.names)) # 1
+
+        for name in self.names:
+            schedule = self.scheduler.get_schedule(name)
+            self.assertGreater(schedule.next_time, now) # 2
+            self.assertTrue(settings.SCHEDULER_MIN_INTERVAL <= schedule.interval
+                            <= settings.SCHEDULER_MAX_INTERVAL) # 3
+
+        self.assertEquals(self.scheduler.poll(now), {}) # 4
+
+    def test_run(self):
+        """ Tests run.
+
+        Run the scheduler and stop it from another thread:
+         1- Verify the scheduler has stopped.
+         2- Verify the feeds are scheduled.
+
+        """
+        threading.Timer(1, self.scheduler.stop).start()
+        self.scheduler.run()
+        self.assertTrue(self.scheduler.stopped.is_set()) # 1
+
+        for name in self.names:
+            self.assertIsNotNone(self.scheduler.get_schedule(name)) # 2
+
+    def test_get_schedule(self):
+        """ Tests get_schedule.
+
+        Poll and remove a feed:
+         1- Verify the schedule of the other feed.
+         2- Verify the schedule of the feed removed has been dropped.
+
+        """
+        self.scheduler.poll()
+        self.co.rm_feed(self.names[0])
+        self.scheduler.poll()
+
+        self.assertEquals(self.scheduler.get_schedule(self.names[1]).name,
+                          self.names[1]) # 1
+        self.assertIsNone(self.scheduler.get_schedule(self.names[0])) # 2
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    """ Tests the DuplicateIndex class.
+
+    """
+    def setUp(self):
+        self.index = DuplicateIndex()
+        self.text = u"Un séisme de magnitude 7,8 frappe le Népal, des centaines " \
+                u"de morts selon les autorités locales qui craignent un bilan plus lourd"
+        self.text_copy = u"Un séisme de magnitude 7,8 frappe le Népal : des centaines " \
+                u"de morts selon les autorités locales, qui craignent un bilan bien plus lourd"
+        self.text_other = u"Le Real Madrid remporte la finale de la ligue des champions " \
+                u"face à l'Atlético de Madrid après les tirs au but"
+
+    def tearDown(self):
+        self.index.close()
+        rm_data_dir()
+
+    def test_simhash(self):
+        """ Tests simhash.
+
+         1- Verify the fingerprints of near-duplicates are close.
+         2- Verify the fingerprints of different texts are far.
+         3- Verify a text without word has no fingerprint.
+
+        """
+        fingerprint = simhash(self.text)
+        self.assertLessEqual(distance(fingerprint, simhash(self.text_copy)), 
+                             self.index.max_distance) # 1
+        self.assertGreater(distance(fingerprint, simhash(self.text_other)),
+                           self.index.max_distance) # 2
+        self.assertIsNone(simhash(u" ... ")) # 3
+
+    def test_find(self):
+        """ Tests find.
+
+        Add the fingerprint of a text:
+         1- Verify the near-duplicate is found.
+         2- Verify a different text is not found.
+         3- Verify an excluded item is not found.
+         4- Verify the items of an excluded feed are not found.
+
+        """
+        self.index.add("feed/1", simhash(self.text))
+
+        self.assertEquals(self.index.find(simhash(self.text_copy)), "feed/1") # 1
+        self.assertIsNone(self.index.find(simhash(self.text_other))) # 2
+        self.assertIsNone(self.index.find(simhash(self.text), exclude="feed/1")) # 3
+        self.assertIsNone(self.index.find(simhash(self.text_copy), feed="feed")) # 4
+
+    def test_rm_feed(self):
+        """ Tests rm_feed.
+
+        Add the fingerprints of two feeds and remove the first feed:
+         1- Verify the items of the first feed are not found.
+         2- Verify the items of the second feed are found.
+
+        """
+        self.index.add("feed_1/1", simhash(self.text))
+        self.index.add("feed_2/1", simhash(self.text_other))
+        self.index.rm_feed("feed_1")
+
+        self.assertIsNone(self.index.find(simhash(self.text))) # 1
+        self.assertEquals(self.index.find(simhash(self.text_other)), "feed_2/1") # 2
+
+    def test_rm(self):
+        """ Tests rm.
+
+        Add the fingerprints of two items and remove the first item:
+         1- Verify the first item is not found.
+         2- Verify the second item is found.
+
+        """
+        self.index.add("feed/1", simhash(self.text))
+        self.index.add("feed/2", simhash(self.text_other))
+        self.index.rm(["feed/1"])
+
+        self.assertIsNone(self.index.find(simhash(self.text))) # 1
+        self.assertEquals(self.index.find(simhash(self.text_other)), "feed/2") # 2
+
+    def test_rm_original(self):
+        """ Tests rm of an item with duplicates.
+
+        Add an item and two duplicates, remove the item:
+         1- Verify the first duplicate is the new original of the other.
+         2- Verify the new original replaces the item when it is removed.
+
+        """
+        self.index.add("feed_1/1", simhash(self.text))
+        self.index.add("feed_2/1", simhash(self.text_copy), "feed_1/1")
+        self.index.add("feed_3/1", simhash(self.text_copy), "feed_1/1")
+
+        self.assertEquals(self.index.rm(["feed_1/1"]),
+                          {"feed_2/1": None, "feed_3/1": "feed_2/1"}) # 1
+        self.assertEquals(self.index.rm_feed("feed_2"), {"feed_3/1": None}) # 2
+
+
+class TestRetention(unittest.TestCase):
+    """ Tests the Retention class.
+
+    """
+    def setUp(self):
+        self.co = Collector()
+        self.names = []
+        for name, url, tag, language in Manager.get_feeds_info()[:2]:
+            self.co.add_feed(name, url, tag, language)
+            self.names.append(name)
+
+    def tearDown(self):
+        self.co.close()
+        rm_data_dir()
+
+    def test_expire(self):
+        """ Tests expire.
+
+        Expire the items of a feed with a maximum number of items:
+         1- Verify the number of items left.
+         2- Verify the most recent items are kept.
+
+        Expire the items with a maximum age:
+         3- Verify the items left are recent enough.
+
+        """
+        name = self.names[0]
+        dates = self.co.get_item_dates(name)
+
+        retention = Retention(self.co, max_age=None, max_items=2)
+        retention.expire(name)
+        self.assertEquals(len(list(self.co.get_items(name))), 2) # 1
+        self.assertEquals([t for _, t in self.co.get_item_dates(name)],
+                          [t for _, t in dates[-2:]]) # 2
+
+        now = dates[-1][1] + 1
+        retention = Retention(self.co, max_age=1, max_items=None)
+        retention.expire(name, now)
+        for _, timestamp in self.co.get_item_dates(name):
+            self.assertGreaterEqual(timestamp, now - 1) # 3
+
+    def test_poll(self):
+        """ Tests poll.
+
+        Poll with a policy for the first feed only:
+         1- Verify the items of the first feed are removed.
+         2- Verify the items of the second feed are kept.
+         3- Verify the number of items removed.
+
+        """
+        counts = [len(self.co.get_item_dates(name)) for name in self.names]
+        retention = Retention(self.co, max_age=None, max_items=None,
+                              policies={self.names[0]: (None, 1)})
+        removed = retention.poll()
+
+        self.assertEquals(len(self.co.get_item_dates(self.names[0])), 1) # 1
+        self.assertEquals(len(self.co.get_item_dates(self.names[1])), counts[1]) # 2
+        self.assertEquals(removed, {self.names[0]: counts[0] - 1, self.names[1]: 0}) # 3
+
+    def test_start(self):
+        """ Tests start.
+
+        Start the background job and close it:
+         1- Verify the job has stopped.
+         2- Verify the items have been removed.
+
+        """
+        retention = Retention(self.co, max_age=None, max_items=1)
+        thread = retention.start()
+        for _ in range(50):
+            if retention.removed:
+                break
+            time.sleep(0.1)
+        retention.close()
+        self.assertFalse(thread.is_alive()) # 1
+
+        for name in self.names:
+            self.assertLessEqual(len(self.co.get_item_dates(name)), 1) # 2
+
+
+class TestCodec(unittest.TestCase):
+    """ Tests the codec of the records.
+
+    """
+    def setUp(self):
+        feed_parsed = feedparser.parse(Manager.get_feeds_info()[0][1])
+        self.item = Item(feed_parsed["entries"][0])
+        self.vector = Vector(array("i", [3, 7]), array("d", [0.5, 1.]),
+                             array("d", [0.25, 0.]), "SCIENCE")
+
+    def tearDown(self):
+        rm_data_dir()
+
+    def test_dumps_loads(self):
+        """ Tests dumps and loads.
+
+        Store an item and a vector:
+         1- Verify the records are not pickles.
+         2- Verify the fields of the item are read.
+         3- Verify the tag of the item is still unset.
+         4- Verify the items of the vector are read.
+
+        """
+        record = codec.dumps(self.item)
+        self.assertTrue(codec.is_record(record)) # 1
+
+        item = codec.loads(record)
+        for field in Item.__slots__:
+            self.assertEquals(getattr(item, field, None),
+                              getattr(self.item, field, None)) # 2
+        self.assertFalse(hasattr(item, "tag")) # 3
+
+        vector = codec.loads(codec.dumps(self.vector))
+        self.assertEquals((vector.indexes, vector.tfs, vector.weights),
+                          (self.vector.indexes, self.vector.tfs, self.vector.weights)) # 4
+
+    def test_loads_pickle(self):
+        """ Tests loads with an old pickle.
+
+        Read the pickle of an old-style word info:
+         1- Verify the object has the class of today.
+         2- Verify the fields are read.
+         3- Verify the record is smaller than the pickle.
+
+        """
+        old = codec.PLACEHOLDERS["WordInfo"]()
+        old.word, old.index, old.number, old.idf = u"googl", 3, 2, 0.5
+        data = pickle.dumps(old)
+
+        word_info = codec.loads(data)
+        self.assertIsInstance(word_info, WordInfo) # 1
+        self.assertEquals((word_info.word, word_info.index, word_info.number, word_info.idf),
+                          (u"googl", 3, 2, 0.5)) # 2
+        self.assertLess(len(codec.dumps(word_info)), len(data)) # 3
+
+    def test_pack_text(self):
+        """ Tests pack_text and unpack_text.
 
-        Get feeds and:
-         1- Comparing feed name from the data base with original feeds.
-         2- Comparing feed name from feeds with original feeds.
-         3- Verify if feeds name from the db are equals to feeds obj name attribute. 
-             (1, 2 is not enough for that because the order is not preserved)
+        Pack a short text and a large text:
+         1- Verify the short text is not compressed.
+         2- Verify the large text is compressed.
+         3- Verify the texts are unpacked.
 
         """
-        feeds_name = []
-        for name, url, tag, _ in self.feed_info:
-            self.co.add_feed(name, url, tag)
-            feeds_name.append(name)
+        short, large = u"été", u"le vieillissement de l'ADN " * 50
 
-        feeds_name = set(feeds_name)
-        feeds_name_1 = set([name for name, _ in self.co.get_feeds()])
-        self.assertEquals(feeds_name, feeds_name_1) # 1
+        self.assertEquals(codec.pack_text(short), short.encode("utf-8")) # 1
+        self.assertLess(len(codec.pack_text(large)), len(large) / 4) # 2
 
-        feeds_name_2 = set([feed.name for _, feed in self.co.get_feeds()])
-        self.assertEquals(feeds_name, feeds_name_2) # 2
+        self.assertEquals(codec.unpack_text(codec.pack_text(short)), short) # 3
+        self.assertEquals(codec.unpack_text(codec.pack_text(large)), large) # 3
 
-        for name, feed in self.co.get_feeds():
-            self.assertEquals(name, feed.name) # 3
+    def test_loads_fields(self):
+        """ Tests loads with fields.
 
-    def test_get_items(self):
-        """ Tests get_items.
-        
-        Add a feed.
+        Store an item with a large abstract:
+         1- Verify the abstract is compressed in the record.
+         2- Verify the abstract is read.
+         3- Verify the fields asked are read.
+         4- Verify the fields not asked have their default value or are unset.
 
-        Get the first item:
-         1- Verify if the item is not None.
+        """
+        self.item.abstract = u"le vieillissement de l'ADN " * 50
+        self.item.webpage_text = u"text"
+        record = codec.dumps(self.item)
+        self.assertLess(len(record), len(self.item.abstract)) # 1
 
-        Get all items:
-         2- Verify if the id from the db are equals to the item id attribute.
+        self.assertEquals(codec.loads(record).abstract, self.item.abstract) # 2
+
+        item = codec.loads(record, ["id", "title"])
+        self.assertEquals((item.id, item.title), (self.item.id, self.item.title)) # 3
+        self.assertEquals(item.webpage_text, u"") # 4
+        self.assertFalse(hasattr(item, "abstract")) # 4
+
+    def test_convert_db(self):
+        """ Tests kyotocabinetutil.convert_db.
+
+        Store an old pickle and a text, convert the database:
+         1- Verify only the pickle is converted.
+         2- Verify the converted record is read.
+         3- Verify the text is unchanged.
 
         """
-        name, url, tag, _ = self.feed_info[0]
-        feed = self.co.add_feed(name, url, tag)
+        old = codec.PLACEHOLDERS["VectorItem"]()
+        old.word, old.tf = u"googl", 0.5
 
-        item_id, item = self.co.get_items(name).next()
-        self.assertIsNotNone(item) # 1
+        db = storage.new_db()
+        db.open("%s/Convert%s" % (WORK_DIR, DB_EXT), storage.OWRITER | storage.OCREATE)
+        db.set("pickle", pickle.dumps(old))
+        db.set("text", "some text")
 
-        for item_id, item in self.co.get_items(name):
-            self.assertEquals(item_id, str(item.id)) # 2
+        self.assertEquals(kc_util.convert_db(db), 1) # 1
+        self.assertEquals(codec.loads(db.get("pickle")).word, u"googl") # 2
+        self.assertEquals(db.get("text"), "some text") # 3
+        db.close()
 
 
-class TestFeed(unittest.TestCase):
-    """ Tests the Feed class.
+class TestKyotoCabinetUtil(unittest.TestCase):
+    """ Tests the kyotocabinetutil module.
 
     """
     def setUp(self):
-        feed_info = Manager.get_feeds_info()
-        self.name, self.url, self.tag, _ = feed_info[0]
+        self.db = storage.new_db()
+        self.db.open("%s/Util%s" % (WORK_DIR, DB_EXT), storage.OWRITER | storage.OCREATE)
+        self.db.set_bulk(dict(("a/%s" % i, codec.dumps(WordInfo(u"w%s" % i, i)))
+                              for i in range(5)))
+        self.db.set("b/0", codec.dumps(WordInfo(u"other", 9)))
 
     def tearDown(self):
+        self.db.close()
         rm_data_dir()
 
-    def test___init__(self):
-        """ Tests the constructor.
+    def test_gen_keys(self):
+        """ Tests gen_keys.
 
-        Create a new Feed instance.
-         1- Verify if there is an instance.
+        Store 5 records with the prefix "a/" and 1 with "b/":
+         1- Verify all keys are read without prefix.
+         2- Verify only the keys of the prefix are read.
+         3- Verify the keys of a range are read.
 
         """
-        feed = Feed(self.name, "lemonde_sante_ZhxYv.kct", self.url, self.tag,
-                    etag="128732871823", 
-                    modified="2014-12-06 13:25:12,432")
+        keys = list(kc_util.gen_keys(self.db.cursor()))
+        self.assertEquals(len(keys), 6) # 1
 
-        self.assertIsNotNone(feed) # 1
+        keys = list(kc_util.gen_keys(self.db.cursor(), "a/"))
+        self.assertEquals(keys, ["0", "1", "2", "3", "4"]) # 2
 
-    def test___str__(self):
-        """ Tests the print method.
+        keys = list(kc_util.gen_keys(self.db.cursor(), "a/", "1", "3"))
+        self.assertEquals(keys, ["1", "2"]) # 3
 
-        Create a new feed.
-        Print the feed.
+    def test_gen_db(self):
+        """ Tests gen_db.
+
+        Store 5 records with the prefix "a/" and 1 with "b/":
+         1- Verify the objects of a prefix are decoded.
+         2- Verify the objects of a range are decoded.
+         3- Verify a lazy value is not decoded before it is used.
+         4- Verify a lazy value is decoded.
 
         """
-        feed = Feed(self.name, "lemonde_sante_ZhxYv.kct", self.url, self.tag,
-                    etag="128732871823", 
-                    modified="2014-12-06 13:25:12,432")
+        words = [word_info.word for _, word_info in kc_util.gen_db(self.db.cursor(), "a/")]
+        self.assertEquals(words, [u"w0", u"w1", u"w2", u"w3", u"w4"]) # 1
 
-        print(feed)
+        words = [word_info.word for _, word_info
+                 in kc_util.gen_db(self.db.cursor(), "a/", start="3")]
+        self.assertEquals(words, [u"w3", u"w4"]) # 2
 
+        key, lazy = kc_util.gen_db(self.db.cursor(), "b/", lazy=True).next()
+        self.assertFalse(hasattr(lazy, "_value")) # 3
+        self.assertEquals((key, lazy.value.word), ("0", u"other")) # 4
 
-class TestItem(unittest.TestCase):
-    """ Tests the Item class.
+    def test_get_bulk(self):
+        """ Tests get_bulk.
+
+        Store 5 records with the prefix "a/" and 1 with "b/":
+         1- Verify the objects of the keys are read.
+         2- Verify the missing keys are skipped.
+
+        """
+        word_infos = kc_util.get_bulk(self.db, ["1", "4", "9"], "a/")
+        self.assertEquals(sorted(word_infos), ["1", "4"]) # 1, 2
+        self.assertEquals(word_infos["4"].word, u"w4") # 1
+
+
+class TestStorage(unittest.TestCase):
+    """ Tests the SQLite backend of the storage.
 
     """
     def setUp(self):
-        feed_info = Manager.get_feeds_info()
-        _, url, _, _ = feed_info[0]
-        feed_parsed = feedparser.parse(url)
-
-        self.item_entry = feed_parsed["entries"][0]
+        self.filename = "%s/Storage.sqlite" % WORK_DIR
+        self.db = storage.new_db("sqlite")
+        self.db.open(self.filename, storage.OWRITER | storage.OCREATE)
 
     def tearDown(self):
+        self.db.close()
         rm_data_dir()
 
-    def test___init__(self):
-        """ Tests the constructor.
+    def test_records(self):
+        """ Tests the methods on a record.
 
-        Create a new Item instance.
-         1- Verify if there is an instance.
+        Set, add and replace records:
+         1- Verify the value is read.
+         2- Verify a key can't be added twice.
+         3- Verify a missing key can't be replaced.
+         4- Verify the unicode keys and the numbers are stored as strings.
+         5- Verify a removed key is missing.
 
         """
-        item = Item(self.item_entry)
-        self.assertIsNotNone(item) # 1
+        self.assertTrue(self.db.set("a", "\x00value"))
+        self.assertEquals(self.db.get("a"), "\x00value") # 1
 
-    def test___str__(self):
-        """ Tests the print method.
+        self.assertFalse(self.db.add("a", "other")) # 2
+        self.assertFalse(self.db.replace("b", "other")) # 3
 
-        Create a new item.
-        Print the item.
+        self.db.set(u"clé", 0.5)
+        self.assertEquals(self.db.get(u"clé".encode("utf-8")), "0.5") # 4
+
+        self.assertTrue(self.db.remove("a"))
+        self.assertEquals(self.db.get("a"), None) # 5
+        self.assertEquals(len(self.db), 1) # 5
+
+    def test_bulk(self):
+        """ Tests the bulk methods and match_prefix.
+
+        Store 3 records with the prefix "a/" and 1 with "b/":
+         1- Verify the number of records stored.
+         2- Verify the keys of the prefix are sorted.
+         3- Verify the missing keys are not read.
+         4- Verify the number of records removed.
 
         """
-        item = Item(self.item_entry)
-        print (item)
+        records = {"a/2": "2", "a/1": "1", "a/3": "3", "b/1": "4"}
+        self.assertEquals(self.db.set_bulk(records), 4) # 1
 
-    def test_get_id(self):
-        """ Tests get_id.
+        self.assertEquals(self.db.match_prefix("a/"), ["a/1", "a/2", "a/3"]) # 2
+        self.assertEquals(self.db.get_bulk(["a/1", "c"]), {"a/1": "1"}) # 3
+        self.assertEquals(self.db.remove_bulk(["a/1", "a/2", "c"]), 2) # 4
 
-        Get id:
-         1- Verify in the id is an integer.
-         2- Compare two id for the same data.
+    def test_cursor(self):
+        """ Tests the cursor.
+
+        Store more records than a batch of the cursor:
+         1- Verify all keys are read in order.
+         2- Verify the keys of a range are read.
+         3- Verify the values are read after the keys.
+         4- Verify jump_back moves to the last record.
 
         """
-        item_data = {"title":"lemonde", 
-                "title_detail": {"base":"www.lemonde.fr"}}
-        item_id = Item.get_id(item_data)
+        keys = ["%04d" % i for i in range(storage.CURSOR_BATCH + 10)]
+        self.db.set_bulk(dict((key, "v%s" % key) for key in keys))
 
-        self.assertIsInstance(item_id, int) # 1
+        self.assertEquals(list(kc_util.gen_keys(self.db.cursor())), keys) # 1
+        self.assertEquals(list(kc_util.gen_keys(self.db.cursor(), "", "0010", "0013")),
+                          ["0010", "0011", "0012"]) # 2
 
-        item_id_ = Item.get_id(item_data)
-        self.assertEquals(item_id, item_id_) # 2
+        cursor = self.db.cursor()
+        cursor.jump("0100")
+        self.assertEquals(cursor.get_key(True), "0100")
+        self.assertEquals(cursor.get(True), ("0101", "v0101")) # 3
+
+        self.assertTrue(cursor.jump_back())
+        self.assertEquals(cursor.get_key(), keys[-1]) # 4
+
+    def test_transaction(self):
+        """ Tests the transactions and a reader of another connection.
+
+        Begin a transaction and store a record:
+         1- Verify the reader doesn't see the record before the commit.
+         2- Verify the reader sees the record after the commit.
+         3- Verify an aborted transaction stores nothing.
+
+        """
+        reader = storage.new_db("sqlite")
+        reader.open(self.filename, storage.OREADER)
+
+        self.assertTrue(self.db.begin_transaction())
+        self.db.set("a", "1")
+        self.assertEquals(reader.get("a"), None) # 1
+        self.assertTrue(self.db.end_transaction(True))
+        self.assertEquals(reader.get("a"), "1") # 2
+
+        self.db.begin_transaction()
+        self.db.set("b", "2")
+        self.db.end_transaction(False)
+        self.assertEquals(self.db.get("b"), None) # 3
+
+        reader.close()
+
+    def test_vacuum(self):
+        """ Tests vacuum and a reader of another connection.
+
+        Store records, open a reader and remove most records:
+         1- Verify the database is smaller after vacuum.
+         2- Verify vacuum fails during a transaction.
+         3- Verify the reader sees the records written after vacuum.
+
+        """
+        self.db.set_bulk(dict(("%04d" % i, "v" * 1000) for i in range(500)))
+        reader = storage.new_db("sqlite")
+        reader.open(self.filename, storage.OREADER)
+        self.db.remove_bulk(["%04d" % i for i in range(490)])
+
+        size = self.db.size()
+        self.assertTrue(self.db.vacuum())
+        self.assertTrue(self.db.size() < size) # 1
+
+        self.db.begin_transaction()
+        self.assertFalse(self.db.vacuum()) # 2
+        self.db.end_transaction(False)
+
+        self.db.set("a", "1")
+        self.assertEquals(reader.get("a"), "1") # 3
+        self.assertEquals(len(reader), 11) # 3
+
+        reader.close()
 
 
 ###########################################################################
@@ -450,7 +1826,7 @@ class TestVector(unittest.TestCase):
          1- Verify if there is an instance.
 
         """
-        v = Vector([], "BUSINESS")
+        v = Vector(array("i"), array("d"), array("d"), "BUSINESS")
         self.assertIsNotNone(v) # 1
 
 class TestVectorItem(unittest.TestCase):
@@ -497,6 +1873,7 @@ class TestClassifier(unittest.TestCase):
         self.c = Classifier(CleanTextUtil("french"))
 
     def tearDown(self):
+        self.c.close()
         rm_data_dir()
 
     def test_add_text(self):
@@ -526,6 +1903,89 @@ class TestClassifier(unittest.TestCase):
         words = [word for word, _ in kc_util.gen_db(self.c.dictionary_db.cursor())]
         self.assertEquals(words, flux1_text_wanted) # 2
 
+    def test_add_texts(self):
+        """ Tests add_texts.
+
+        Add three texts at once, then one more:
+         1- Verify the number of texts.
+         2- Verify the number of documents of each word.
+         3- Verify each word has its own index.
+         4- Verify the words already in the dictionary keep their index.
+
+        """
+        self.assertEquals(self.c.add_texts([u"google pages", u"pages internet",
+                                            u"google pages tactiles"]), 3)
+        indexes = dict((word, word_info.index) for word, word_info
+                       in kc_util.gen_db(self.c.dictionary_db.cursor()))
+
+        self.c.add_text(u"pages souris")
+        self.assertEquals(int(self.c.classifier_state_db.get("text_nb")), 4) # 1
+
+        word_infos = dict(kc_util.gen_db(self.c.dictionary_db.cursor()))
+        numbers = dict((word, word_info.number) for word, word_info in word_infos.items())
+        self.assertEquals(numbers, {"googl": 2, "pag": 4, "internet": 1, 
+                                    "tactil": 1, "sour": 1}) # 2
+
+        self.assertEquals(sorted(word_info.index for word_info in word_infos.values()),
+                          range(5)) # 3
+        for word, index in indexes.items():
+            self.assertEquals(word_infos[word].index, index) # 4
+
+    def test_extend_text(self):
+        """ Tests extend_text.
+
+        Add a text and its vector to the classifier.
+        Extend the text of the vector with new words:
+         1- Verify if the number of text is unchanged.
+         2- Verify if only the new words are counted.
+
+        """
+        self.c.add_text(u"Google classe les pages")
+        self.c.add_vector("flux1", u"Google classe les pages", "SCIENCE")
+        self.c.extend_text("flux1", u"Google classe les écrans tactiles")
+
+        self.assertEquals(int(self.c.classifier_state_db.get("text_nb")), 1) # 1
+
+        words = dict(kc_util.gen_db(self.c.dictionary_db.cursor()))
+        self.assertEquals(words["googl"].number, 1) # 2
+        self.assertEquals(words["tactil"].number, 1) # 2
+
+    def test_rm_texts(self):
+        """ Tests rm_texts.
+
+        Add two texts and their vectors to the classifier.
+        Remove the text of the first vector:
+         1- Verify if the number of texts is decremented.
+         2- Verify if the words of both texts are counted once.
+         3- Verify if the words of the removed text only are removed.
+         4- Verify if a missing vector removes nothing.
+
+        """
+        self.c.add_texts([u"Google classe les pages", u"Google souris"])
+        self.c.add_vector("flux1", u"Google classe les pages", "SCIENCE")
+        self.c.add_vector("flux2", u"Google souris", "SCIENCE")
+
+        self.assertEquals(self.c.rm_texts(["flux1"]), 1)
+        self.assertEquals(int(self.c.classifier_state_db.get("text_nb")), 1) # 1
+
+        words = dict(kc_util.gen_db(self.c.dictionary_db.cursor()))
+        self.assertEquals(words["googl"].number, 1) # 2
+        self.assertEquals(sorted(words), ["googl", "sour"]) # 3
+
+        self.assertEquals(self.c.rm_texts(["flux3"]), 0) # 4
+
+    def test_watermark(self):
+        """ Tests set_watermark and get_watermark.
+
+         1- Verify if the watermark is 0 first.
+         2- Verify if the watermark stored is returned.
+
+        """
+        self.assertEquals(self.c.get_watermark(), 0) # 1
+
+        self.c.set_watermark(42)
+        self.assertEquals(self.c.get_watermark(), 42) # 2
+
     def test_set_idf(self):
         """ Tests set_idf.
 
@@ -590,6 +2050,7 @@ class TestClassifier(unittest.TestCase):
 
         Add a vector:
          2- Check if there is a vector.
+         3- Check the indexes are the ones of the words, sorted.
 
         """
         text, vector_1 = "foo", "foo_1"
@@ -603,6 +2064,12 @@ class TestClassifier(unittest.TestCase):
         vector = self.c.get_vector(vector_1)
         self.assertIsInstance(vector, Vector) # 2
 
+        self.c.add_text(u"Google classe les pages")
+        self.c.add_vector("foo_2", u"pages Google pages")
+        indexes = [word_info.index for word, word_info
+                   in kc_util.gen_db(self.c.dictionary_db.cursor()) if word in ("googl", "pag")]
+        self.assertEquals(list(self.c.get_vector("foo_2").indexes), sorted(indexes)) # 3
+
     def test_rm_vector(self):
         """ Tests rm_vector.
 
@@ -714,10 +2181,92 @@ class TestClassifier(unittest.TestCase):
         pass
 
     def test_scalar_product(self):
-        """ Test .
+        """ Tests scalar_product.
+
+        Create two vectors with two common words:
+         1- Verify the product of the weights of the common words.
 
         """
-        pass
+        u = Vector(array("i", [1, 2, 5]), array("d", [1., 1., 1.]),
+                   array("d", [0.5, 2., 1.]), "SPORT")
+        v = Vector(array("i", [2, 3, 5]), array("d", [1., 1., 1.]),
+                   array("d", [3., 4., 0.5]), "SPORT")
+
+        self.assertEquals(self.c.scalar_product(u, v), 2. * 3. + 1. * 0.5) # 1
+
+    def test_convert_dbs(self):
+        """ Tests convert_dbs.
+
+        Store a legacy vector:
+         1- Verify the vector is read with its word indexes.
+         2- Verify the legacy vector is converted.
+         3- Verify the record is a vector.
+
+        """
+        self.c.add_text(u"Google classe les pages")
+        self.c.set_idf()
+        legacy = LegacyVector([VectorItem(u"pag", 1.), VectorItem(u"googl", 0.5)], "SPORT")
+        self.c.vectors_db.set("old", codec.dumps(legacy))
+
+        word_infos = dict(kc_util.gen_db(self.c.dictionary_db.cursor()))
+        vector = self.c.get_vector("old")
+        self.assertEquals(sorted(zip(vector.indexes, vector.tfs)),
+                          sorted([(word_infos["pag"].index, 1.),
+                                  (word_infos["googl"].index, 0.5)])) # 1
+
+        self.assertEquals(self.c.convert_dbs(), 1) # 2
+        self.assertIsInstance(codec.loads(self.c.vectors_db.get("old")), Vector) # 3
+
+    def test_normalized(self):
+        """ Tests the normalized vectors.
+
+        Add two vectors and get their cosine similarity.
+
+        Normalize the vectors with set_idf:
+         1- Verify the norm of the vectors equals 1.
+         2- Verify the cosine similarity is the same.
+
+        """
+        texts = [u"Google classe les pages Internet", u"Google classe les sites",
+                 u"Le clip kitsch du couple"]
+        self.c.add_texts(texts)
+        self.c.set_idf()
+        self.c.add_vector("foo_1", texts[0])
+        self.c.add_vector("foo_2", texts[1])
+        self.c.set_tfidf_norm()
+        cosine = self.c.cosine_sim("foo_1", "foo_2")
+
+        self.c.normalized = True
+        self.c.set_idf()
+
+        for _, vector in self.c.get_vectors():
+            self.assertAlmostEquals(self.c.vector_tfidf_norm(vector), 1.) # 1
+
+        self.assertEquals(self.c.cosine_sim("foo_1", "foo_2"), cosine) # 2
+
+    def test_normalized_reopen(self):
+        """ Tests the conversion of normalized vectors.
+
+        Add vectors with normalized weights and reopen the classifier
+        without normalized weights:
+         1- Verify the cosine similarity.
+         2- Verify the neighbors.
+
+        """
+        texts = [u"Google classe les pages Internet", u"Google classe les sites",
+                 u"Le clip kitsch du couple"]
+        self.c.close()
+        self.c = Classifier(CleanTextUtil("french"), normalized=True)
+        self.c.add_texts(texts)
+        self.c.set_idf()
+        self.c.add_vector("foo_1", texts[0], "SPORT")
+        self.c.add_vector("foo_2", texts[1], "SPORT")
+        cosine = self.c.cosine_sim("foo_1", "foo_2")
+        self.c.close()
+
+        self.c = Classifier(CleanTextUtil("french"), normalized=False)
+        self.assertEquals(self.c.cosine_sim("foo_1", "foo_2"), cosine) # 1
+        self.assertEquals(self.c.kNN("foo_1", ["foo_2"]), [("SPORT", cosine)]) # 2
 
     def test_cosine_sim(self):
         """ Test .
@@ -726,10 +2275,61 @@ class TestClassifier(unittest.TestCase):
         pass
 
     def test_kNN(self):
-        """ Test .
+        """ Tests kNN.
+
+        Add tagged vectors:
+         1- Verify the neighbors are the ones of the cosine similarities.
+
+        Update a tag:
+         2- Verify the neighbor has the new tag.
+
+        Use the matrix engine:
+         3- Verify the neighbors are the same.
 
         """
-        pass
+        texts = [u"Google classe les pages Internet", u"Google classe les sites",
+                 u"Les pages Internet du couple", u"Le clip kitsch du couple"]
+        self.c.add_texts(texts)
+        self.c.set_idf()
+        for i, text in enumerate(texts):
+            self.c.add_vector("foo_%s" % i, text, "TAG_%s" % i)
+        self.c.set_tfidf_norm()
+
+        v_compares = ["foo_1", "foo_2", "foo_3"]
+        cosines = [(self.c.get_vector(name).tag, self.c.cosine_sim("foo_0", name))
+                   for name in v_compares]
+        cosines = sorted([tag_sim for tag_sim in cosines if tag_sim[1] > settings.MIN_COS_SINE],
+                         key=lambda tag_sim: tag_sim[1])
+        self.assertEquals(self.c.kNN("foo_0", v_compares), cosines[-settings.K_ITEM:]) # 1
+
+        self.c.update_vector_tag("foo_1", "SPORT")
+        neighbors = self.c.kNN("foo_0", v_compares)
+        self.assertIn("SPORT", [tag for tag, _ in neighbors]) # 2
+
+        self.c.postings = None
+        self.assertEquals(self.c.kNN("foo_0", v_compares), neighbors) # 3
+
+    def test_postings(self):
+        """ Tests the postings of the vectors.
+
+        Add two vectors:
+         1- Verify there is a posting by word of the vectors.
+
+        Remove a vector:
+         2- Verify its postings are removed.
+
+        """
+        texts = [u"Google classe les pages Internet", u"Le clip kitsch du couple"]
+        self.c.add_texts(texts)
+        self.c.set_idf()
+        self.c.add_vector("foo_1", texts[0])
+        self.c.add_vector("foo_2", texts[1])
+
+        lengths = [len(self.c.get_vector(name).indexes) for name in ["foo_1", "foo_2"]]
+        self.assertEquals(len(self.c.postings), sum(lengths)) # 1
+
+        self.c.rm_vector("foo_1")
+        self.assertEquals(len(self.c.postings), lengths[1]) # 2
 
     def test_get_category(self):
         """ Test .
@@ -755,6 +2355,111 @@ class TestClassifier(unittest.TestCase):
         """
         pass
 
+class TestKNNEngine(unittest.TestCase):
+    """ Tests the KNNEngine class.
+
+    """
+    def setUp(self):
+        self.u = Vector(array("i", [1, 2]), array("d", [1., 1.]), array("d", [1., 1.]), None)
+        self.vectors = {
+            "a": Vector(array("i", [1]), array("d", [1.]), array("d", [1.]), "A"),
+            "b": Vector(array("i", [2]), array("d", [1.]), array("d", [1.]), "B"),
+            "c": Vector(array("i", [1, 2]), array("d", [1., 1.]), array("d", [1., 1.]), "C"),
+            "d": Vector(array("i", [3]), array("d", [1.]), array("d", [1.]), "D"),
+            "e": Vector(array("i", [1, 3]), array("d", [1., 1.]), array("d", [1., 1.]), "E")}
+        self.norms = {"a": 1., "b": 1., "c": 2 ** 0.5, "d": 1., "e": 2 ** 0.5}
+        self.names = ["e", "a", "b", "c", "d", "missing"]
+
+    def test_kNN(self):
+        """ Tests kNN.
+
+        Load the vectors and their norms:
+         1- Verify the k-nearest neighbors sorted by similarity.
+         2- Verify the last vector is kept for equal similarities.
+         3- Verify the neighbors above the minimum similarity only.
+
+        """
+        engine = KNNEngine(self.names, self.vectors, self.norms, k=3)
+        self.assertEquals(engine.kNN(self.u, 2 ** 0.5),
+                          [("A", 0.71), ("B", 0.71), ("C", 1.)]) # 1
+
+        engine = KNNEngine(self.names, self.vectors, self.norms, k=2)
+        self.assertEquals(engine.kNN(self.u, 2 ** 0.5), [("B", 0.71), ("C", 1.)]) # 2
+
+        engine = KNNEngine(self.names, self.vectors, self.norms, k=5, min_sim=0.5)
+        self.assertEquals(engine.kNN(self.u, 2 ** 0.5),
+                          [("A", 0.71), ("B", 0.71), ("C", 1.)]) # 3
+
+    def test_normalized(self):
+        """ Tests kNN with normalized vectors.
+
+        Load the vectors without norm:
+         1- Verify the similarities are the scalar products.
+
+        """
+        engine = KNNEngine(["a", "c"], self.vectors, k=2)
+        self.assertEquals(engine.kNN(self.u), [("A", 1.), ("C", 2.)]) # 1
+
+    def test_covers(self):
+        """ Tests covers.
+
+        Load the vectors:
+         1- Verify a missing vector is covered.
+         2- Verify another vector is not covered.
+
+        """
+        engine = KNNEngine(self.names, self.vectors, self.norms)
+        self.assertTrue(engine.covers("missing")) # 1
+        self.assertFalse(engine.covers("f")) # 2
+
+class TestPostingsIndex(unittest.TestCase):
+    """ Tests the PostingsIndex class.
+
+    """
+    def setUp(self):
+        self.index = PostingsIndex()
+        self.u = Vector(array("i", [1, 2]), array("d", [1., 1.]), array("d", [0.5, 2.]), None)
+        self.a = Vector(array("i", [1, 3]), array("d", [1., 1.]), array("d", [0.1, 1.]), "A")
+        self.b = Vector(array("i", [2]), array("d", [1.]), array("d", [3.]), "B")
+        self.c = Vector(array("i", [4]), array("d", [1.]), array("d", [1.]), "C")
+
+    def tearDown(self):
+        self.index.close()
+        rm_data_dir()
+
+    def test_scores(self):
+        """ Tests scores.
+
+        Add three vectors:
+         1- Verify the scalar products of the vectors sharing words.
+
+        Update the weights of a vector:
+         2- Verify the new scalar product.
+
+        """
+        for name, vector in [("a", self.a), ("b", self.b), ("c", self.c)]:
+            self.index.add(name, vector)
+        self.assertEquals(self.index.scores(self.u), {"a": 0.5 * 0.1, "b": 2. * 3.}) # 1
+
+        self.b.weights = array("d", [1.])
+        self.index.add("b", self.b)
+        self.assertEquals(self.index.scores(self.u)["b"], 2.) # 2
+
+    def test_rm(self):
+        """ Tests rm.
+
+        Add two vectors and remove one:
+         1- Verify its postings are removed.
+         2- Verify the vector is not scored.
+
+        """
+        self.index.add("a", self.a)
+        self.index.add("b", self.b)
+        self.index.rm("a", self.a)
+
+        self.assertEquals(len(self.index), 1) # 1
+        self.assertEquals(self.index.scores(self.u).keys(), ["b"]) # 2
+
 ###########################################################################
 # Manager Test 
 ###########################################################################
@@ -770,6 +2475,7 @@ class TestManager(unittest.TestCase):
         self.feeds_info = Manager.get_feeds_info()
 
     def tearDown(self):
+        self.co.close()
         rm_data_dir()
 
     def test_add_feeds(self):
@@ -803,6 +2509,58 @@ class TestManager(unittest.TestCase):
         size = len([_ for _, _, _, _ in self.feeds_info])
         self.assertEquals(int(self.c.classifier_state_db.get("text_nb")), size) # 2
 
+    def test_update_texts_vectors(self):
+        """ Tests update_texts_vectors.
+
+        Add feeds.
+        Add texts vectors:
+         1- Check if nothing is updated without new events.
+
+        Add a new feed, remove a feed.
+        Update texts vectors:
+         2- Check if only the new feed is updated.
+         3- Check if the vector of the new feed exists.
+         4- Check if the vector of the removed feed doesn't exist anymore.
+         5- Check if the watermark is the last event.
+         6- Check if the text of the removed feed is not counted anymore.
+
+        Remove an item of a feed.
+        Update texts vectors:
+         7- Check if the feed is updated.
+         8- Check if the words are counted in the texts of the feeds only.
+
+        """
+        (name, url, tag, _), new_feed_info = self.feeds_info[0], self.feeds_info[-1]
+        for feed_info in self.feeds_info[:-1]:
+            self.co.add_feed(*feed_info)
+        self.m.add_texts_vectors()
+
+        self.assertEquals(self.m.update_texts_vectors(), 0) # 1
+
+        self.co.add_feed(*new_feed_info)
+        self.co.rm_feed(name)
+
+        self.assertEquals(self.m.update_texts_vectors(), 1) # 2
+        self.assertIsNotNone(self.c.get_vector(new_feed_info[0])) # 3
+        self.assertIsNone(self.c.get_vector(name)) # 4
+        self.assertEquals(self.c.get_watermark(), self.co.event_seq) # 5
+        self.assertEquals(int(self.c.classifier_state_db.get("text_nb")),
+                          len(self.c.get_vectors_name())) # 6
+
+        name = new_feed_info[0]
+        item_id, _ = self.co.get_items(name).next()
+        self.co.rm_items(name, [item_id])
+        self.assertEquals(self.m.update_texts_vectors(), 1) # 7
+
+        numbers = {}
+        for vector_name in self.c.get_vectors_name():
+            text = "".join(text for _, text in self.co.get_text_from_items(vector_name))
+            for word in set(self.c.clean_text_util.clean_text(text)):
+                numbers[word] = numbers.get(word, 0) + 1
+        self.assertEquals(dict((word, word_info.number) for word, word_info
+                               in kc_util.gen_db(self.c.dictionary_db.cursor())),
+                          numbers) # 8
+
     def test_add_general_feed(self):
 #TODO
         """ Test .
@@ -855,6 +2613,8 @@ class TestIndexer(unittest.TestCase):
         self.indexer = ind.Indexer(self.co)
 
     def tearDown(self):
+        self.indexer.close()
+        self.co.close()
         rm_data_dir()
 
     def test_add_feed(self):
@@ -899,6 +2659,59 @@ class TestIndexer(unittest.TestCase):
             with self.indexer.ix.searcher() as s:
                 self.assertEquals(len(s.search(query)), 1)
 
+    def test_update(self):
+        """ Tests update.
+
+        Add a feed to the collector.
+        Add feeds to the indexer.
+         1- Check if nothing is indexed without new events.
+
+        Add a new feed to the collector.
+        Update the indexer:
+         2- Check if the items of the new feed are indexed.
+         3- Check if the watermark is the last event.
+
+        Tag an item, remove another item and the first feed.
+        Update the indexer:
+         4- Check if the tagged item is indexed once with its tag.
+         5- Check if the removed item is not indexed anymore.
+         6- Check if the items of the removed feed are not indexed anymore.
+
+        """
+        feeds_info = Manager.get_feeds_info()
+        self.co.add_feed(*feeds_info[0])
+        self.indexer.add_feeds()
+
+        self.assertEquals(self.indexer.update(), 0) # 1
+
+        name = feeds_info[1][0]
+        self.co.add_feed(*feeds_info[1])
+        self.indexer.update()
+
+        for _, item in self.co.get_items(name):
+            if item.duplicate_of:
+                continue
+
+            query = self.indexer._Indexer__query("webpage_url", item.webpage_url)
+            with self.indexer.ix.searcher() as s:
+                self.assertEquals(len(s.search(query)), 1) # 2
+
+        self.assertEquals(self.indexer.get_watermark(), self.co.event_seq) # 3
+
+        feed = self.co.get_feed(name)
+        item_ids = [item_id for item_id, item in self.co.get_items(name)
+                    if not item.duplicate_of]
+        self.co.update_item_tag(feed.item_db_filename, item_ids[0], "SPORT", name)
+        self.co.rm_items(name, item_ids[1:2])
+        self.co.rm_feed(feeds_info[0][0])
+        self.indexer.update()
+
+        with self.indexer.ix.searcher() as s:
+            docs = list(s.documents(key=u"%s/%s" % (name, item_ids[0])))
+            self.assertEquals([doc["tag"] for doc in docs], [u"SPORT"]) # 4
+            self.assertEquals(list(s.documents(key=u"%s/%s" % (name, item_ids[1]))), []) # 5
+            self.assertEquals(list(s.documents(feed=unicode(feeds_info[0][0]))), []) # 6
+
     def test_rm_feed(self):
         """ Tests rm_feed.
 
@@ -1022,11 +2835,22 @@ OPT_ALL = "all  "
 OPTS = ["Collector", \
         "Feed", \
         "Item", \
+        "LanguageGuesser", \
+        "Fetcher", \
+        "ArticleExtractor", \
+        "Scheduler", \
+        "DuplicateIndex", \
+        "Retention", \
+        "Codec", \
+        "KyotoCabinetUtil", \
+        "Storage", \
         "CleanTextUtil", \
         "WordInfo", \
         "Vector", \
         "VectorItem", \
         "Classifier", \
+        "KNNEngine", \
+        "PostingsIndex", \
         "Manager", \
         "Indexer"]
 